@@ -0,0 +1,194 @@
+"""Admission control for PDF processing in request handlers.
+
+Filling (pdfrw) and rendering (a poppler process) are CPU-bound. Without a
+limit, a traffic spike starts all of them at once and every request slows
+down together. Here each process allows ``ADMISSION_PDF_SLOTS`` PDF
+operations at a time; further requests wait in a bounded queue per kind:
+
+* Fill requests wait in a queue of ``ADMISSION_FILL_QUEUE`` and render
+  requests in a queue of ``ADMISSION_RENDER_QUEUE``. A free slot always goes
+  to the oldest waiting fill before any render.
+* A request finding its queue full is rejected at once with 429, and one
+  that waited ``ADMISSION_MAX_WAIT_SECONDS`` without a slot with 503. Both
+  carry ``Retry-After``, estimated from the queue length and recent service
+  times.
+
+Queue depth (``queue_depth{queue="pdf_fill"|"pdf_render"}``), wait times and
+rejections are exported on ``/metrics``.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from flask import Flask, current_app
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FILL = 'fill'
+RENDER = 'render'
+# Kinds in the order free slots are handed out
+PRIORITY = (FILL, RENDER)
+# Weight of the latest sample in the service time averages
+SERVICE_TIME_ALPHA = 0.2
+
+
+class Overloaded(Exception):
+    """Exception raised when PDF work is not admitted.
+
+    Attributes:
+        kind: 'fill' or 'render'
+        status_code: 429 if the queue was full, 503 if the wait timed out
+        retry_after: Suggested seconds before retrying
+    """
+
+    def __init__(self, kind: str, status_code: int, retry_after: int):
+        reason = 'queue full' if status_code == 429 else 'timed out waiting'
+        super().__init__(f"Too many {kind} requests ({reason}), retry in {retry_after}s")
+        self.kind = kind
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """Counting semaphore with bounded, prioritized wait queues.
+
+    Args:
+        slots: PDF operations allowed at a time
+        queue_limits: Most waiting requests per kind
+        max_wait: Seconds a request waits for a slot before it is rejected
+    """
+
+    def __init__(self, slots: int, queue_limits: Dict[str, int], max_wait: float):
+        self.slots = slots
+        self.queue_limits = queue_limits
+        self.max_wait = max_wait
+        self._free = slots
+        self._waiting = {kind: deque() for kind in PRIORITY}
+        self._service_time = {kind: 1.0 for kind in PRIORITY}
+        self._cond = threading.Condition()
+
+    def _next_waiter(self) -> Optional[object]:
+        for kind in PRIORITY:
+            if self._waiting[kind]:
+                return self._waiting[kind][0]
+        return None
+
+    def _retry_after(self, kind: str) -> int:
+        # Requests ahead of a new one: waiting ones of this or higher priority
+        ahead = 0
+        for other in PRIORITY:
+            ahead += len(self._waiting[other])
+            if other == kind:
+                break
+        return max(1, math.ceil((ahead + 1) * self._service_time[kind] / self.slots))
+
+    def acquire(self, kind: str, max_wait: Optional[float] = None) -> float:
+        """Take a slot for ``kind``, waiting in its queue if none is free.
+
+        Returns:
+            Seconds waited
+
+        Raises:
+            Overloaded: If the queue is full or no slot became free in time
+        """
+        with self._cond:
+            if self._free > 0 and self._next_waiter() is None:
+                self._free -= 1
+                return 0.0
+            if len(self._waiting[kind]) >= self.queue_limits[kind]:
+                raise Overloaded(kind, 429, self._retry_after(kind))
+
+            token = object()
+            self._waiting[kind].append(token)
+            metrics.QUEUE_DEPTH.inc(queue=f"pdf_{kind}")
+            start = time.monotonic()
+            deadline = start + (self.max_wait if max_wait is None else max_wait)
+            try:
+                while not (self._free > 0 and self._next_waiter() is token):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Overloaded(kind, 503, self._retry_after(kind))
+                    self._cond.wait(remaining)
+                self._free -= 1
+                return time.monotonic() - start
+            finally:
+                self._waiting[kind].remove(token)
+                metrics.QUEUE_DEPTH.dec(queue=f"pdf_{kind}")
+                # The next waiter may be eligible now
+                self._cond.notify_all()
+
+    def release(self, kind: str, held_seconds: float) -> None:
+        """Return a slot taken for ``kind`` that was held for ``held_seconds``."""
+        with self._cond:
+            self._free += 1
+            self._service_time[kind] += SERVICE_TIME_ALPHA * (held_seconds - self._service_time[kind])
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, kind: str, max_wait: Optional[float] = None) -> Iterator[None]:
+        """Hold a slot for ``kind`` for the duration of the block."""
+        try:
+            waited = self.acquire(kind, max_wait)
+        except Overloaded as e:
+            metrics.ADMISSION_REJECTED.inc(kind=kind, status=str(e.status_code))
+            raise
+        metrics.ADMISSION_WAIT_SECONDS.observe(waited, kind=kind)
+        metrics.PDF_SLOTS_IN_USE.inc()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            metrics.PDF_SLOTS_IN_USE.dec()
+            self.release(kind, time.monotonic() - start)
+
+
+def init_app(app: Flask) -> None:
+    """Create the limiter for ``app``.
+
+    Reads ``ADMISSION_PDF_SLOTS`` (concurrent PDF operations per process,
+    defaults to the CPU count, 0 disables admission control),
+    ``ADMISSION_FILL_QUEUE`` (defaults to twice the slots),
+    ``ADMISSION_RENDER_QUEUE`` (defaults to the slots) and
+    ``ADMISSION_MAX_WAIT_SECONDS``.
+    """
+    slots = int(os.environ.get('ADMISSION_PDF_SLOTS', str(os.cpu_count() or 2)))
+    app.config.setdefault('ADMISSION_PDF_SLOTS', slots)
+    app.config.setdefault('ADMISSION_FILL_QUEUE', int(os.environ.get('ADMISSION_FILL_QUEUE', str(2 * slots))))
+    app.config.setdefault('ADMISSION_RENDER_QUEUE', int(os.environ.get('ADMISSION_RENDER_QUEUE', str(slots))))
+    app.config.setdefault('ADMISSION_MAX_WAIT_SECONDS', float(os.environ.get('ADMISSION_MAX_WAIT_SECONDS', '10')))
+
+    limiter = None
+    if app.config['ADMISSION_PDF_SLOTS'] > 0:
+        limiter = Limiter(
+            app.config['ADMISSION_PDF_SLOTS'],
+            {FILL: app.config['ADMISSION_FILL_QUEUE'], RENDER: app.config['ADMISSION_RENDER_QUEUE']},
+            app.config['ADMISSION_MAX_WAIT_SECONDS'],
+        )
+    app.extensions['admission'] = limiter
+
+
+@contextmanager
+def slot(kind: str, max_wait: Optional[float] = None) -> Iterator[None]:
+    """Hold a PDF processing slot of the current app for the block.
+
+    Args:
+        kind: FILL or RENDER
+        max_wait: Override of ``ADMISSION_MAX_WAIT_SECONDS``
+
+    Raises:
+        Overloaded: If the work is not admitted
+    """
+    limiter = current_app.extensions.get('admission')
+    if limiter is None:
+        yield
+        return
+    with limiter.slot(kind, max_wait):
+        yield
@@ -1,16 +1,39 @@
 import os
+import hmac
 import logging
+from contextlib import ExitStack
+from datetime import datetime
 from typing import Dict, Tuple, Any
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import BadRequest, NotFound
 import tempfile
+import time
 import uuid
 
+import click
+
+import admission
+import datasources
+import downloads
+import fieldtypes
+import jobs
+import metrics
+import migrations
+import profiling
+import retention
+import schema
+import storage
+import sweeper
+import uploads
+import versions
+import warmup
+import workqueue
+
 # Configure logging from environment variable
 log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
@@ -35,8 +58,11 @@ db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Stream uploaded files straight into the upload folder while hashing them
+app.request_class = uploads.UploadRequest
 
-# Enable CSRF protection
+# Enable CSRF protection (can be turned off with WTF_CSRF_ENABLED=false, e.g. for load tests)
+app.config["WTF_CSRF_ENABLED"] = os.environ.get("WTF_CSRF_ENABLED", "true").lower() not in ("0", "false", "no")
 try:
     from flask_wtf.csrf import CSRFProtect
     csrf = CSRFProtect(app)
@@ -44,9 +70,12 @@ except ImportError:
     logger.warning("flask_wtf not installed, CSRF protection disabled")
     csrf = None
 
-# Configure SQLite database
+# Secret that X-Profile / ?profile= must carry to profile a request (empty disables on-demand profiling)
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+
+# Configure the database, defaulting to the bundled SQLite file
 db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdf_forms.db')
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", f"sqlite:///{db_path}")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
@@ -54,17 +83,51 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Configure upload folder
-UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'pdf_uploads')
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", os.path.join(tempfile.gettempdir(), 'pdf_uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+# Uploads are streamed to disk, so raising the limit does not raise memory use
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "16")) * 1024 * 1024
 
 # Initialize the app with the extension
 db.init_app(app)
+# Shared storage backend for templates and generated files
+storage.init_app(app)
+# Worker pool for background field extraction
+jobs.init_app(app)
+# X-Sendfile / X-Accel-Redirect offload of downloads
+downloads.init_app(app)
+# Purging of deleted rows and orphan file sweeps
+sweeper.init_app(app)
+# Retention policies and the archive tier for filled outputs
+retention.init_app(app)
+# Fill and render jobs claimed by workers on any node
+workqueue.init_app(app)
+# Concurrency limit and bounded queues for PDF processing in requests
+admission.init_app(app)
+# Compiled field schemas of templates, cached per process
+schema.init_app(app)
+# Preloading of hot templates when a process starts
+warmup.init_app(app)
+# Background threads are only started from post_fork (set by gunicorn.conf.py), as a
+# preloaded app is imported in the master, whose threads the forked workers would not have
+app.config['BACKGROUND_DEFERRED'] = os.environ.get('BACKGROUND_DEFERRED', '').lower() in ('1', 'true', 'yes')
+
+
+def start_background(app: Flask) -> None:
+    """Start the background threads of this process.
+
+    These are the embedded job worker and the periodic sweeps and
+    compactions; warm-up is started separately. Call once per process,
+    once the tables exist.
+    """
+    workqueue.start_workers(app)
+    sweeper.start(app)
+    retention.start(app)
 
 # Helper functions
 def delete_file_safely(filepath: str) -> bool:
-    """Safely delete a file, logging warnings if it fails.
+    """Safely delete a file and its stored copy, logging warnings if it fails.
 
     Args:
         filepath: Path to the file to delete
@@ -72,6 +135,7 @@ def delete_file_safely(filepath: str) -> bool:
     Returns:
         bool: True if successful or file doesn't exist, False if deletion failed
     """
+    storage.remove(filepath)
     if not filepath or not os.path.exists(filepath):
         return True
 
@@ -84,26 +148,75 @@ def delete_file_safely(filepath: str) -> bool:
         return False
 
 
+@app.before_request
+def _start_request_timer() -> None:
+    """Record the request start time for the HTTP metrics."""
+    g.request_started = time.perf_counter()
+    metrics.HTTP_IN_FLIGHT.inc()
+
+
+@app.after_request
+def _record_response_status(response):
+    """Remember the response status for the HTTP metrics."""
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _record_request_metrics(exc: Exception = None) -> None:
+    """Observe request duration and status once the request is finished."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    metrics.HTTP_IN_FLIGHT.dec()
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(g.pop('response_status', 500)))
+
+
+def profiling_requested() -> bool:
+    """Return True if the current request asks for a profile.
+
+    Profiling is requested with an ``X-Profile`` header or a ``profile``
+    query parameter carrying ``PROFILE_TOKEN``; without a token configured,
+    requests cannot ask for it. Requests may also be selected by
+    ``PROFILE_SAMPLE_RATE``.
+    """
+    token = app.config['PROFILE_TOKEN']
+    flag = request.headers.get('X-Profile') or request.args.get('profile') or ''
+    requested = bool(token) and hmac.compare_digest(flag.encode(), token.encode())
+    return profiling.should_profile(requested)
+
+
 # Import routes after app is initialized to avoid circular imports
 with app.app_context():
     from models import PDFTemplate, FormField, FilledForm
     import pdf_processor
 
-    # Create database tables
+    # Create database tables and add columns introduced since they were created
     db.create_all()
+    migrations.add_missing_columns(db.engine, db.metadata)
+    if not app.config['BACKGROUND_DEFERRED']:
+        start_background(app)
+    if not app.config['WARMUP_DEFERRED']:
+        warmup.start(app)
 
     @app.route('/')
     def index():
         """Home page showing options to upload a PDF or fill out an existing template."""
-        templates = PDFTemplate.query.all()
+        templates = PDFTemplate.query.filter_by(deleted_at=None, superseded_at=None).all()
         return render_template('index.html', templates=templates)
 
     @app.route('/upload', methods=['POST'])
     def upload_pdf() -> Tuple[str, int]:
         """Handle PDF template upload.
 
-        Validates the uploaded file, extracts form fields, and stores the
-        template and field information in the database.
+        Validates the uploaded file and stores the template in processing
+        state. Form fields are extracted by a background job.
+
+        With a ``supersedes`` template ID the file is stored as a new version
+        of that template. If it is identical to that version, its fields are
+        copied and nothing is extracted.
 
         Returns:
             Redirect response to either fill_form or index page
@@ -121,6 +234,16 @@ with app.app_context():
             flash('Only PDF files are allowed', 'danger')
             return redirect(url_for('index'))
 
+        previous = None
+        if request.form.get('supersedes'):
+            try:
+                previous = PDFTemplate.get_active_or_404(int(request.form['supersedes']))
+            except ValueError:
+                raise BadRequest('Invalid template ID')
+            if previous.superseded_at is not None:
+                flash('Only the latest version of a template can be replaced', 'warning')
+                return redirect(url_for('fill_form', template_id=previous.id))
+
         # Generate a unique filename to avoid collisions
         original_filename = secure_filename(file.filename)
         unique_id = str(uuid.uuid4())
@@ -128,47 +251,58 @@ with app.app_context():
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
         try:
-            # Save the uploaded file
-            file.save(filepath)
-
-            # Extract form fields from the PDF
-            template_name = request.form.get('template_name', original_filename).strip()
-            if not template_name:
-                template_name = original_filename
-
+            # Move the streamed upload into place after checking its PDF markers
             try:
-                fields = pdf_processor.extract_form_fields(filepath)
-            except Exception as e:
-                delete_file_safely(filepath)
-                logger.error(f"Error extracting form fields: {str(e)}")
-                flash(f'Error reading PDF: {str(e)}', 'danger')
+                upload = uploads.save_upload(file, filepath)
+            except uploads.InvalidPDFError as e:
+                flash(f'Invalid PDF file: {str(e)}', 'danger')
                 return redirect(url_for('index'))
 
-            if not fields:
+            # Reject files without an interactive form before a full parse
+            if pdf_processor.check_acroform(filepath) is False:
                 delete_file_safely(filepath)
                 flash('No form fields found in the PDF', 'warning')
                 return redirect(url_for('index'))
 
-            # Save template information to the database
+            storage.publish(filepath)
+
+            template_name = request.form.get('template_name', '').strip()
+            if not template_name:
+                template_name = previous.name if previous is not None else original_filename
+
+            # Save the template now and extract its form fields in the background
             template = PDFTemplate(
                 name=template_name,
                 file_path=filepath,
-                original_filename=original_filename
+                original_filename=original_filename,
+                sha256=upload.sha256,
+                status=PDFTemplate.STATUS_PROCESSING,
+                processing_started_at=datetime.utcnow()
             )
+            if previous is not None:
+                template.supersedes_id = previous.id
+                template.version = (previous.version or 1) + 1
+                # Retention settings carry over to the new version
+                template.retention_days = previous.retention_days
+                template.retention_max_forms = previous.retention_max_forms
+                template.retention_max_bytes = previous.retention_max_bytes
             db.session.add(template)
-            db.session.flush()  # Get the ID without committing
-
-            # Add form fields to the database
-            for field_name in fields:
-                form_field = FormField(
-                    template_id=template.id,
-                    field_name=field_name
-                )
-                db.session.add(form_field)
+            db.session.flush()
+
+            if previous is not None and previous.is_ready and previous.sha256 == upload.sha256:
+                # Same file as the version it replaces: reuse its fields
+                count = versions.copy_all_fields(template, previous)
+                template.status = PDFTemplate.STATUS_READY
+                template.schema_version = 1
+                versions.mark_superseded(template)
+                db.session.commit()
+                logger.info(f"Template {template.id} v{template.version} is identical to v{previous.version}, "
+                            f"copied {count} fields")
+            else:
+                db.session.commit()
+                jobs.submit_extraction(app, template.id, profile=profiling_requested())
+                logger.info(f"Uploaded template {template.id}: {template_name}, extracting fields in the background")
 
-            db.session.commit()
-
-            logger.info(f"Successfully uploaded template: {template_name} with {len(fields)} fields")
             flash(f'Successfully uploaded template: {template_name}', 'success')
             return redirect(url_for('fill_form', template_id=template.id))
 
@@ -182,16 +316,95 @@ with app.app_context():
     @app.route('/template/<int:template_id>')
     def fill_form(template_id):
         """Show the form to fill out for a specific template."""
-        template = PDFTemplate.query.get_or_404(template_id)
-        fields = FormField.query.filter_by(template_id=template_id).all()
-        return render_template('form.html', template=template, fields=fields)
+        template = PDFTemplate.get_active_or_404(template_id)
+        if template.superseded_at is not None:
+            current = versions.latest(template)
+            if current.id != template.id:
+                flash(f'Template {template.name} was replaced by version {current.version}', 'info')
+                return redirect(url_for('fill_form', template_id=current.id))
+        compiled = schema.for_template(template) if template.is_ready else None
+        return render_template('form.html', template=template, schema=compiled,
+                               can_retry=template.status == PDFTemplate.STATUS_FAILED or jobs.is_stale(template))
+
+    @app.route('/template/<int:template_id>/retention', methods=['POST'])
+    def update_retention(template_id: int) -> Tuple[str, int]:
+        """Update the retention policy of a template.
+
+        Empty fields fall back to the app-wide defaults.
+
+        Args:
+            template_id: ID of the template to update
+
+        Returns:
+            Redirect response to fill_form page
+        """
+        template = PDFTemplate.get_active_or_404(template_id)
+
+        try:
+            values = {}
+            for field in ('retention_days', 'retention_max_forms', 'retention_max_mb'):
+                raw = request.form.get(field, '').strip()
+                values[field] = int(raw) if raw else None
+                if values[field] is not None and values[field] < 0:
+                    raise ValueError(f"{field} must not be negative")
+        except ValueError as e:
+            flash(f'Invalid retention policy: {str(e)}', 'danger')
+            return redirect(url_for('fill_form', template_id=template_id))
+
+        template.retention_days = values['retention_days']
+        template.retention_max_forms = values['retention_max_forms']
+        max_mb = values['retention_max_mb']
+        template.retention_max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None
+        db.session.commit()
+
+        flash('Retention policy updated', 'success')
+        return redirect(url_for('fill_form', template_id=template_id))
+
+    @app.route('/template/<int:template_id>/status')
+    def template_status(template_id: int):
+        """Report the field extraction status of a template as JSON."""
+        template = PDFTemplate.get_active_or_404(template_id)
+        return jsonify({
+            'id': template.id,
+            'status': template.status or PDFTemplate.STATUS_READY,
+            'attempts': template.attempts or 0,
+            'error': template.error_message,
+            'field_count': FormField.query.filter_by(template_id=template_id).count(),
+        })
+
+    @app.route('/template/<int:template_id>/retry', methods=['POST'])
+    def retry_extraction(template_id: int) -> Tuple[str, int]:
+        """Queue field extraction again for a failed or stalled template.
+
+        Args:
+            template_id: ID of the template to process
+
+        Returns:
+            Redirect response to fill_form page
+        """
+        template = PDFTemplate.get_active_or_404(template_id)
+        if template.status != PDFTemplate.STATUS_FAILED and not jobs.is_stale(template):
+            flash('Form fields are not being retried for this template', 'warning')
+            return redirect(url_for('fill_form', template_id=template_id))
+
+        template.status = PDFTemplate.STATUS_PROCESSING
+        template.attempts = 0
+        template.error_message = None
+        template.processing_started_at = datetime.utcnow()
+        db.session.commit()
+        jobs.submit_extraction(app, template.id)
+
+        flash('Retrying form field extraction', 'info')
+        return redirect(url_for('fill_form', template_id=template_id))
 
     @app.route('/submit_form/<int:template_id>', methods=['POST'])
     def submit_form(template_id: int) -> Tuple[str, int]:
         """Submit filled form data.
 
         Validates form data, fills the PDF template, generates a PNG preview,
-        and stores the result in the database.
+        and stores the result in the database. With ``FILL_MODE`` or
+        ``RENDER_MODE`` set to ``queue``, filling or rendering is left to a
+        job claimed by a worker.
 
         Args:
             template_id: ID of the PDF template to fill
@@ -199,98 +412,198 @@ with app.app_context():
         Returns:
             Redirect response to view_pdfs or fill_form page
         """
-        template = PDFTemplate.query.get_or_404(template_id)
-
-        # Create a filled form record
-        filled_form = FilledForm(template_id=template_id)
-        db.session.add(filled_form)
-        db.session.flush()  # Get the ID without committing
-
-        # Get all form fields for this template
-        fields = FormField.query.filter_by(template_id=template_id).all()
-
-        # Prepare field data dictionary
-        field_data = {}
-        for field in fields:
-            value = request.form.get(field.field_name, '').strip()
-            field_data[field.field_name] = value
+        template = PDFTemplate.get_active_or_404(template_id)
+        if not template.is_ready:
+            flash('Form fields of this template are not ready yet', 'warning')
+            return redirect(url_for('fill_form', template_id=template_id))
 
+        # Read the value of every field of the template
         try:
-            # Fill the PDF with the form data
-            output_pdf_path = os.path.join(
-                app.config['UPLOAD_FOLDER'],
-                f"filled_{filled_form.id}_{secure_filename(template.original_filename)}"
-            )
-
-            try:
-                pdf_processor.fill_pdf_form(template.file_path, field_data, output_pdf_path)
-            except Exception as e:
-                logger.error(f"Error filling PDF: {str(e)}", exc_info=True)
-                raise PDFProcessingError(f"Failed to fill PDF: {str(e)}")
+            field_data = schema.for_template(template).extract(request.form)
+        except fieldtypes.FieldValueError as e:
+            invalid = ', '.join(name for _, name, _ in e.errors)
+            flash(f'Invalid value for: {invalid}', 'danger')
+            return redirect(url_for('fill_form', template_id=template_id))
 
-            # Convert PDF to PNG
-            png_path = output_pdf_path.replace('.pdf', '.png')
+        # Wait for a fill slot before writing to the database, so queued
+        # requests hold no database lock; rejections raise Overloaded
+        fill_slot = ExitStack()
+        if app.config['FILL_MODE'] != 'queue':
+            fill_slot.enter_context(admission.slot(admission.FILL))
+
+        with fill_slot:
+            # Create a filled form record
+            filled_form = FilledForm(template_id=template_id)
+            db.session.add(filled_form)
+            with metrics.SUBMIT_STAGE_SECONDS.time(stage='db_flush'):
+                db.session.flush()  # Get the ID without committing
+
+            filled_form.assign_output_paths(template, app.config['UPLOAD_FOLDER'])
+            output_pdf_path = filled_form.pdf_path
+            png_path = filled_form.png_path
+            profile_path = output_pdf_path.replace('.pdf', '_profile.txt')
+
+            if app.config['FILL_MODE'] == 'queue':
+                filled_form.status = FilledForm.STATUS_FILLING
+                filled_form.set_data(field_data)
+                workqueue.enqueue('fill', {'filled_form_id': filled_form.id})
+                with metrics.SUBMIT_STAGE_SECONDS.time(stage='commit'):
+                    db.session.commit()
+                logger.info(f"Queued filling of form {filled_form.id} from template {template_id}")
+                flash('Form submitted, the PDF is being generated', 'success')
+                return redirect(url_for('view_pdfs'))
+
+            render_queued = app.config['RENDER_MODE'] == 'queue'
             try:
-                pdf_processor.convert_pdf_to_png(output_pdf_path, png_path)
+                if not storage.fetch(template.file_path):
+                    raise PDFProcessingError('Template file is missing from storage')
+
+                label = f"submit_form template={template_id} form={filled_form.id}"
+                with profiling.session(label, profiling_requested()) as profile:
+                    # Fill the PDF with the form data
+                    try:
+                        with metrics.SUBMIT_STAGE_SECONDS.time(stage='fill'):
+                            pdf_processor.fill_pdf_form(template.file_path, field_data, output_pdf_path)
+                    except Exception as e:
+                        logger.error(f"Error filling PDF: {str(e)}", exc_info=True)
+                        raise PDFProcessingError(f"Failed to fill PDF: {str(e)}")
+                    finally:
+                        fill_slot.close()
+
+                    # Convert PDF to PNG
+                    try:
+                        if not render_queued:
+                            with admission.slot(admission.RENDER), metrics.SUBMIT_STAGE_SECONDS.time(stage='render'):
+                                pdf_processor.render_preview(output_pdf_path, png_path, template.file_path, field_data)
+                    except admission.Overloaded as e:
+                        # The preview is rendered on its first download instead
+                        logger.info(f"Skipped preview of form {filled_form.id}: {str(e)}")
+                    except Exception as e:
+                        logger.warning(f"Error converting PDF to PNG: {str(e)}", exc_info=True)
+                        # Don't fail completely if PNG conversion fails
+
+                # Update the filled form record with digests and data
+                filled_form.pdf_sha256 = uploads.file_sha256(output_pdf_path)
+                if os.path.exists(png_path):
+                    filled_form.png_sha256 = uploads.file_sha256(png_path)
+                filled_form.profile_path = profile.write(profile_path) if profile else None
+                filled_form.set_data(field_data)  # Store as JSON
+                with metrics.SUBMIT_STAGE_SECONDS.time(stage='store'):
+                    for path in (output_pdf_path, png_path, filled_form.profile_path):
+                        storage.publish(path)
+                if render_queued:
+                    filled_form.status = FilledForm.STATUS_RENDERING
+                    workqueue.enqueue('render', {'filled_form_id': filled_form.id})
+                with metrics.SUBMIT_STAGE_SECONDS.time(stage='commit'):
+                    db.session.commit()
+
+                logger.info(f"Successfully filled form {filled_form.id} from template {template_id}")
+                flash('Form filled successfully!', 'success')
+                return redirect(url_for('view_pdfs'))
+
+            except PDFProcessingError as e:
+                db.session.rollback()
+                delete_file_safely(output_pdf_path)
+                delete_file_safely(png_path)
+                delete_file_safely(profile_path)
+                flash(str(e), 'danger')
+                return redirect(url_for('fill_form', template_id=template_id))
             except Exception as e:
-                logger.warning(f"Error converting PDF to PNG: {str(e)}", exc_info=True)
-                # Don't fail completely if PNG conversion fails
-
-            # Update the filled form record with file paths and data
-            filled_form.pdf_path = output_pdf_path
-            filled_form.png_path = png_path
-            filled_form.set_data(field_data)  # Store as JSON
-            db.session.commit()
-
-            logger.info(f"Successfully filled form {filled_form.id} from template {template_id}")
-            flash('Form filled successfully!', 'success')
-            return redirect(url_for('view_pdfs'))
-
-        except PDFProcessingError as e:
-            db.session.rollback()
-            delete_file_safely(output_pdf_path)
-            delete_file_safely(png_path)
-            flash(str(e), 'danger')
-            return redirect(url_for('fill_form', template_id=template_id))
-        except Exception as e:
-            db.session.rollback()
-            delete_file_safely(output_pdf_path)
-            delete_file_safely(png_path)
-            logger.error(f"Unexpected error filling form: {str(e)}", exc_info=True)
-            flash(f'An unexpected error occurred: {str(e)}', 'danger')
-            return redirect(url_for('fill_form', template_id=template_id))
+                db.session.rollback()
+                delete_file_safely(output_pdf_path)
+                delete_file_safely(png_path)
+                delete_file_safely(profile_path)
+                logger.error(f"Unexpected error filling form: {str(e)}", exc_info=True)
+                flash(f'An unexpected error occurred: {str(e)}', 'danger')
+                return redirect(url_for('fill_form', template_id=template_id))
 
     @app.route('/pdfs')
     def view_pdfs():
         """View all filled PDFs."""
-        filled_forms = FilledForm.query.order_by(FilledForm.created_at.desc()).all()
+        filled_forms = FilledForm.query.filter_by(deleted_at=None).order_by(FilledForm.created_at.desc()).all()
         return render_template('pdfs.html', filled_forms=filled_forms)
 
     @app.route('/download/<int:form_id>/<filetype>')
     def download_file(form_id, filetype):
-        """Download filled PDF or PNG."""
-        filled_form = FilledForm.query.get_or_404(form_id)
-        
+        """Download filled PDF or PNG.
+
+        Responses carry a strong ETag from the content digest and support
+        conditional and range requests. Links with a ``v`` parameter matching
+        the current content version are cacheable as immutable, and
+        ``inline=1`` serves the file for display instead of as attachment.
+        PDFs moved to the archive tier are restored and dropped previews are
+        rendered again first; files missing locally are fetched from the
+        storage backend.
+        """
+        filled_form = FilledForm.get_active_or_404(form_id)
+        if not filled_form.has_pdf:
+            flash('This form has not been generated yet' if filled_form.status == FilledForm.STATUS_FILLING
+                  else 'Generating this form failed', 'warning')
+            return redirect(url_for('view_pdfs'))
+
+        try:
+            if filetype == 'pdf':
+                retention.restore_pdf(filled_form)
+            elif filetype == 'png' and retention.regenerate_png(filled_form):
+                if filled_form.png_sha256 is None:
+                    filled_form.png_sha256 = uploads.file_sha256(filled_form.png_path)
+                    db.session.commit()
+        except admission.Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"Error restoring files of filled form {form_id}: {str(e)}", exc_info=True)
+
         if filetype == 'pdf':
             filepath = filled_form.pdf_path
             mimetype = 'application/pdf'
         elif filetype == 'png':
             filepath = filled_form.png_path
             mimetype = 'image/png'
+        elif filetype == 'profile':
+            filepath = filled_form.profile_path
+            mimetype = 'text/plain'
         else:
             flash('Invalid file type', 'danger')
             return redirect(url_for('view_pdfs'))
-        
-        if not os.path.exists(filepath):
+
+        if not storage.fetch(filepath):
             flash('File not found', 'danger')
             return redirect(url_for('view_pdfs'))
-        
+
+        etag = None
+        if filetype in ('pdf', 'png'):
+            digest_attr = f"{filetype}_sha256"
+            etag = getattr(filled_form, digest_attr)
+            if etag is None:
+                # Forms filled before digests were recorded
+                etag = uploads.file_sha256(filepath)
+                setattr(filled_form, digest_attr, etag)
+                db.session.commit()
+
+        version = request.args.get('v')
+        immutable = bool(version) and version == filled_form.file_version(filetype)
+        inline = request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+
         filename = os.path.basename(filepath)
-        return send_file(filepath, mimetype=mimetype, as_attachment=True, download_name=filename)
+        return downloads.send_stored_file(filepath, mimetype, filename, etag=etag,
+                                          as_attachment=not inline, immutable=immutable)
+
+    @app.route('/template/<int:template_id>/profile')
+    def download_template_profile(template_id: int):
+        """Download the field extraction profile captured for a template upload."""
+        template = PDFTemplate.get_active_or_404(template_id)
+        if not storage.fetch(template.profile_path):
+            flash('No profile was captured for this template', 'warning')
+            return redirect(url_for('fill_form', template_id=template_id))
+        return downloads.send_stored_file(template.profile_path, 'text/plain',
+                                          os.path.basename(template.profile_path))
 
     @app.route('/delete_template/<int:template_id>', methods=['POST'])
     def delete_template(template_id: int) -> Tuple[str, int]:
-        """Delete a PDF template and its associated files.
+        """Delete a PDF template, its older versions and their filled forms.
+
+        The templates and their filled forms are only marked as deleted here;
+        rows and files are removed by a background purge job.
 
         Args:
             template_id: ID of the template to delete
@@ -298,28 +611,24 @@ with app.app_context():
         Returns:
             Redirect response to index page
         """
-        template = PDFTemplate.query.get_or_404(template_id)
+        template = PDFTemplate.get_active_or_404(template_id)
 
         try:
-            # Delete the template file
-            delete_file_safely(template.file_path)
-
-            # Delete associated filled forms
-            filled_forms = FilledForm.query.filter_by(template_id=template_id).all()
-            for form in filled_forms:
-                # Delete filled form files
-                delete_file_safely(form.pdf_path)
-                delete_file_safely(form.png_path)
-                db.session.delete(form)
-
-            # Delete form fields (cascade handled by relationship, but explicit for clarity)
-            FormField.query.filter_by(template_id=template_id).delete()
-
-            # Delete the template record
-            db.session.delete(template)
+            now = datetime.utcnow()
+            # Older versions go along with the template
+            deleted_ids = []
+            for version in versions.history(template):
+                if version.deleted_at is None:
+                    version.deleted_at = now
+                    deleted_ids.append(version.id)
+            FilledForm.query.filter(FilledForm.template_id.in_(deleted_ids), FilledForm.deleted_at.is_(None)).update(
+                {FilledForm.deleted_at: now}, synchronize_session=False
+            )
             db.session.commit()
+            for deleted_id in deleted_ids:
+                jobs.submit_purge(app, deleted_id)
 
-            logger.info(f"Successfully deleted template {template_id}: {template.name}")
+            logger.info(f"Deleted template {template_id}: {template.name}, purging in the background")
             flash('Template deleted successfully', 'success')
         except Exception as e:
             db.session.rollback()
@@ -330,7 +639,10 @@ with app.app_context():
 
     @app.route('/delete_filled_form/<int:form_id>', methods=['POST'])
     def delete_filled_form(form_id: int) -> Tuple[str, int]:
-        """Delete a filled form and its associated files.
+        """Delete a filled form.
+
+        The form is marked as deleted and purged with its files in the
+        background.
 
         Args:
             form_id: ID of the filled form to delete
@@ -338,18 +650,14 @@ with app.app_context():
         Returns:
             Redirect response to view_pdfs page
         """
-        filled_form = FilledForm.query.get_or_404(form_id)
+        filled_form = FilledForm.get_active_or_404(form_id)
 
         try:
-            # Delete files if they exist
-            delete_file_safely(filled_form.pdf_path)
-            delete_file_safely(filled_form.png_path)
-
-            # Delete the database record
-            db.session.delete(filled_form)
+            filled_form.deleted_at = datetime.utcnow()
             db.session.commit()
+            jobs.submit_purge(app)
 
-            logger.info(f"Successfully deleted filled form {form_id}")
+            logger.info(f"Deleted filled form {form_id}, purging in the background")
             flash('Filled form deleted successfully', 'success')
         except Exception as e:
             db.session.rollback()
@@ -358,6 +666,84 @@ with app.app_context():
 
         return redirect(url_for('view_pdfs'))
 
+    @app.route('/metrics')
+    def metrics_endpoint() -> Response:
+        """Expose the process metrics in the Prometheus text format."""
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    @app.cli.command('sweep')
+    @click.option('--dry-run', is_flag=True, help='Only report orphaned files, do not remove anything.')
+    def sweep_command(dry_run: bool) -> None:
+        """Purge deleted rows and remove orphaned files from the upload folder."""
+        result = sweeper.run(dry_run=dry_run)
+        action = 'would be removed' if dry_run else 'removed'
+        click.echo(
+            f"{result.scanned} files scanned, {result.removed} {action} "
+            f"({result.bytes_removed / (1024 * 1024):.1f} MB), {result.kept_recent} recent files kept, "
+            f"{result.errors} errors"
+        )
+
+    @app.cli.command('compact')
+    @click.option('--template-id', type=int, help='Only compact this template.')
+    def compact_command(template_id: int) -> None:
+        """Apply retention policies: drop old previews and archive old PDFs."""
+        if template_id is not None:
+            result = retention.compact_template(template_id)
+        else:
+            result = retention.compact_all()
+        click.echo(
+            f"{result.previews_dropped} previews dropped, {result.pdfs_archived} PDFs archived, "
+            f"{result.bytes_freed / (1024 * 1024):.1f} MB freed, {result.errors} errors"
+        )
+
+    @app.cli.command('worker')
+    @click.option('--queue', 'queues', multiple=True, type=click.Choice(sorted(workqueue.HANDLERS)),
+                  help='Queue to take jobs from (repeatable, default: all).')
+    @click.option('--concurrency', type=int, default=1, show_default=True, help='Jobs run at the same time.')
+    @click.option('--burst', is_flag=True, help='Exit once no job is due.')
+    def worker_command(queues: Tuple[str, ...], concurrency: int, burst: bool) -> None:
+        """Claim and run fill and render jobs until interrupted."""
+        import signal
+
+        worker = workqueue.Worker(app, list(queues) or sorted(workqueue.HANDLERS), concurrency=concurrency)
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            ran = worker.run(burst=burst)
+        except KeyboardInterrupt:
+            worker.stop()
+            ran = None
+        if ran is not None:
+            click.echo(f"{ran} jobs run")
+
+    @app.cli.command('fill-batch')
+    @click.argument('template_id', type=int)
+    @click.argument('source', required=False)
+    @click.option('--format', 'fmt', type=click.Choice(datasources.FORMATS),
+                  help='Source format (default: from the file extension, sql with --query).')
+    @click.option('--query', help='SQL query to read rows from; SOURCE is then a database URL (default: the app database).')
+    @click.option('--map', 'mappings', multiple=True, metavar='FIELD=COLUMN',
+                  help='Take FIELD from COLUMN (repeatable). Other fields take the column of the same name.')
+    @click.option('--mapping-file', type=click.Path(exists=True, dir_okay=False),
+                  help='JSON object of field name to column.')
+    @click.option('--chunk-size', type=click.IntRange(min=1), default=datasources.DEFAULT_CHUNK_SIZE,
+                  show_default=True, help='Rows read and stored per transaction.')
+    @click.option('--queue/--inline', 'queue', default=None,
+                  help='Queue fill jobs for `flask worker`, or fill here (default: from FILL_MODE).')
+    @click.option('--strict', is_flag=True, help='Stop at the first chunk with an invalid row instead of skipping it.')
+    def fill_batch_command(template_id: int, source: str, fmt: str, query: str, mappings: Tuple[str, ...],
+                           mapping_file: str, chunk_size: int, queue: bool, strict: bool) -> None:
+        """Fill TEMPLATE_ID once per row of a CSV, JSON Lines or SQL source."""
+        try:
+            chunks = datasources.open_source(source, fmt, query, chunk_size)
+            mapping = datasources.parse_mapping(mappings, mapping_file)
+            result = datasources.fill_batch(template_id, chunks, mapping, queue=queue, skip_invalid=not strict)
+        except (datasources.DataSourceError, fieldtypes.FieldValueError) as e:
+            raise click.ClickException(str(e))
+        click.echo(
+            f"{result.rows} rows read: {result.queued} forms queued, {result.filled} filled, "
+            f"{result.invalid} invalid rows skipped, {result.failed} failed"
+        )
+
     @app.errorhandler(404)
     def page_not_found(e: Exception) -> Tuple[str, int]:
         """Handle 404 errors.
@@ -371,6 +757,35 @@ with app.app_context():
         logger.warning(f"404 error: {str(e)}")
         return render_template('base.html', error="Page not found"), 404
 
+    @app.errorhandler(413)
+    def request_too_large(e: Exception):
+        """Handle uploads larger than MAX_CONTENT_LENGTH.
+
+        Args:
+            e: The exception that triggered the error
+
+        Returns:
+            Redirect response to index page
+        """
+        limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+        logger.warning(f"Rejected upload larger than {limit_mb} MB")
+        flash(f'File too large (maximum {limit_mb} MB)', 'danger')
+        return redirect(url_for('index'))
+
+    @app.errorhandler(admission.Overloaded)
+    def overloaded(e: admission.Overloaded) -> Tuple[str, int]:
+        """Reject PDF work that admission control did not admit.
+
+        Args:
+            e: The rejection, carrying the status code and retry delay
+
+        Returns:
+            Error page with 429 or 503 status code and a Retry-After header
+        """
+        logger.warning(f"Rejected request: {str(e)}")
+        message = 'The server is busy, please try again in a few seconds'
+        return render_template('base.html', error=message), e.status_code, {'Retry-After': str(e.retry_after)}
+
     @app.errorhandler(500)
     def server_error(e: Exception) -> Tuple[str, int]:
         """Handle 500 errors.
@@ -0,0 +1,255 @@
+"""ASGI entry point: serves the Flask app on an event loop.
+
+Run with an ASGI server, e.g.::
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Under a WSGI server every connection holds a worker thread for as long as it
+lasts, so slow clients uploading or downloading large PDFs use up the
+workers. Here the event loop does the network I/O instead:
+
+* Request bodies are received asynchronously into a spooled temporary file
+  (kept in memory up to ``ASGI_SPOOL_MB``), so the Flask view only runs once
+  the whole upload has arrived.
+* Views run in bounded thread pools: ``ASGI_CPU_ENDPOINTS`` (the views doing
+  ``pdf_processor`` work) in a pool of ``ASGI_CPU_THREADS``, all others
+  (downloads, listings, status polling) in a pool of ``ASGI_IO_THREADS``.
+* Response bodies are sent chunk by chunk; a thread is only used to read
+  each chunk from disk, never while waiting for a slow client.
+
+A pool thread is therefore only busy while a view actually runs, and the
+number of open connections is bounded by the event loop rather than by the
+thread count.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app
+
+logger = logging.getLogger(__name__)
+
+# Views sent to the CPU pool unless ASGI_CPU_ENDPOINTS says otherwise
+DEFAULT_CPU_ENDPOINTS = 'upload_pdf,submit_form'
+# Size of the chunks response bodies are sent in
+CHUNK_SIZE = 64 * 1024
+
+
+class FileWrapper:
+    """``wsgi.file_wrapper`` reading files in :data:`CHUNK_SIZE` chunks."""
+
+    def __init__(self, file, buffer_size: int = CHUNK_SIZE):
+        self.file = file
+        self.buffer_size = max(buffer_size, CHUNK_SIZE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        data = self.file.read(self.buffer_size)
+        if data:
+            return data
+        raise StopIteration()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class AsgiBridge:
+    """Runs a WSGI application as an ASGI application.
+
+    Args:
+        wsgi_app: Flask application to serve
+        io_threads: Size of the pool for I/O-bound views
+        cpu_threads: Size of the pool for ``cpu_endpoints``
+        cpu_endpoints: Endpoint names of CPU-bound views
+        spool_bytes: Request bodies up to this size are kept in memory
+    """
+
+    def __init__(self, wsgi_app: Flask, io_threads: int = 32, cpu_threads: int = 2,
+                 cpu_endpoints: Iterable[str] = (), spool_bytes: int = 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='asgi-io')
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_threads, thread_name_prefix='asgi-cpu')
+        self.cpu_endpoints = frozenset(cpu_endpoints)
+        self.spool_bytes = spool_bytes
+        self.max_content_length = wsgi_app.config.get('MAX_CONTENT_LENGTH')
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+
+    async def handle_lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.io_executor.shutdown(wait=True)
+                self.cpu_executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def executor_for(self, scope: dict) -> ThreadPoolExecutor:
+        """Pick the pool for the view matching the request path."""
+        if not self.cpu_endpoints:
+            return self.io_executor
+        adapter = self.wsgi_app.url_map.bind('localhost')
+        try:
+            endpoint, _ = adapter.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            return self.io_executor
+        return self.cpu_executor if endpoint in self.cpu_endpoints else self.io_executor
+
+    async def handle_http(self, scope: dict, receive: Callable, send: Callable) -> None:
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        declared = headers.get('content-length')
+        if (self.max_content_length is not None and declared and declared.isdigit()
+                and int(declared) > self.max_content_length):
+            # Let Flask answer with its 413 page without receiving the body
+            body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+            body_size = None
+        else:
+            body, body_size = await self.receive_body(receive)
+            if body is None:
+                return
+
+        loop = asyncio.get_running_loop()
+        environ = self.build_environ(scope, headers, body, body_size)
+        response: List = []
+
+        def start_response(status: str, response_headers: List[Tuple[str, str]], exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, response_headers]
+
+        def run_view():
+            try:
+                return self.wsgi_app(environ, start_response)
+            finally:
+                body.close()
+
+        iterable = await loop.run_in_executor(self.executor_for(scope), run_view)
+        try:
+            status, response_headers = response
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response_headers],
+            })
+            if isinstance(iterable, (list, tuple)):
+                for chunk in iterable:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                # File bodies: read each chunk in the pool, send it on the loop
+                iterator = iter(iterable)
+                while True:
+                    chunk = await loop.run_in_executor(self.io_executor, next, iterator, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self.io_executor, close)
+
+    async def receive_body(self, receive: Callable) -> Tuple[Optional[tempfile.SpooledTemporaryFile], int]:
+        """Receive the request body into a spooled file.
+
+        Bodies over ``MAX_CONTENT_LENGTH`` are drained without being stored;
+        the reported size makes Flask answer 413.
+
+        Returns:
+            The rewound body and its size, or (None, 0) if the client disconnected
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+            chunk = message.get('body', b'')
+            if chunk:
+                size += len(chunk)
+                if self.max_content_length is None or size <= self.max_content_length:
+                    body.write(chunk)
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body, size
+
+    def build_environ(self, scope: dict, headers: dict, body, body_size: Optional[int]) -> dict:
+        """Build the WSGI environ of an ASGI HTTP request (PEP 3333)."""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        path = scope.get('root_path', '') + scope['path']
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'REQUEST_URI': path,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for name, value in headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value if body_size is None else str(body_size)
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        if body_size is not None and 'CONTENT_LENGTH' not in environ and body_size:
+            environ['CONTENT_LENGTH'] = str(body_size)
+        return environ
+
+
+def create_bridge(flask_app: Flask) -> AsgiBridge:
+    """Wrap ``flask_app`` with pool sizes from the environment.
+
+    Reads ``ASGI_IO_THREADS``, ``ASGI_CPU_THREADS`` (defaults to the CPU
+    count), ``ASGI_CPU_ENDPOINTS`` (comma-separated view names) and
+    ``ASGI_SPOOL_MB``.
+    """
+    config = flask_app.config
+    config.setdefault('ASGI_IO_THREADS', int(os.environ.get('ASGI_IO_THREADS', '32')))
+    config.setdefault('ASGI_CPU_THREADS', int(os.environ.get('ASGI_CPU_THREADS', str(os.cpu_count() or 2))))
+    config.setdefault('ASGI_CPU_ENDPOINTS', os.environ.get('ASGI_CPU_ENDPOINTS', DEFAULT_CPU_ENDPOINTS))
+    config.setdefault('ASGI_SPOOL_MB', float(os.environ.get('ASGI_SPOOL_MB', '1')))
+    return AsgiBridge(
+        flask_app,
+        io_threads=config['ASGI_IO_THREADS'],
+        cpu_threads=config['ASGI_CPU_THREADS'],
+        cpu_endpoints=[name.strip() for name in config['ASGI_CPU_ENDPOINTS'].split(',') if name.strip()],
+        spool_bytes=int(config['ASGI_SPOOL_MB'] * 1024 * 1024),
+    )
+
+
+app = create_bridge(flask_app)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Bytes saved against CPU time spent by the optimization levels of filled PDFs.
+
+Fills synthetic AcroForm fixtures with ``fill_pdf_form`` (native pdfrw
+fill) and ``_fill_pdf_form_fallback`` (reportlab overlay, which leaves the
+merged page contents uncompressed) without optimization, then optimizes a
+copy of each output at every level with every available engine and
+reports the sizes before and after, the bytes saved and the CPU and wall
+time per optimization, as JSON.
+
+Usage:
+    python benchmarks/bench_optimize.py
+    python benchmarks/bench_optimize.py --fields 100,2000 --pages 1,20 --levels fast,size --output optimize.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_pdf import _int_list  # noqa: E402
+from benchmarks.fixtures import field_data_for, fixture_path  # noqa: E402
+
+METHODS = ('native', 'fallback')
+
+
+def available_engines():
+    """Return the optimization engines that can run here."""
+    engines = ['pdfrw']
+    try:
+        import pikepdf  # noqa: F401
+        engines.insert(0, 'pikepdf')
+    except ImportError:
+        pass
+    return engines
+
+
+def fill_unoptimized(method, pdf_path, names, output_path):
+    """Fill a fixture with ``method`` and leave the output as written."""
+    import pdf_processor
+
+    level = pdf_processor.PDF_OPTIMIZE
+    pdf_processor.PDF_OPTIMIZE = 'none'
+    try:
+        if method == 'native':
+            pdf_processor.fill_pdf_form(pdf_path, field_data_for(names), output_path)
+        else:
+            pdf_processor._fill_pdf_form_fallback(pdf_path, field_data_for(names), output_path)
+    finally:
+        pdf_processor.PDF_OPTIMIZE = level
+
+
+def measure(filled_path, level, engine, iterations, workdir):
+    """Optimize copies of ``filled_path`` and return sizes and timings."""
+    import optimize
+
+    cpu, wall, result = [], [], None
+    default_engine = optimize.engine
+    optimize.engine = lambda: engine
+    try:
+        for i in range(iterations):
+            path = os.path.join(workdir, f'optimize_{i}.pdf')
+            shutil.copyfile(filled_path, path)
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            result = optimize.optimize_pdf(path, level)
+            cpu.append((time.process_time() - cpu_start) * 1000.0)
+            wall.append((time.perf_counter() - wall_start) * 1000.0)
+    finally:
+        optimize.engine = default_engine
+    return {
+        'level': level,
+        'engine': engine,
+        'bytes_before': result.bytes_before,
+        'bytes_after': result.bytes_after,
+        'bytes_saved': result.bytes_saved,
+        'saved_pct': round(100.0 * result.bytes_saved / result.bytes_before, 1) if result.bytes_before else 0.0,
+        'duplicates': result.duplicates,
+        'cpu_ms': round(statistics.median(cpu), 2),
+        'wall_ms': round(statistics.median(wall), 2),
+        'kb_saved_per_cpu_ms': round(result.bytes_saved / 1024 / statistics.median(cpu), 2) if cpu[0] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the optimization levels of filled PDFs')
+    parser.add_argument('--fields', type=_int_list, default=(100, 2000), help='Comma separated field counts')
+    parser.add_argument('--pages', type=_int_list, default=(1, 20), help='Comma separated page counts')
+    parser.add_argument('--methods', default=','.join(METHODS), help=f'Fill methods (default: {",".join(METHODS)})')
+    parser.add_argument('--levels', default='fast,size', help='Comma separated levels (default: fast,size)')
+    parser.add_argument('--iterations', type=int, default=3, help='Optimizations timed per case')
+    parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'pdf_bench_fixtures'),
+                        help='Directory for generated fixtures (reused between runs)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import logging
+    logging.disable(logging.WARNING)
+
+    methods = [method for method in args.methods.split(',') if method]
+    levels = [level for level in args.levels.split(',') if level]
+    engines = available_engines()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pdf_optimize_') as workdir:
+        for num_pages in args.pages:
+            for num_fields in args.fields:
+                pdf_path, names = fixture_path(args.fixture_dir, num_fields, num_pages)
+                for method in methods:
+                    filled_path = os.path.join(workdir, f'filled_{method}.pdf')
+                    fill_unoptimized(method, pdf_path, names, filled_path)
+                    for level in levels:
+                        for engine in engines:
+                            record = measure(filled_path, level, engine, args.iterations, workdir)
+                            record.update({'fields': num_fields, 'pages': num_pages, 'method': method,
+                                           'template_bytes': os.path.getsize(pdf_path)})
+                            results.append(record)
+                            print(
+                                f"{method:<8} {num_fields:>5}f {num_pages:>4}p {level:<4} {engine:<7} "
+                                f"{record['bytes_before']:>10} -> {record['bytes_after']:>10} B "
+                                f"({record['saved_pct']:>5.1f}%)  cpu {record['cpu_ms']:>9.2f} ms",
+                                file=sys.stderr,
+                            )
+
+    text = json.dumps({'engines': engines, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the PDF hot paths in pdf_processor.
+
+Measures ``extract_form_fields``, ``fill_pdf_form``, ``_fill_pdf_form_fallback``,
+``_fill_pdf_form_incremental`` and ``convert_pdf_to_png`` against synthetic
+AcroForm PDFs generated with reportlab, optionally with ``--payload-mb`` of
+page images like scanned templates. Every (stage, fields, pages, payload)
+case runs in a fresh process so that peak RSS is attributable to that case
+alone.
+
+Usage:
+    python benchmarks/bench_pdf.py --output results.json
+    python benchmarks/bench_pdf.py --quick --compare baseline.json --threshold 0.2
+    python benchmarks/bench_pdf.py --stages fill,fallback --fields 1,2000 --pages 1,200
+    python benchmarks/bench_pdf.py --stages extract,fill,incremental --fields 100 --pages 10 --payload-mb 0,300
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fixtures import fixture_path, field_data_for  # noqa: E402
+
+STAGES = ('extract', 'fill', 'fallback', 'incremental', 'render')
+DEFAULT_FIELDS = (1, 100, 2000)
+DEFAULT_PAGES = (1, 20, 200)
+QUICK_FIELDS = (1, 100)
+QUICK_PAGES = (1, 10)
+
+
+def percentile(values, pct):
+    """Return the ``pct`` percentile of ``values`` using linear interpolation."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _peak_rss_mb():
+    """Return the peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _run_case(stage, pdf_path, names, iterations, warmup, workdir, queue):
+    """Run one benchmark case in a child process and report through ``queue``."""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import logging
+    logging.disable(logging.WARNING)
+
+    import pdf_processor
+
+    field_data = field_data_for(names)
+    output_pdf = os.path.join(workdir, f'out_{stage}.pdf')
+    output_png = os.path.join(workdir, f'out_{stage}.png')
+
+    # The render stage converts an already filled PDF, like submit_form does
+    if stage == 'render':
+        pdf_processor.fill_pdf_form(pdf_path, field_data, output_pdf)
+
+    def run_once():
+        if stage == 'extract':
+            pdf_processor.extract_form_fields(pdf_path)
+        elif stage == 'fill':
+            pdf_processor.fill_pdf_form(pdf_path, field_data, output_pdf)
+        elif stage == 'fallback':
+            pdf_processor._fill_pdf_form_fallback(pdf_path, field_data, output_pdf)
+        elif stage == 'incremental':
+            pdf_processor._fill_pdf_form_incremental(pdf_path, field_data, output_pdf)
+        elif stage == 'render':
+            pdf_processor.convert_pdf_to_png(output_pdf, output_png)
+
+    for _ in range(warmup):
+        run_once()
+
+    baseline_rss = _peak_rss_mb()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        run_once()
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - started
+
+    queue.put({
+        'latencies_ms': latencies,
+        'elapsed_s': elapsed,
+        'peak_rss_mb': _peak_rss_mb(),
+        'baseline_rss_mb': baseline_rss,
+    })
+
+
+def run_case(stage, num_fields, num_pages, iterations, warmup, fixture_dir, payload_mb=0):
+    """Run a benchmark case in a fresh process and summarise the results.
+
+    Returns:
+        dict: Result record for the JSON report
+    """
+    pdf_path, names = fixture_path(fixture_dir, num_fields, num_pages, payload_mb)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    with tempfile.TemporaryDirectory(prefix='pdf_bench_') as workdir:
+        proc = ctx.Process(
+            target=_run_case,
+            args=(stage, pdf_path, names, iterations, warmup, workdir, queue),
+        )
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            raise RuntimeError(f"Benchmark case {stage}/{num_fields}f/{num_pages}p/{payload_mb}mb "
+                               f"exited with {proc.exitcode}")
+        raw = queue.get()
+
+    latencies = raw['latencies_ms']
+    return {
+        'stage': stage,
+        'fields': num_fields,
+        'pages': num_pages,
+        'payload_mb': payload_mb,
+        'template_bytes': os.path.getsize(pdf_path),
+        'iterations': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p90_ms': round(percentile(latencies, 90), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_ops': round(len(latencies) / raw['elapsed_s'], 3) if raw['elapsed_s'] else None,
+        'peak_rss_mb': round(raw['peak_rss_mb'], 1),
+        'stage_rss_mb': round(raw['peak_rss_mb'] - raw['baseline_rss_mb'], 1),
+    }
+
+
+def _library_versions():
+    versions = {}
+    for module in ('PyPDF2', 'pdfrw', 'reportlab', 'pdf2image'):
+        try:
+            versions[module] = getattr(__import__(module), '__version__', 'unknown')
+        except ImportError:
+            versions[module] = None
+    return versions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, rss_threshold):
+    """Compare results against a baseline report.
+
+    A case regresses when its p50 latency or peak RSS grew by more than the
+    given fraction relative to the same case in the baseline.
+
+    Returns:
+        list: Human readable descriptions of the regressions found
+    """
+    def key(record):
+        return (record['stage'], record['fields'], record['pages'], record.get('payload_mb', 0))
+
+    previous = {key(record): record for record in baseline.get('results', [])}
+    regressions = []
+    for record in results:
+        old = previous.get(key(record))
+        if not old:
+            continue
+        label = f"{record['stage']} {record['fields']}f/{record['pages']}p/{record.get('payload_mb', 0)}mb"
+        if old['p50_ms'] and record['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append(f"{label}: p50 {old['p50_ms']} ms -> {record['p50_ms']} ms")
+        if old['peak_rss_mb'] and record['peak_rss_mb'] > old['peak_rss_mb'] * (1 + rss_threshold):
+            regressions.append(f"{label}: peak RSS {old['peak_rss_mb']} MB -> {record['peak_rss_mb']} MB")
+    return regressions
+
+
+def _int_list(value):
+    return tuple(int(v) for v in value.split(',') if v)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pdf_processor hot paths')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma separated stages to run')
+    parser.add_argument('--fields', type=_int_list, help='Comma separated field counts (1-2000)')
+    parser.add_argument('--pages', type=_int_list, help='Comma separated page counts (1-200)')
+    parser.add_argument('--payload-mb', type=_int_list, default=(0,),
+                        help='Comma separated sizes of the page images in MB (default: 0)')
+    parser.add_argument('--iterations', type=int, default=5, help='Timed iterations per case')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed warm-up iterations per case')
+    parser.add_argument('--quick', action='store_true', help='Run a small matrix for smoke testing')
+    parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'pdf_bench_fixtures'),
+                        help='Directory for generated fixtures (reused between runs)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', help='Baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed p50 latency growth as a fraction (default: 0.2)')
+    parser.add_argument('--rss-threshold', type=float, default=0.2,
+                        help='Allowed peak RSS growth as a fraction (default: 0.2)')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    if 'render' in stages and not shutil.which('pdftoppm'):
+        print("pdftoppm (poppler) not found, skipping the render stage", file=sys.stderr)
+        stages.remove('render')
+
+    fields = args.fields or (QUICK_FIELDS if args.quick else DEFAULT_FIELDS)
+    pages = args.pages or (QUICK_PAGES if args.quick else DEFAULT_PAGES)
+    iterations = 3 if args.quick and args.iterations == 5 else args.iterations
+
+    results = []
+    for payload_mb in args.payload_mb:
+        for num_pages in pages:
+            for num_fields in fields:
+                for stage in stages:
+                    record = run_case(stage, num_fields, num_pages, iterations, args.warmup, args.fixture_dir,
+                                      payload_mb)
+                    results.append(record)
+                    print(
+                        f"{stage:<11} {num_fields:>5}f {num_pages:>4}p {payload_mb:>4}mb  "
+                        f"p50 {record['p50_ms']:>9.2f} ms  p99 {record['p99_ms']:>9.2f} ms  "
+                        f"{record['throughput_ops']:>8.2f} ops/s  peak {record['peak_rss_mb']:>7.1f} MB",
+                        file=sys.stderr,
+                    )
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'libraries': _library_versions(),
+            'iterations': iterations,
+            'warmup': args.warmup,
+        },
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.rss_threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Batch preview generation with full renders against composited previews.
+
+Fills ``--forms`` forms with distinct values from a synthetic AcroForm
+template, then renders the preview of every filled PDF twice:
+
+* ``full``: ``convert_pdf_to_png`` runs poppler on each filled PDF;
+* ``composite``: ``composite_preview`` renders the template once into the
+  preview cache (the ``cold`` preview) and draws the values of every other
+  form over a copy of it.
+
+Reports the latency percentiles of both, the cold composite, and the forms
+per second of the whole batch, as JSON. Requires poppler, like the app.
+
+Usage:
+    python benchmarks/bench_previews.py --fields 100,2000 --forms 50
+    python benchmarks/bench_previews.py --fields 100 --pages 10 --payload-mb 0,150 --output previews.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_pdf import _int_list, percentile  # noqa: E402
+from benchmarks.fixtures import field_data_for, fixture_path  # noqa: E402
+
+
+def form_data(names, index):
+    """Return the field values of the ``index``-th form of a batch."""
+    return {name: f"{value} #{index}" for name, value in field_data_for(names).items()}
+
+
+def summarize(samples_ms):
+    return {
+        'p50_ms': round(statistics.median(samples_ms), 2),
+        'p95_ms': round(percentile(samples_ms, 95), 2),
+        'total_s': round(sum(samples_ms) / 1000.0, 3),
+        'forms_per_s': round(len(samples_ms) / (sum(samples_ms) / 1000.0), 2),
+    }
+
+
+def run_case(num_fields, num_pages, payload_mb, forms, fixture_dir, workdir):
+    """Fill ``forms`` forms from one fixture and time both preview modes."""
+    import pdf_processor
+
+    template_path, names = fixture_path(fixture_dir, num_fields, num_pages, payload_mb)
+    batch = []
+    for index in range(forms):
+        data = form_data(names, index)
+        pdf_path = os.path.join(workdir, f'form_{index}.pdf')
+        pdf_processor.fill_pdf_form(template_path, data, pdf_path)
+        batch.append((data, pdf_path))
+
+    full = []
+    for index, (_, pdf_path) in enumerate(batch):
+        started = time.perf_counter()
+        pdf_processor.convert_pdf_to_png(pdf_path, os.path.join(workdir, f'full_{index}.png'))
+        full.append((time.perf_counter() - started) * 1000.0)
+
+    pdf_processor.clear_preview_cache()
+    composite = []
+    for index, (data, _) in enumerate(batch):
+        started = time.perf_counter()
+        pdf_processor.composite_preview(template_path, data, os.path.join(workdir, f'composite_{index}.png'))
+        composite.append((time.perf_counter() - started) * 1000.0)
+
+    full_summary, composite_summary = summarize(full), summarize(composite)
+    return {
+        'fields': num_fields,
+        'pages': num_pages,
+        'payload_mb': payload_mb,
+        'forms': forms,
+        'full': full_summary,
+        'composite': dict(composite_summary, cold_ms=round(composite[0], 2)),
+        'speedup': round(full_summary['total_s'] / composite_summary['total_s'], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full and composited previews of a batch of forms')
+    parser.add_argument('--fields', type=_int_list, default=(100, 2000), help='Comma separated field counts')
+    parser.add_argument('--pages', type=_int_list, default=(1,), help='Comma separated page counts')
+    parser.add_argument('--payload-mb', type=_int_list, default=(0,),
+                        help='Comma separated sizes of page images in MB, like scanned templates')
+    parser.add_argument('--forms', type=int, default=50, help='Forms filled and previewed per case')
+    parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'pdf_bench_fixtures'),
+                        help='Directory for generated fixtures (reused between runs)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('PDF_OPTIMIZE', 'none')
+    import logging
+    logging.disable(logging.WARNING)
+
+    results = []
+    for payload_mb in args.payload_mb:
+        for num_pages in args.pages:
+            for num_fields in args.fields:
+                with tempfile.TemporaryDirectory(prefix='pdf_previews_') as workdir:
+                    record = run_case(num_fields, num_pages, payload_mb, args.forms, args.fixture_dir, workdir)
+                results.append(record)
+                print(
+                    f"{num_fields:>5}f {num_pages:>4}p {payload_mb:>4}MB  "
+                    f"full p50 {record['full']['p50_ms']:>8.1f} ms  "
+                    f"composite p50 {record['composite']['p50_ms']:>8.1f} ms "
+                    f"(cold {record['composite']['cold_ms']:.1f} ms)  x{record['speedup']}",
+                    file=sys.stderr,
+                )
+
+    text = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Synthetic AcroForm fixtures for the benchmarks.
+
+PDFs are generated locally with reportlab so that benchmark runs are
+reproducible and do not depend on real customer templates.
+"""
+
+import math
+import os
+
+# Letter size in points
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 36
+
+# Bump when the generated layout changes so cached fixtures are rebuilt
+FIXTURE_VERSION = 1
+
+
+def field_name(index):
+    """Return the name of the synthetic field with the given index."""
+    return f"field_{index:05d}"
+
+
+def make_acroform_pdf(path, num_fields, num_pages=1, payload_mb=0):
+    """Generate a PDF with ``num_fields`` text fields spread over ``num_pages``.
+
+    Fields are distributed as evenly as possible over the pages and laid out
+    in a grid that shrinks to fit the page. With ``payload_mb``, every page
+    also gets a background image of random pixels, like a scanned form,
+    totalling about that many megabytes.
+
+    Args:
+        path (str): Output path of the generated PDF
+        num_fields (int): Number of form fields to create
+        num_pages (int): Number of pages to create
+        payload_mb (int): Approximate size of the page images in MB
+
+    Returns:
+        list: Names of the generated fields, in creation order
+    """
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+    # Random pixels do not compress, so the image size is the payload size
+    image_side = int(math.sqrt(payload_mb * 1024 * 1024 / num_pages / 3)) if payload_mb else 0
+    per_page = math.ceil(num_fields / num_pages) if num_fields else 0
+    names = []
+
+    for page in range(num_pages):
+        if image_side:
+            from PIL import Image
+            from reportlab.lib.utils import ImageReader
+
+            noise = Image.frombytes('RGB', (image_side, image_side), os.urandom(image_side * image_side * 3))
+            c.drawImage(ImageReader(noise), 0, 0, width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        c.setFont('Helvetica', 8)
+        c.drawString(MARGIN, PAGE_HEIGHT - MARGIN / 2, f"Benchmark fixture - page {page + 1} of {num_pages}")
+
+        start = page * per_page
+        count = max(0, min(per_page, num_fields - start))
+        if count:
+            cols = max(1, math.ceil(math.sqrt(count / 2)))
+            rows = math.ceil(count / cols)
+            cell_w = (PAGE_WIDTH - 2 * MARGIN) / cols
+            cell_h = (PAGE_HEIGHT - 2 * MARGIN) / rows
+            for i in range(count):
+                row, col = divmod(i, cols)
+                name = field_name(start + i)
+                c.acroForm.textfield(
+                    name=name,
+                    tooltip=name,
+                    x=MARGIN + col * cell_w,
+                    y=PAGE_HEIGHT - MARGIN - (row + 1) * cell_h,
+                    width=max(cell_w - 2, 4),
+                    height=max(min(cell_h - 2, 18), 4),
+                    fontSize=max(min(cell_h - 4, 10), 2),
+                    borderWidth=0,
+                )
+                names.append(name)
+        c.showPage()
+
+    c.save()
+    return names
+
+
+def field_data_for(names):
+    """Return a deterministic value for each field name."""
+    return {name: f"Value {i}" for i, name in enumerate(names)}
+
+
+def fixture_path(directory, num_fields, num_pages, payload_mb=0):
+    """Return the path of a cached fixture, generating it if needed.
+
+    Args:
+        directory (str): Directory holding generated fixtures
+        num_fields (int): Number of form fields
+        num_pages (int): Number of pages
+        payload_mb (int): Approximate size of the page images in MB
+
+    Returns:
+        tuple: (path, field names)
+    """
+    os.makedirs(directory, exist_ok=True)
+    payload = f"_{payload_mb}mb" if payload_mb else ''
+    path = os.path.join(directory, f"acroform_v{FIXTURE_VERSION}_{num_fields}f_{num_pages}p{payload}.pdf")
+    names = [field_name(i) for i in range(num_fields)]
+    if not os.path.exists(path):
+        make_acroform_pdf(path, num_fields, num_pages, payload_mb)
+    return path, names
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+HTTP load-test harness for the Flask routes.
+
+Starts the app locally (gunicorn by default, or uvicorn with the ASGI entry
+point in ``asgi.py``) against a scratch SQLite
+database and upload folder, seeds it with templates and filled forms, then
+drives a weighted mix of ``upload_pdf``, ``submit_form``, ``view_pdfs`` and
+``download_file`` requests from concurrent clients. Reports p50/p99 latency,
+error rate and SQLite lock errors per route as JSON.
+
+Usage:
+    python benchmarks/loadtest.py --templates 5 --forms 200 --duration 30 --concurrency 16
+    python benchmarks/loadtest.py --mix submit=1,view=1 --workers 4 --threads 2 --output load.json
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_pdf import percentile  # noqa: E402
+from benchmarks.fixtures import field_data_for, make_acroform_pdf  # noqa: E402
+
+ROUTES = ('upload', 'submit', 'view', 'download')
+DEFAULT_MIX = 'upload=1,submit=3,view=3,download=6'
+
+# Route handlers as they appear in tracebacks, used to attribute lock errors
+ROUTE_FUNCTIONS = {
+    'upload': 'upload_pdf',
+    'submit': 'submit_form',
+    'view': 'view_pdfs',
+    'download': 'download_file',
+}
+LOG_RECORD_START = re.compile(r'^(\d{4}-\d{2}-\d{2} |\[\d{4}-\d{2}-\d{2} )')
+
+
+def server_env(workdir):
+    """Return the environment pointing the app at the scratch database."""
+    return dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        WTF_CSRF_ENABLED='false',
+        LOG_LEVEL='WARNING',
+    )
+
+
+def seed(workdir, num_templates, num_forms, num_fields, queue):
+    """Create templates and filled forms in the scratch database.
+
+    Runs in a separate process because importing ``app`` binds it to the
+    database configured in the environment.
+    """
+    os.environ.update(server_env(workdir))
+    from app import app, db
+    from models import PDFTemplate, FormField, FilledForm
+    import pdf_processor
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    templates = []
+    with app.app_context():
+        for t in range(num_templates):
+            path = os.path.join(upload_folder, f"{uuid.uuid4()}_seed_{t}.pdf")
+            names = make_acroform_pdf(path, num_fields)
+            template = PDFTemplate(name=f"Seed template {t}", file_path=path,
+                                   original_filename=f"seed_{t}.pdf")
+            db.session.add(template)
+            db.session.flush()
+            db.session.add_all(FormField(template_id=template.id, field_name=name) for name in names)
+            templates.append((template, names))
+        db.session.commit()
+
+        # Fill each template once and copy the output for every seeded form
+        samples = {}
+        for template, names in templates:
+            pdf_path = os.path.join(upload_folder, f"seed_sample_{template.id}.pdf")
+            png_path = pdf_path.replace('.pdf', '.png')
+            pdf_processor.fill_pdf_form(template.file_path, field_data_for(names), pdf_path)
+            try:
+                pdf_processor.convert_pdf_to_png(pdf_path, png_path)
+            except pdf_processor.PDFConversionError:
+                # Without poppler, use a blank placeholder so downloads still succeed
+                from PIL import Image
+                Image.new('RGB', (1275, 1650), 'white').save(png_path, 'PNG')
+            samples[template.id] = (pdf_path, png_path)
+
+        form_ids = []
+        for i in range(num_forms):
+            template, names = templates[i % len(templates)]
+            form = FilledForm(template_id=template.id)
+            db.session.add(form)
+            db.session.flush()
+            sample_pdf, sample_png = samples[template.id]
+            form.pdf_path = os.path.join(upload_folder, f"filled_{form.id}_seed.pdf")
+            form.png_path = form.pdf_path.replace('.pdf', '.png')
+            shutil.copyfile(sample_pdf, form.pdf_path)
+            shutil.copyfile(sample_png, form.png_path)
+            form.set_data(field_data_for(names))
+            form_ids.append(form.id)
+        db.session.commit()
+
+        queue.put({
+            'templates': [(template.id, names) for template, names in templates],
+            'forms': form_ids,
+        })
+
+
+def seed_workdir(workdir, num_templates, num_forms, num_fields):
+    """Seed a scratch database in ``workdir`` in a separate process.
+
+    Returns:
+        Dict with the seeded ``templates`` (id and field names) and ``forms`` (ids)
+    """
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    seeder = ctx.Process(target=seed, args=(workdir, num_templates, num_forms, num_fields, queue))
+    seeder.start()
+    seeded = None
+    while seeded is None:
+        try:
+            seeded = queue.get(timeout=1)
+        except Exception:
+            if not seeder.is_alive():
+                raise RuntimeError(f"Seeding failed with exit code {seeder.exitcode}")
+    seeder.join()
+    return seeded
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir, port, log_file, extra_env=None):
+    """Start the app server and wait until it accepts requests.
+
+    ``extra_env`` overrides variables of :func:`server_env`.
+    """
+    env = server_env(workdir)
+    env.update(extra_env or {})
+    if args.server == 'gunicorn':
+        cmd = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(args.workers),
+            '--threads', str(args.threads),
+            '--timeout', str(args.timeout),
+            'main:app',
+        ]
+    elif args.server == 'uvicorn':
+        cmd = [
+            sys.executable, '-m', 'uvicorn',
+            '--host', '127.0.0.1',
+            '--port', str(port),
+            '--workers', str(args.workers),
+            '--log-level', 'warning',
+            'asgi:app',
+        ]
+    else:
+        cmd = [
+            sys.executable, '-c',
+            f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)",
+        ]
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}, see {log_file.name}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError('Server did not start within 30 seconds')
+
+
+def _multipart(fields, file_field, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One simulated user issuing requests over a keep-alive connection."""
+
+    def __init__(self, port, seeded, upload_pdf, rng):
+        self.port = port
+        self.seeded = seeded
+        self.upload_pdf = upload_pdf
+        self.rng = rng
+        self.conn = None
+
+    def _request(self, method, path, body=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            response.read()
+            return response.status, response.getheader('Location', '')
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def run(self, route):
+        """Issue one request for ``route`` and return whether it succeeded.
+
+        Failures in this app are mostly redirects back to the previous page
+        with a flash message, so success is judged by the redirect target.
+        """
+        if route == 'upload':
+            body, content_type = _multipart(
+                {'template_name': 'Load test upload'}, 'pdf_file', 'loadtest.pdf', self.upload_pdf
+            )
+            status, location = self._request('POST', '/upload', body, {'Content-Type': content_type})
+            return status == 302 and '/template/' in location
+        if route == 'submit':
+            template_id, names = self.rng.choice(self.seeded['templates'])
+            body = urlencode(field_data_for(names))
+            status, location = self._request('POST', f'/submit_form/{template_id}', body,
+                                             {'Content-Type': 'application/x-www-form-urlencoded'})
+            return status == 302 and location.endswith('/pdfs')
+        if route == 'view':
+            status, _ = self._request('GET', '/pdfs')
+            return status == 200
+        if route == 'download':
+            form_id = self.rng.choice(self.seeded['forms'])
+            filetype = self.rng.choice(('pdf', 'png'))
+            status, _ = self._request('GET', f'/download/{form_id}/{filetype}')
+            return status == 200
+        raise ValueError(f"Unknown route: {route}")
+
+
+def drive(args, port, seeded, upload_pdf):
+    """Run the weighted workload and return the raw samples per route."""
+    mix = {}
+    for item in args.mix.split(','):
+        route, _, weight = item.partition('=')
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route in mix: {route}")
+        mix[route] = float(weight or 1)
+    routes, weights = list(mix), list(mix.values())
+
+    samples = {route: [] for route in routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        client = Client(port, seeded, upload_pdf, rng)
+        while time.monotonic() < deadline:
+            route = rng.choices(routes, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                ok = client.run(route)
+            except (OSError, http.client.HTTPException):
+                ok = False
+            latency = (time.perf_counter() - t0) * 1000.0
+            with lock:
+                samples[route].append((latency, ok))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def count_lock_errors(log_path):
+    """Count 'database is locked' errors in the server log per route."""
+    counts = {route: 0 for route in ROUTES}
+    counts['unattributed'] = 0
+    records, current = [], []
+    with open(log_path, errors='replace') as f:
+        for line in f:
+            if LOG_RECORD_START.match(line) and current:
+                records.append(''.join(current))
+                current = []
+            current.append(line)
+    if current:
+        records.append(''.join(current))
+
+    for record in records:
+        if 'database is locked' not in record:
+            continue
+        for route, function in ROUTE_FUNCTIONS.items():
+            if f'in {function}' in record or function in record:
+                counts[route] += 1
+                break
+        else:
+            counts['unattributed'] += 1
+    return counts
+
+
+def summarise(samples, duration, lock_errors):
+    routes = {}
+    for route, values in samples.items():
+        if not values:
+            continue
+        latencies = [latency for latency, _ in values]
+        errors = sum(1 for _, ok in values if not ok)
+        routes[route] = {
+            'requests': len(values),
+            'errors': errors,
+            'error_rate': round(errors / len(values), 4),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(max(latencies), 2),
+            'throughput_rps': round(len(values) / duration, 2),
+            'db_lock_errors': lock_errors.get(route, 0),
+        }
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Flask routes against a scratch database')
+    parser.add_argument('--templates', type=int, default=5, help='Number of templates to seed (N)')
+    parser.add_argument('--forms', type=int, default=100, help='Number of filled forms to seed (M)')
+    parser.add_argument('--fields', type=int, default=20, help='Form fields per seeded template')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to drive load')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Weighted route mix (default: {DEFAULT_MIX})')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn', 'flask'), default='gunicorn',
+                        help='Server to start')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn or uvicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--timeout', type=int, default=30, help='gunicorn worker timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the workload')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory after the run')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pdf_loadtest_')
+    try:
+        seeded = seed_workdir(workdir, args.templates, args.forms, args.fields)
+        print(f"Seeded {len(seeded['templates'])} templates and {len(seeded['forms'])} forms in {workdir}",
+              file=sys.stderr)
+
+        upload_path = os.path.join(workdir, 'upload.pdf')
+        make_acroform_pdf(upload_path, args.fields)
+        with open(upload_path, 'rb') as f:
+            upload_pdf = f.read()
+
+        log_path = os.path.join(workdir, 'server.log')
+        with open(log_path, 'w') as log_file:
+            port = _free_port()
+            server = start_server(args, workdir, port, log_file)
+            try:
+                started = time.monotonic()
+                samples = drive(args, port, seeded, upload_pdf)
+                elapsed = time.monotonic() - started
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        lock_errors = count_lock_errors(log_path)
+        report = {
+            'config': {
+                'server': args.server,
+                'workers': args.workers,
+                'threads': args.threads,
+                'concurrency': args.concurrency,
+                'duration_s': round(elapsed, 2),
+                'templates': args.templates,
+                'forms': args.forms,
+                'fields': args.fields,
+                'mix': args.mix,
+            },
+            'routes': summarise(samples, elapsed, lock_errors),
+            'db_lock_errors': lock_errors,
+        }
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+    finally:
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
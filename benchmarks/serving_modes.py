@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Compare the WSGI (gunicorn) and ASGI (uvicorn + ``asgi.py``) serving modes
+under slow clients.
+
+For each mode, starts the app against a scratch database, opens
+``--slow-clients`` connections that download a large filled PDF at
+``--read-kbps``, then measures how fast requests (template status polling and
+the filled forms page) from ``--fast-clients`` clients are served meanwhile.
+With sync workers every slow download holds a worker, so fast requests queue
+behind them; with the ASGI bridge they are served by the event loop.
+
+Reports, per mode, p50/p99 latency and errors of the fast requests and how
+many slow downloads got their first byte within the run, as JSON.
+
+Usage:
+    python benchmarks/serving_modes.py --slow-clients 32 --duration 15
+    python benchmarks/serving_modes.py --modes uvicorn --workers 1 --file-mb 50 --output modes.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_pdf import percentile  # noqa: E402
+from benchmarks.loadtest import _free_port, seed_workdir, start_server  # noqa: E402
+
+MODES = ('gunicorn', 'uvicorn')
+SLOW_RCVBUF = 16 * 1024
+
+
+def make_large_pdf(path, size_mb):
+    """Overwrite ``path`` with a PDF-looking file of ``size_mb`` MB."""
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n')
+        for _ in range(int(size_mb)):
+            f.write(block)
+        f.write(b'\n%%EOF\n')
+
+
+def slow_download(port, path, read_kbps, stop, results, lock):
+    """Download ``path`` reading at most ``read_kbps`` KB per second until ``stop``."""
+    started = time.perf_counter()
+    first_byte = None
+    received = 0
+    sock = socket.socket()
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SLOW_RCVBUF)
+        sock.settimeout(1)
+        sock.connect(('127.0.0.1', port))
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+        chunk = max(1024, read_kbps * 1024 // 10)
+        while not stop.is_set():
+            try:
+                data = sock.recv(chunk)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            received += len(data)
+            time.sleep(0.1)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    with lock:
+        results.append((first_byte, received))
+
+
+def fast_requests(port, paths, stop, samples, lock):
+    """Issue requests for ``paths`` in turn until ``stop``, recording latency."""
+    conn = None
+    index = 0
+    while not stop.is_set():
+        path = paths[index % len(paths)]
+        index += 1
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+            if conn is not None:
+                conn.close()
+            conn = None
+        with lock:
+            samples.append(((time.perf_counter() - t0) * 1000.0, ok))
+    if conn is not None:
+        conn.close()
+
+
+def run_mode(mode, args):
+    """Benchmark one serving mode and return its report."""
+    workdir = tempfile.mkdtemp(prefix=f'pdf_serving_{mode}_')
+    try:
+        seeded = seed_workdir(workdir, 1, 2, 10)
+        template_id = seeded['templates'][0][0]
+        form_id = seeded['forms'][0]
+        upload_folder = os.path.join(workdir, 'uploads')
+        make_large_pdf(os.path.join(upload_folder, f"filled_{form_id}_seed.pdf"), args.file_mb)
+
+        server_args = argparse.Namespace(server=mode, workers=args.workers, threads=args.threads,
+                                         timeout=max(30, int(args.duration) * 4))
+        log_path = os.path.join(workdir, 'server.log')
+        with open(log_path, 'w') as log_file:
+            port = _free_port()
+            server = start_server(server_args, workdir, port, log_file)
+            try:
+                lock = threading.Lock()
+                stop = threading.Event()
+                slow_results, fast_samples = [], []
+                slow_threads = [
+                    threading.Thread(target=slow_download,
+                                     args=(port, f'/download/{form_id}/pdf', args.read_kbps, stop, slow_results, lock))
+                    for _ in range(args.slow_clients)
+                ]
+                for thread in slow_threads:
+                    thread.start()
+                time.sleep(1)
+
+                paths = [f'/template/{template_id}/status', '/pdfs']
+                fast_threads = [
+                    threading.Thread(target=fast_requests, args=(port, paths, stop, fast_samples, lock))
+                    for _ in range(args.fast_clients)
+                ]
+                started = time.monotonic()
+                for thread in fast_threads:
+                    thread.start()
+                time.sleep(args.duration)
+                stop.set()
+                for thread in fast_threads + slow_threads:
+                    thread.join()
+                elapsed = time.monotonic() - started
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        latencies = [latency for latency, _ in fast_samples] or [0.0]
+        first_bytes = [first for first, _ in slow_results if first is not None]
+        return {
+            'fast_requests': len(fast_samples),
+            'fast_errors': sum(1 for _, ok in fast_samples if not ok),
+            'fast_throughput_rps': round(len(fast_samples) / elapsed, 2),
+            'fast_p50_ms': round(percentile(latencies, 50), 2),
+            'fast_p99_ms': round(percentile(latencies, 99), 2),
+            'fast_max_ms': round(max(latencies), 2),
+            'slow_clients_served': len(first_bytes),
+            'slow_first_byte_p50_ms': round(percentile(first_bytes, 50) * 1000, 2) if first_bytes else None,
+            'slow_mb_received': round(sum(received for _, received in slow_results) / (1024 * 1024), 2),
+        }
+    finally:
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI serving under slow clients')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'Modes to run (default: {",".join(MODES)})')
+    parser.add_argument('--slow-clients', type=int, default=32, help='Concurrent slow downloads')
+    parser.add_argument('--fast-clients', type=int, default=4, help='Concurrent clients issuing fast requests')
+    parser.add_argument('--read-kbps', type=int, default=256, help='Read rate of each slow client in KB/s')
+    parser.add_argument('--file-mb', type=int, default=20, help='Size of the downloaded PDF in MB')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds to measure fast requests')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes in both modes')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directories after the run')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Unknown mode: {mode}")
+
+    report = {
+        'config': {
+            'slow_clients': args.slow_clients,
+            'fast_clients': args.fast_clients,
+            'read_kbps': args.read_kbps,
+            'file_mb': args.file_mb,
+            'duration_s': args.duration,
+            'workers': args.workers,
+            'threads': args.threads,
+        },
+        'modes': {},
+    }
+    for mode in modes:
+        print(f"Running {mode}...", file=sys.stderr)
+        report['modes'][mode] = run_mode(mode, args)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
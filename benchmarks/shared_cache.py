@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark of the template fill cache under gunicorn.
+
+Starts the app under gunicorn against a scratch database seeded with
+``--templates`` templates of ``--fields`` fields, once per warm-up mode and
+worker count:
+
+* ``per-worker``: every worker parses the hot templates after it is forked
+  (the default of ``gunicorn.conf.py``);
+* ``shared``: ``WARMUP_SHARED=1``, the master parses them before forking and
+  the workers share them copy-on-write.
+
+Once warm-up is done (and after ``--fills`` form submissions per worker, which
+touch the cached templates), it reads ``/proc/<pid>/smaps_rollup`` of the
+master and every worker and reports, per run, the RSS, PSS and USS (private
+memory) of the workers and the PSS of the whole server, as JSON. RSS counts
+shared pages in every process that maps them; PSS splits them between the
+processes and USS leaves them out, so a shared cache shows up as a flat USS
+per worker and a total PSS that grows slowly with the number of workers.
+
+Linux only.
+
+Usage:
+    python benchmarks/shared_cache.py --workers 1,2,4 --templates 10 --fields 1000
+    python benchmarks/shared_cache.py --modes shared --workers 8 --output shared.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fixtures import field_data_for  # noqa: E402
+from benchmarks.loadtest import _free_port, seed_workdir, start_server  # noqa: E402
+
+MODES = ('per-worker', 'shared')
+WARMUP_LINE = re.compile(r'Warm-up preloaded (\d+) of (\d+) templates')
+SMAPS_FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty')
+
+
+def read_memory(pid):
+    """Return RSS, PSS and USS of a process in MB from ``smaps_rollup``."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in SMAPS_FIELDS:
+                values[key] = int(rest.split()[0]) / 1024.0
+    return {
+        'rss_mb': values['Rss'],
+        'pss_mb': values['Pss'],
+        'uss_mb': values['Private_Clean'] + values['Private_Dirty'],
+    }
+
+
+def child_pids(pid):
+    """Return the ids of the child processes of ``pid``."""
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_for_warmup(log_path, expected, workers, master_pid, timeout=120):
+    """Wait until ``expected`` warm-ups are logged and all workers are up."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(log_path) as f:
+            done = WARMUP_LINE.findall(f.read())
+        if len(done) >= expected and len(child_pids(master_pid)) >= workers:
+            return [int(preloaded) for preloaded, _ in done]
+        time.sleep(0.2)
+    raise RuntimeError(f"Warm-up did not finish within {timeout} seconds, see {log_path}")
+
+
+def submit_forms(port, templates, count):
+    """Submit ``count`` forms per template and return how many succeeded."""
+    ok = 0
+    for template_id, names in templates:
+        body = urlencode(field_data_for(names))
+        for _ in range(count):
+            # A new connection per request spreads the fills over the workers
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            try:
+                conn.request('POST', f'/submit_form/{template_id}', body,
+                             {'Content-Type': 'application/x-www-form-urlencoded'})
+                response = conn.getresponse()
+                response.read()
+                ok += response.status == 302 and response.getheader('Location', '').endswith('/pdfs')
+            finally:
+                conn.close()
+    return ok
+
+
+def run_case(mode, workers, workdir, seeded, args):
+    """Start gunicorn in ``mode`` with ``workers`` workers and measure its memory."""
+    extra_env = {
+        'WARMUP_SHARED': '1' if mode == 'shared' else '0',
+        'WARMUP_TEMPLATES': str(args.templates),
+        'WARMUP_RENDER': 'false',
+        # Warm-up reports itself at INFO level
+        'LOG_LEVEL': 'INFO',
+    }
+    log_path = os.path.join(workdir, f'server_{mode}_{workers}.log')
+    server_args = argparse.Namespace(server='gunicorn', workers=workers, threads=1, timeout=120)
+    with open(log_path, 'w') as log_file:
+        port = _free_port()
+        server = start_server(server_args, workdir, port, log_file, extra_env)
+        try:
+            preloaded = wait_for_warmup(log_path, 1 if mode == 'shared' else workers, workers, server.pid)
+            fills_ok = submit_forms(port, seeded['templates'], args.fills * workers) if args.fills else 0
+            time.sleep(args.settle)
+            master = read_memory(server.pid)
+            per_worker = [read_memory(pid) for pid in child_pids(server.pid)]
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def mean(key):
+        return round(sum(worker[key] for worker in per_worker) / len(per_worker), 2)
+
+    return {
+        'workers': workers,
+        'templates_preloaded': preloaded,
+        'fills_ok': fills_ok,
+        'worker_rss_mb': mean('rss_mb'),
+        'worker_pss_mb': mean('pss_mb'),
+        'worker_uss_mb': mean('uss_mb'),
+        'master_pss_mb': round(master['pss_mb'], 2),
+        'total_pss_mb': round(master['pss_mb'] + sum(worker['pss_mb'] for worker in per_worker), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure worker memory with per-worker and shared template caches')
+    parser.add_argument('--modes', default=','.join(MODES), help=f'Modes to run (default: {",".join(MODES)})')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts (default: 1,2,4)')
+    parser.add_argument('--templates', type=int, default=10, help='Templates seeded and preloaded')
+    parser.add_argument('--fields', type=int, default=1000, help='Fields per template')
+    parser.add_argument('--fills', type=int, default=2, help='Forms submitted per template and worker before measuring')
+    parser.add_argument('--settle', type=float, default=1.0, help='Seconds to wait before reading memory')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory after the run')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        parser.error('/proc/<pid>/smaps_rollup is not available on this system')
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Unknown mode: {mode}")
+    worker_counts = [int(count) for count in args.workers.split(',') if count.strip()]
+
+    workdir = tempfile.mkdtemp(prefix='pdf_shared_cache_')
+    report = {
+        'config': {
+            'templates': args.templates,
+            'fields': args.fields,
+            'fills': args.fills,
+            'workers': worker_counts,
+        },
+        'modes': {},
+    }
+    try:
+        # Seed filled forms too, so that every template counts as hot
+        seeded = seed_workdir(workdir, args.templates, args.templates, args.fields)
+        for mode in modes:
+            report['modes'][mode] = []
+            for workers in worker_counts:
+                print(f"Running {mode} with {workers} workers...", file=sys.stderr)
+                report['modes'][mode].append(run_case(mode, workers, workdir, seeded, args))
+    finally:
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark based on ``python -X importtime``.
+
+Imports a module in a fresh interpreter several times, parses the import
+time report written to stderr and prints a JSON summary with the total
+import time and the slowest top-level imports. It also checks that the
+heavy PDF libraries are not imported at startup.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --module pdf_processor --runs 10 --max-ms 300
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported inside the code paths that need them
+HEAVY_MODULES = ('PyPDF2', 'pdfrw', 'reportlab', 'pdf2image')
+
+
+def measure_import(module):
+    """Import ``module`` in a new interpreter and parse the importtime report.
+
+    Args:
+        module (str): Name of the module to import
+
+    Returns:
+        dict: Mapping of imported module name to cumulative time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, LOG_LEVEL='WARNING'),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Drop the separator space, keeping the two-space nesting indent
+            timings[name[1:].rstrip()] = int(cumulative.strip())
+        except ValueError:
+            continue
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure module import time with -X importtime')
+    parser.add_argument('--module', default='pdf_form_filler', help='Module to import (default: pdf_form_filler)')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreter runs')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest top-level imports to report')
+    parser.add_argument('--max-ms', type=float, help='Fail if the median import time exceeds this many ms')
+    args = parser.parse_args()
+
+    totals = []
+    heavy = set()
+    top_level = {}
+    for _ in range(args.runs):
+        timings = measure_import(args.module)
+        totals.append(timings.get(args.module, 0) / 1000.0)
+        for name, cumulative in timings.items():
+            stripped = name.strip()
+            if stripped.split('.')[0] in HEAVY_MODULES:
+                heavy.add(stripped.split('.')[0])
+            # Direct imports of the module are indented by exactly two spaces
+            if name.startswith('  ') and not name.startswith('   '):
+                top_level.setdefault(stripped, []).append(cumulative / 1000.0)
+
+    slowest = sorted(
+        ((name, statistics.median(values)) for name, values in top_level.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:args.top]
+
+    report = {
+        'module': args.module,
+        'runs': args.runs,
+        'median_ms': round(statistics.median(totals), 2),
+        'min_ms': round(min(totals), 2),
+        'max_ms': round(max(totals), 2),
+        'heavy_modules_imported': sorted(heavy),
+        'slowest_imports_ms': {name: round(ms, 2) for name, ms in slowest},
+    }
+    print(json.dumps(report, indent=2))
+
+    failed = False
+    if heavy:
+        print(f"Heavy PDF libraries imported at startup: {', '.join(sorted(heavy))}", file=sys.stderr)
+        failed = True
+    if args.max_ms is not None and report['median_ms'] > args.max_ms:
+        print(f"Median import time {report['median_ms']} ms exceeds {args.max_ms} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
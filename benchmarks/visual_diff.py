@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Visual regression check of filled PDFs across fill engines.
+
+Fills ``--forms`` forms with distinct values from each synthetic AcroForm
+fixture with two engines, renders every page of both outputs with poppler
+and compares them pixel by pixel. An engine is a fill method of
+pdf_processor, optionally followed by an optimization level:
+
+* ``native``: ``fill_pdf_form`` (pdfrw, with incremental fills disabled);
+* ``incremental``: ``_fill_pdf_form_incremental``;
+* ``fallback``: ``_fill_pdf_form_fallback`` (reportlab overlay);
+* ``native+size``, ``fallback+fast``...: the output optimized at that level.
+
+A side can also be a directory of renders saved by an earlier run with
+``--save``, to compare against another version of the code. Forms are
+spread over ``--jobs`` processes. Differences are computed with Pillow on
+grayscale renders: a pixel has changed if it differs by more than
+``--tolerance`` levels, and the score of a form is the largest share of
+changed pixels over its pages (1.0 if the page counts differ). The JSON
+report ranks forms by score; those above ``--threshold`` are mismatches,
+and ``--diff-dir`` receives an image of each with the changed pixels in
+red. Exits non-zero if there are mismatches. Requires poppler, like the app.
+
+Usage:
+    python benchmarks/visual_diff.py --a native --b native+size --fields 100,2000 --forms 20
+    python benchmarks/visual_diff.py --a native --b fallback --diff-dir /tmp/diffs --output diff.json
+    python benchmarks/visual_diff.py --a native --b native --save /tmp/renders_before
+    python benchmarks/visual_diff.py --a /tmp/renders_before --b native
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.bench_pdf import _int_list  # noqa: E402
+from benchmarks.bench_previews import form_data  # noqa: E402
+from benchmarks.fixtures import fixture_path  # noqa: E402
+
+METHODS = ('native', 'incremental', 'fallback')
+
+
+def parse_side(value):
+    """Validate an engine name or a directory of saved renders."""
+    if os.path.isdir(value):
+        return value
+    method, _, level = value.partition('+')
+    if method not in METHODS:
+        raise argparse.ArgumentTypeError(f"Unknown engine or missing directory: {value}")
+    if level and level not in ('none', 'fast', 'size'):
+        raise argparse.ArgumentTypeError(f"Unknown optimization level: {level}")
+    return value
+
+
+def _init_worker():
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import logging
+    logging.disable(logging.ERROR)
+
+
+def fill(engine, template_path, data, output_path):
+    """Fill a form with ``engine`` and optimize it if the engine names a level."""
+    import pdf_processor
+
+    method, _, level = engine.partition('+')
+    if method == 'native':
+        pdf_processor.FILL_INCREMENTAL_MB = 0
+        pdf_processor.PDF_OPTIMIZE = 'none'
+        pdf_processor.fill_pdf_form(template_path, data, output_path)
+    elif method == 'incremental':
+        pdf_processor._fill_pdf_form_incremental(template_path, data, output_path)
+    else:
+        pdf_processor._fill_pdf_form_fallback(template_path, data, output_path)
+    if level:
+        import optimize
+        optimize.optimize_pdf(output_path, level)
+
+
+def render(side, case, index, template_path, data, dpi, workdir):
+    """Return the pages of one form of ``side`` as grayscale images."""
+    from PIL import Image
+
+    if os.path.isdir(side):
+        case_dir = os.path.join(side, case)
+        if not os.path.isdir(case_dir):
+            return []
+        names = sorted(name for name in os.listdir(case_dir) if name.startswith(f'form{index:05d}_'))
+        return [Image.open(os.path.join(case_dir, name)).convert('L') for name in names]
+
+    from pdf2image import convert_from_path
+
+    pdf_path = os.path.join(workdir, f'{case}_{index}_{side}.pdf')
+    try:
+        fill(side, template_path, data, pdf_path)
+        return [page.convert('L') for page in convert_from_path(pdf_path, dpi=dpi, thread_count=1)]
+    finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+
+def diff_pages(page_a, page_b, tolerance):
+    """Compare two grayscale pages.
+
+    Returns:
+        tuple: (share of changed pixels, mean absolute difference from 0 to 1,
+        bounding box of the changes, mask of the changed pixels)
+    """
+    from PIL import ImageChops
+
+    if page_a.size != page_b.size:
+        return 1.0, 1.0, None, None
+    difference = ImageChops.difference(page_a, page_b)
+    histogram = difference.histogram()
+    total = page_a.width * page_a.height
+    changed = sum(histogram[tolerance + 1:])
+    mean = sum(level * count for level, count in enumerate(histogram)) / total / 255.0
+    if not changed:
+        return 0.0, mean, None, None
+    mask = difference.point(lambda level: 255 if level > tolerance else 0)
+    return changed / total, mean, mask.getbbox(), mask
+
+
+def compare_form(task):
+    """Fill, render and compare one form with both sides; run in a worker."""
+    from PIL import Image
+
+    case, index, template_path, names, args = task
+    data = form_data(names, index)
+    started = time.perf_counter()
+    try:
+        pages_a = render(args.a, case, index, template_path, data, args.dpi, args.workdir)
+        pages_b = render(args.b, case, index, template_path, data, args.dpi, args.workdir)
+    except Exception as e:
+        # A form that cannot be filled or rendered is the worst mismatch
+        return {'case': case, 'form': index, 'score': 1.0, 'error': str(e),
+                'seconds': round(time.perf_counter() - started, 3)}
+
+    if args.save:
+        case_dir = os.path.join(args.save, case)
+        os.makedirs(case_dir, exist_ok=True)
+        for number, page in enumerate(pages_b, 1):
+            page.save(os.path.join(case_dir, f'form{index:05d}_p{number:04d}.png'))
+
+    worst, worst_page, worst_bbox, worst_mask, mean_diff = 0.0, None, None, None, 0.0
+    for number, (page_a, page_b) in enumerate(zip(pages_a, pages_b), 1):
+        share, mean, bbox, mask = diff_pages(page_a, page_b, args.tolerance)
+        mean_diff = max(mean_diff, mean)
+        if share > worst:
+            worst, worst_page, worst_bbox, worst_mask = share, number, bbox, mask
+    result = {
+        'case': case,
+        'form': index,
+        'pages_a': len(pages_a),
+        'pages_b': len(pages_b),
+        'score': 1.0 if len(pages_a) != len(pages_b) else round(worst, 6),
+        'mean_diff': round(mean_diff, 6),
+        'worst_page': worst_page,
+        'bbox': worst_bbox,
+        'diff_image': None,
+    }
+
+    if args.diff_dir and worst_mask is not None and result['score'] > args.threshold:
+        page = pages_b[worst_page - 1].convert('RGB')
+        red = Image.new('RGB', page.size, (255, 0, 0))
+        path = os.path.join(args.diff_dir, f"{case}_form{index:05d}_p{worst_page:04d}.png")
+        Image.composite(red, page, worst_mask).save(path)
+        result['diff_image'] = path
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render and compare filled PDFs from two engines')
+    parser.add_argument('--a', type=parse_side, default='native',
+                        help=f'Baseline engine ({", ".join(METHODS)}, optionally +level) or directory of renders')
+    parser.add_argument('--b', type=parse_side, default='native+size',
+                        help='Candidate engine or directory of renders')
+    parser.add_argument('--fields', type=_int_list, default=(100, 2000), help='Comma separated field counts')
+    parser.add_argument('--pages', type=_int_list, default=(1, 5), help='Comma separated page counts')
+    parser.add_argument('--payload-mb', type=_int_list, default=(0,),
+                        help='Comma separated sizes of page images in MB, like scanned templates')
+    parser.add_argument('--forms', type=int, default=20, help='Forms filled and compared per fixture')
+    parser.add_argument('--dpi', type=int, default=72, help='Resolution of the renders')
+    parser.add_argument('--tolerance', type=int, default=32,
+                        help='Gray levels by which a pixel may differ without counting as changed')
+    parser.add_argument('--threshold', type=float, default=0.0005,
+                        help='Share of changed pixels above which a form is a mismatch')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--diff-dir', help='Write an image of every mismatch here, changes in red')
+    parser.add_argument('--save', help='Save the renders of --b here, for a later run with --a DIR')
+    parser.add_argument('--top', type=int, default=10, help='Mismatches printed to stderr')
+    parser.add_argument('--fixture-dir', default=os.path.join(tempfile.gettempdir(), 'pdf_bench_fixtures'),
+                        help='Directory for generated fixtures (reused between runs)')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    for directory in (args.diff_dir, args.save):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    args.workdir = tempfile.mkdtemp(prefix='pdf_visual_diff_')
+    # Fixtures are generated here so that workers do not race to write them
+    tasks = []
+    for payload_mb in args.payload_mb:
+        for num_pages in args.pages:
+            for num_fields in args.fields:
+                template_path, names = fixture_path(args.fixture_dir, num_fields, num_pages, payload_mb)
+                case = f"{num_fields}f_{num_pages}p" + (f"_{payload_mb}mb" if payload_mb else '')
+                tasks.extend((case, index, template_path, names, args) for index in range(args.forms))
+
+    started = time.perf_counter()
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(args.jobs, initializer=_init_worker) as pool:
+            results = list(pool.imap_unordered(compare_form, tasks))
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    elapsed = time.perf_counter() - started
+
+    results.sort(key=lambda result: (-result['score'], result['case'], result['form']))
+    mismatches = [result for result in results if result['score'] > args.threshold]
+    for result in mismatches[:args.top]:
+        if 'error' in result:
+            detail = result['error']
+        elif result['pages_a'] != result['pages_b']:
+            detail = f"{result['pages_a']} pages against {result['pages_b']}"
+        else:
+            detail = f"page {result['worst_page']}  bbox {result['bbox']}"
+        print(f"{result['case']:<16} form {result['form']:>5}  score {result['score']:.4%}  {detail}",
+              file=sys.stderr)
+    print(f"{len(mismatches)} of {len(results)} forms differ between {args.a} and {args.b} "
+          f"({elapsed:.1f}s with {args.jobs} jobs)", file=sys.stderr)
+
+    report = {
+        'config': {
+            'a': args.a,
+            'b': args.b,
+            'dpi': args.dpi,
+            'tolerance': args.tolerance,
+            'threshold': args.threshold,
+            'jobs': args.jobs,
+        },
+        'summary': {
+            'forms': len(results),
+            'mismatches': len(mismatches),
+            'seconds': round(elapsed, 2),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
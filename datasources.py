@@ -0,0 +1,342 @@
+"""Streaming data sources for batch fills.
+
+Rows are read from a CSV file, a JSON Lines file or a SQL query in chunks of
+``chunk_size`` records and never all at once: files are read line by line
+and queries run through a server-side cursor (``stream_results``), so memory
+use depends on the chunk size and not on the size of the source.
+
+:func:`fill_batch` maps each chunk onto the fields of a template, coerces
+and validates it column-wise (:mod:`fieldtypes`), stores one filled form per
+row and either queues a fill job per form (``flask fill-batch --queue``) or
+fills them in the same process.
+"""
+
+import csv
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from flask import current_app
+
+import fieldtypes
+import schema
+import workqueue
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl', 'sql')
+DEFAULT_CHUNK_SIZE = 500
+# Invalid rows reported individually in the log before the rest are only counted
+MAX_LOGGED_ERRORS = 20
+
+Chunk = List[Dict[str, Any]]
+
+
+class DataSourceError(Exception):
+    """Exception raised when a data source cannot be read or mapped."""
+    pass
+
+
+def _chunks(records: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[Chunk]:
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Chunk]:
+    """Read a CSV file with a header row in chunks of records."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from _chunks(csv.DictReader(f), chunk_size)
+
+
+def read_jsonl(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Chunk]:
+    """Read a JSON Lines file (one JSON object per line) in chunks of records.
+
+    Raises:
+        DataSourceError: If a line is not a JSON object
+    """
+    def records():
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise DataSourceError(f"{path}:{number}: invalid JSON: {e}")
+                if not isinstance(record, dict):
+                    raise DataSourceError(f"{path}:{number}: expected a JSON object")
+                yield record
+
+    yield from _chunks(records(), chunk_size)
+
+
+def read_sql(query: str, chunk_size: int = DEFAULT_CHUNK_SIZE, url: Optional[str] = None) -> Iterator[Chunk]:
+    """Run a query through a server-side cursor and read its rows in chunks.
+
+    Args:
+        query: SQL query; the column names are the record keys
+        chunk_size: Rows fetched from the server at a time
+        url: Database URL, the app database when None
+
+    Must run inside an app context when ``url`` is None.
+    """
+    from sqlalchemy import create_engine, text
+
+    if url:
+        engine = create_engine(url)
+    else:
+        from app import db
+        engine = db.engine
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(query))
+            for partition in result.mappings().partitions(chunk_size):
+                yield [dict(row) for row in partition]
+    finally:
+        if url:
+            engine.dispose()
+
+
+def detect_format(source: str) -> str:
+    """Guess the format of a source file from its extension."""
+    extension = os.path.splitext(source)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise DataSourceError(f"Cannot tell the format of {source}, pass it explicitly")
+
+
+def open_source(source: Optional[str], fmt: Optional[str] = None, query: Optional[str] = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Chunk]:
+    """Open a data source as an iterator of record chunks.
+
+    Args:
+        source: Path of a CSV or JSON Lines file, or the database URL of a
+            query (the app database when None)
+        fmt: 'csv', 'jsonl' or 'sql'; guessed from the file extension, or
+            'sql' when a query is given
+        query: SQL query to run
+
+    Raises:
+        DataSourceError: If the format is unknown or the file is missing
+    """
+    fmt = fmt or ('sql' if query else detect_format(source or ''))
+    if fmt == 'sql':
+        if not query:
+            raise DataSourceError('A query is needed to read from a database')
+        return read_sql(query, chunk_size, source)
+    if fmt not in FORMATS:
+        raise DataSourceError(f"Unknown format: {fmt}")
+    if not source or not os.path.isfile(source):
+        raise DataSourceError(f"Source file not found: {source}")
+    return read_csv(source, chunk_size) if fmt == 'csv' else read_jsonl(source, chunk_size)
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r'[^0-9a-z]+', '_', name.lower()).strip('_')
+
+
+class FieldMapping:
+    """Maps the columns of a data source onto the fields of a template.
+
+    Fields named in ``explicit`` take the given column. Other fields take the
+    column of the same name, or failing that the one whose name matches when
+    case and punctuation are ignored (``First Name`` for ``first_name``).
+
+    Args:
+        field_names: Field names of the template
+        explicit: Field name to source column
+    """
+
+    def __init__(self, field_names: Iterable[str], explicit: Optional[Dict[str, str]] = None):
+        self.field_names = list(field_names)
+        self.explicit = dict(explicit or {})
+        unknown = sorted(set(self.explicit) - set(self.field_names))
+        if unknown:
+            raise DataSourceError(f"Mapping names fields the template does not have: {', '.join(unknown)}")
+
+    def resolve(self, columns: Iterable[str]) -> Dict[str, str]:
+        """Return the column of every field found in ``columns``.
+
+        Raises:
+            DataSourceError: If an explicitly mapped column is missing
+        """
+        columns = list(columns)
+        column_set = set(columns)
+        missing = sorted(column for column in self.explicit.values() if column not in column_set)
+        if missing:
+            raise DataSourceError(f"Mapped columns not found in the source: {', '.join(missing)}")
+        normalized = {}
+        for column in columns:
+            normalized.setdefault(_normalize(column), column)
+
+        resolved = {}
+        for name in self.field_names:
+            if name in self.explicit:
+                resolved[name] = self.explicit[name]
+            elif name in column_set:
+                resolved[name] = name
+            elif _normalize(name) in normalized:
+                resolved[name] = normalized[_normalize(name)]
+        return resolved
+
+
+def parse_mapping(items: Iterable[str] = (), mapping_file: Optional[str] = None) -> Dict[str, str]:
+    """Build an explicit field mapping from ``field=column`` items and a JSON file.
+
+    Items override entries of the file, which holds a JSON object of field
+    name to column.
+
+    Raises:
+        DataSourceError: If an item or the file is malformed
+    """
+    mapping = {}
+    if mapping_file:
+        try:
+            with open(mapping_file, encoding='utf-8') as f:
+                loaded = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise DataSourceError(f"Cannot read mapping file {mapping_file}: {e}")
+        if not isinstance(loaded, dict):
+            raise DataSourceError(f"Mapping file {mapping_file} must hold a JSON object")
+        mapping.update({str(field): str(column) for field, column in loaded.items()})
+    for item in items:
+        field, sep, column = item.partition('=')
+        if not sep or not field.strip() or not column.strip():
+            raise DataSourceError(f"Expected field=column, got {item!r}")
+        mapping[field.strip()] = column.strip()
+    return mapping
+
+
+@dataclass
+class BatchResult:
+    """Outcome of a batch fill."""
+
+    rows: int = 0
+    queued: int = 0
+    filled: int = 0
+    invalid: int = 0
+    failed: int = 0
+
+
+def fill_batch(template_id: int, chunks: Iterable[Chunk], mapping: Optional[Dict[str, str]] = None,
+               queue: Optional[bool] = None, skip_invalid: bool = True) -> BatchResult:
+    """Create and fill one form per source row.
+
+    Each chunk is mapped, coerced and stored in its own transaction, and the
+    session is cleared after it, so only one chunk is held at a time. JSON
+    Lines records may differ in their keys, so keys first seen in a later
+    chunk are mapped from that chunk on. With ``queue`` a fill job is queued
+    per form for ``flask worker``; otherwise the forms are filled here with
+    the same job handler, one by one.
+
+    Must run inside an app context.
+
+    Args:
+        template_id: ID of a ready template
+        chunks: Chunks of records, see :func:`open_source`
+        mapping: Explicit field name to column mapping
+        queue: Queue fill jobs; defaults to ``FILL_MODE == 'queue'``
+        skip_invalid: Skip rows with invalid values instead of stopping
+
+    Returns:
+        Counts of rows read, forms queued or filled, and rows skipped or failed
+
+    Raises:
+        DataSourceError: If the template cannot be filled or the mapping does not fit
+        fieldtypes.FieldValueError: If a row is invalid and ``skip_invalid`` is False
+    """
+    from app import db
+    from models import PDFTemplate, FilledForm
+
+    template = db.session.get(PDFTemplate, template_id)
+    if template is None or template.deleted_at is not None:
+        raise DataSourceError(f"Template {template_id} not found")
+    if not template.is_ready:
+        raise DataSourceError(f"Form fields of template {template_id} are not ready")
+    if queue is None:
+        queue = current_app.config['FILL_MODE'] == 'queue'
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+
+    compiled = schema.for_template(template)
+    field_mapping = FieldMapping(compiled.names, mapping)
+    fill, on_failure = workqueue.HANDLERS['fill']
+    columns: Dict[str, None] = {}
+    resolved: Dict[str, str] = {}
+    result = BatchResult()
+
+    for chunk in chunks:
+        new_columns = dict.fromkeys(key for record in chunk for key in record if key not in columns)
+        if new_columns:
+            columns.update(new_columns)
+            # Fields keep the column they were first mapped to
+            found = field_mapping.resolve(columns)
+            added = [name for name in found if name not in resolved]
+            resolved = {**found, **resolved}
+            if added and result.rows:
+                logger.info(f"Keys first seen after row {result.rows} map {len(added)} more fields: "
+                            f"{', '.join(added[:10])}")
+
+        records = [{name: record.get(column) for name, column in resolved.items()} for record in chunk]
+        try:
+            values = fieldtypes.coerce_records(compiled.fields, records)
+        except fieldtypes.FieldValueError as e:
+            if not skip_invalid:
+                # Number the rows from the start of the source
+                raise fieldtypes.FieldValueError([(result.rows + row, name, value) for row, name, value in e.errors])
+            bad_rows = {row for row, _, _ in e.errors}
+            for row, name, value in e.errors[:max(0, MAX_LOGGED_ERRORS - result.invalid)]:
+                logger.warning(f"Skipping row {result.rows + row + 1}: invalid value {value!r} for field '{name}'")
+            records = [record for i, record in enumerate(records) if i not in bad_rows]
+            values = fieldtypes.coerce_records(compiled.fields, records)
+            result.invalid += len(bad_rows)
+        result.rows += len(chunk)
+
+        # The session is cleared after every chunk
+        template = db.session.get(PDFTemplate, template_id)
+        forms = []
+        for data in values:
+            filled_form = FilledForm(template_id=template_id, status=FilledForm.STATUS_FILLING)
+            filled_form.set_data(data)
+            forms.append(filled_form)
+        db.session.add_all(forms)
+        db.session.flush()
+        for filled_form in forms:
+            filled_form.assign_output_paths(template, upload_folder)
+            if queue:
+                workqueue.enqueue('fill', {'filled_form_id': filled_form.id})
+        form_ids = [filled_form.id for filled_form in forms]
+        db.session.commit()
+        db.session.expunge_all()
+
+        if queue:
+            result.queued += len(form_ids)
+        else:
+            for form_id in form_ids:
+                payload = {'filled_form_id': form_id}
+                try:
+                    fill(payload)
+                    db.session.commit()
+                    result.filled += 1
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Filling form {form_id} failed: {str(e)}")
+                    on_failure(payload, str(e))
+                    result.failed += 1
+                db.session.expunge_all()
+        logger.info(f"Batch fill of template {template_id}: {result.rows} rows read")
+
+    unmapped = [name for name in compiled.names if name not in resolved]
+    if unmapped:
+        logger.warning(f"{len(unmapped)} fields have no source column and were left empty: "
+                       f"{', '.join(unmapped[:10])}")
+    return result
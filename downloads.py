@@ -0,0 +1,105 @@
+"""Serving stored files with HTTP caching and optional proxy offload.
+
+Files are sent with strong ETags derived from their content digest,
+``Last-Modified`` from the file, ``Cache-Control`` and byte-range support, so
+browsers revalidate previews with a 304 instead of downloading them again and
+interrupted PDF downloads can be resumed.
+
+With ``SENDFILE_MODE`` set, the worker only emits headers and the front proxy
+streams the file:
+
+* ``x-sendfile``: ``X-Sendfile: <absolute path>`` (Apache mod_xsendfile,
+  lighttpd)
+* ``x-accel-redirect``: ``X-Accel-Redirect: <SENDFILE_PREFIX><path relative
+  to UPLOAD_FOLDER>`` (nginx ``internal`` location)
+"""
+
+import logging
+import os
+from typing import Optional
+
+from flask import Flask, Response, current_app, request
+from werkzeug.utils import send_file
+
+logger = logging.getLogger(__name__)
+
+SENDFILE_MODES = ('', 'x-sendfile', 'x-accel-redirect')
+
+# Browsers may keep versioned files for a year without revalidating
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def init_app(app: Flask) -> None:
+    """Read the offload settings for ``app``.
+
+    Reads ``SENDFILE_MODE`` (one of :data:`SENDFILE_MODES`, empty disables
+    offload) and ``SENDFILE_PREFIX`` (internal nginx location mapped to the
+    upload folder).
+    """
+    mode = os.environ.get('SENDFILE_MODE', '').strip().lower()
+    if mode not in SENDFILE_MODES:
+        logger.warning(f"Unknown SENDFILE_MODE {mode!r}, serving files directly")
+        mode = ''
+    app.config.setdefault('SENDFILE_MODE', mode)
+    app.config.setdefault('SENDFILE_PREFIX', os.environ.get('SENDFILE_PREFIX', '/protected-uploads/'))
+
+
+def _accel_path(path: str) -> Optional[str]:
+    """Map ``path`` to the internal nginx location, None if outside the upload folder."""
+    root = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    path = os.path.realpath(path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return current_app.config['SENDFILE_PREFIX'].rstrip('/') + '/' + os.path.relpath(path, root)
+
+
+def send_stored_file(path: str, mimetype: str, download_name: str, etag: Optional[str] = None,
+                     as_attachment: bool = True, immutable: bool = False) -> Response:
+    """Send a stored file with validators, caching headers and range support.
+
+    Args:
+        path: Absolute path of the file
+        mimetype: Content type of the response
+        download_name: File name offered to the browser
+        etag: Strong ETag for the content (e.g. its SHA-256), or None to
+            derive a weak validator from the modification time and size
+        as_attachment: Send ``Content-Disposition: attachment`` (False for
+            inline previews)
+        immutable: Content at this URL never changes, so it may be cached
+            without revalidation
+
+    Returns:
+        200, 206 or 304 response, with an empty body when offloaded
+    """
+    mode = current_app.config['SENDFILE_MODE']
+    accel_path = _accel_path(path) if mode == 'x-accel-redirect' else None
+    offload = mode == 'x-sendfile' or accel_path is not None
+
+    environ = request.environ
+    if offload:
+        # The proxy answers range requests itself when it streams the file
+        environ = {key: value for key, value in environ.items() if key not in ('HTTP_RANGE', 'HTTP_IF_RANGE')}
+
+    response = send_file(
+        path,
+        environ,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        etag=etag if etag else True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else None,
+        use_x_sendfile=offload,
+        response_class=current_app.response_class,
+        conditional=True,
+    )
+
+    # Generated files belong to whoever filled the form: never let shared caches keep them
+    response.cache_control.public = None
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.immutable = True
+
+    if accel_path is not None and 'X-Sendfile' in response.headers:
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = accel_path
+    return response
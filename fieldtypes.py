@@ -0,0 +1,156 @@
+"""Form field types and coercion of submitted values.
+
+Extraction records the type of every field (``FormField.field_type``) and,
+for buttons and choice lists, the values the PDF accepts
+(``FormField.options``):
+
+* ``text``: free text.
+* ``checkbox``: the export name of the checked state (usually ``Yes``) or
+  ``Off``.
+* ``radio``: the export name of one of the buttons, or ``Off``.
+* ``choice``: one of the options of a combo box or list box.
+
+Values are coerced column by column: every column of a batch (one list of
+raw values per field) is reduced to its distinct values, each distinct value
+is checked and translated once, and the column is then mapped through the
+resulting table. Batches of CSV or JSON Lines rows repeat the same few
+checkbox and choice values over and over, so the per-value cost is a single
+dictionary lookup done in C.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+TEXT = 'text'
+CHECKBOX = 'checkbox'
+RADIO = 'radio'
+CHOICE = 'choice'
+TYPES = (TEXT, CHECKBOX, RADIO, CHOICE)
+
+# Export name of the unchecked state of buttons
+OFF = 'Off'
+# Export name of checkboxes whose PDF does not name their checked state
+DEFAULT_ON = 'Yes'
+
+# Raw values accepted for checked and unchecked checkboxes, compared lowercased
+TRUE_VALUES = frozenset({'1', 'true', 'yes', 'y', 'on', 'x', 'checked'})
+FALSE_VALUES = frozenset({'', '0', 'false', 'no', 'n', 'off', 'unchecked'})
+
+# A field as held by a compiled schema: (name, type, required, options)
+Field = Tuple[str, str, bool, Tuple[str, ...]]
+
+
+class FieldValueError(ValueError):
+    """Exception raised when values do not fit the type of their field.
+
+    Attributes:
+        errors: List of (row index, field name, raw value) of the rejected values
+    """
+
+    def __init__(self, errors: List[Tuple[int, str, Any]]):
+        row, name, value = errors[0]
+        more = f" and {len(errors) - 1} more" if len(errors) > 1 else ''
+        super().__init__(f"Invalid value {value!r} for field '{name}' in row {row + 1}{more}")
+        self.errors = errors
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value).strip()
+
+
+def _translation(field: Field, raw: Any) -> Optional[str]:
+    """Translate one distinct raw value of ``field``, None if it is invalid."""
+    _, field_type, _, options = field
+    value = _text(raw)
+    if field_type == CHECKBOX:
+        on = options[0] if options else DEFAULT_ON
+        lowered = value.lower()
+        if lowered in TRUE_VALUES or lowered == on.lower():
+            return on
+        if lowered in FALSE_VALUES:
+            return OFF
+        return None
+    if field_type in (RADIO, CHOICE):
+        if not value:
+            return OFF if field_type == RADIO else ''
+        if not options or value in options:
+            return value
+        if field_type == RADIO and value.lower() == OFF.lower():
+            return OFF
+        # Accept the options regardless of case
+        matches = [option for option in options if option.lower() == value.lower()]
+        return matches[0] if len(matches) == 1 else None
+    return value
+
+
+def coerce_column(field: Field, column: Sequence[Any]) -> Tuple[List[str], List[int]]:
+    """Coerce the raw values of one field.
+
+    Args:
+        field: Field tuple of a compiled schema
+        column: Raw values of the field, one per row
+
+    Returns:
+        (coerced values, indexes of the rows holding invalid values)
+    """
+    if field[1] == TEXT:
+        return [_text(value) for value in column], []
+
+    # Unhashable values (JSON lists or objects) are never valid
+    column = [value if isinstance(value, (str, int, float, bool, type(None))) else repr(value) for value in column]
+    table = {value: _translation(field, value) for value in set(column)}
+    coerced = list(map(table.__getitem__, column))
+    if None not in table.values():
+        return coerced, []
+    invalid = [i for i, value in enumerate(coerced) if value is None]
+    return coerced, invalid
+
+
+def coerce_columns(fields: Iterable[Field], columns: Dict[str, Sequence[Any]],
+                   rows: Optional[int] = None) -> Dict[str, List[str]]:
+    """Coerce a batch of values held column-wise.
+
+    Fields without a column are filled with their empty value.
+
+    Args:
+        fields: Field tuples of a compiled schema
+        columns: Raw values per field name, all of the same length
+        rows: Number of rows, needed when ``columns`` may be empty
+
+    Returns:
+        Coerced values per field name
+
+    Raises:
+        FieldValueError: If any value does not fit its field, listing all of them
+    """
+    if rows is None:
+        rows = len(next(iter(columns.values()))) if columns else 0
+    coerced, errors = {}, []
+    for field in fields:
+        name = field[0]
+        column = columns.get(name)
+        values, invalid = coerce_column(field, column if column is not None else [None] * rows)
+        coerced[name] = values
+        errors.extend((i, name, column[i]) for i in invalid)
+    if errors:
+        errors.sort()
+        raise FieldValueError(errors)
+    return coerced
+
+
+def coerce_records(fields: Sequence[Field], records: Sequence[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Coerce a batch of records (dicts of field name to raw value).
+
+    The records are transposed into columns, coerced with
+    :func:`coerce_columns` and transposed back.
+
+    Raises:
+        FieldValueError: If any value does not fit its field
+    """
+    names = [field[0] for field in fields]
+    columns = {name: [record.get(name) for record in records] for name in names}
+    coerced = coerce_columns(fields, columns, rows=len(records))
+    return [dict(zip(names, row)) for row in zip(*(coerced[name] for name in names))] if names else [{} for _ in records]
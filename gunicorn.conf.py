@@ -0,0 +1,42 @@
+"""gunicorn settings read from the working directory.
+
+Only hooks are set here; pass everything else on the command line as before,
+e.g. ``gunicorn --bind 0.0.0.0:5000 --workers 4 main:app``.
+
+With ``WARMUP_SHARED=1`` the app is preloaded and the hot templates are
+parsed once in the master, and workers share them copy-on-write; otherwise
+every worker warms up its own cache after it is forked. Either way the
+job worker and periodic sweeps and compactions are started in each worker
+after it is forked, never in the master.
+"""
+
+import os
+
+# Warm-up and background threads run per worker in post_fork rather than when
+# the app is loaded, which happens in the master when the app is preloaded
+os.environ.setdefault('WARMUP_DEFERRED', '1')
+os.environ.setdefault('BACKGROUND_DEFERRED', '1')
+
+SHARED = os.environ.get('WARMUP_SHARED', '').lower() in ('1', 'true', 'yes')
+if SHARED:
+    preload_app = True
+
+
+def when_ready(server):
+    """Parse the hot templates in the master before the first workers are forked."""
+    if SHARED:
+        import warmup
+        from app import app
+
+        warmup.preload_shared(app)
+
+
+def post_fork(server, worker):
+    """Start the background threads of the new worker and preload its hot templates."""
+    import warmup
+    from app import app, start_background
+
+    start_background(app)
+    if not SHARED:
+        # Otherwise the cache was inherited from the master
+        warmup.start(app)
@@ -0,0 +1,210 @@
+"""Background jobs run in a local worker pool.
+
+Template ingestion (form field extraction) runs here so that ``upload_pdf``
+can return as soon as the file is stored. Job state is persisted on the
+``PDFTemplate`` row (status, attempts, error message), so progress is visible
+to every worker and failed jobs can be retried.
+
+Purging deleted rows and periodic maintenance such as the orphan file sweep
+run in the same pool.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from flask import Flask, current_app
+
+import metrics
+import profiling
+import storage
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retry N is 2 ** (N - 1) * this value
+RETRY_BACKOFF_SECONDS = 1.0
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def init_app(app: Flask) -> None:
+    """Create the worker pool for ``app``.
+
+    Reads ``EXTRACTION_WORKERS`` (pool size), ``EXTRACTION_MAX_ATTEMPTS``
+    and ``EXTRACTION_STALE_MINUTES`` (after which a template still marked
+    as processing may be retried, e.g. when its worker was restarted).
+    """
+    global _executor
+    app.config.setdefault('EXTRACTION_WORKERS', int(os.environ.get('EXTRACTION_WORKERS', '2')))
+    app.config.setdefault('EXTRACTION_MAX_ATTEMPTS', int(os.environ.get('EXTRACTION_MAX_ATTEMPTS', '3')))
+    app.config.setdefault('EXTRACTION_STALE_MINUTES', int(os.environ.get('EXTRACTION_STALE_MINUTES', '15')))
+    _executor = ThreadPoolExecutor(
+        max_workers=app.config['EXTRACTION_WORKERS'],
+        thread_name_prefix='extraction',
+    )
+
+
+def submit(app: Flask, queue: str, func: Callable, *args, **kwargs) -> Future:
+    """Run ``func(*args, **kwargs)`` in the pool inside an app context.
+
+    Args:
+        app: Flask application, used to open an app context in the worker
+        queue: Name of the job kind, reported in the ``queue_depth`` metric
+        func: Job function; exceptions are logged, not raised
+
+    Returns:
+        Future of the job
+    """
+    metrics.QUEUE_DEPTH.inc(queue=queue)
+    return _executor.submit(_run, app, queue, func, args, kwargs)
+
+
+def _run(app: Flask, queue: str, func: Callable, args: tuple, kwargs: dict):
+    metrics.QUEUE_DEPTH.dec(queue=queue)
+    with app.app_context():
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"{queue} job {func.__name__} crashed: {str(e)}", exc_info=True)
+
+
+def schedule(app: Flask, queue: str, interval_seconds: float, func: Callable) -> threading.Thread:
+    """Submit ``func`` to the pool every ``interval_seconds``.
+
+    The timer runs in a daemon thread, so every process that calls this
+    runs its own schedule.
+
+    Returns:
+        The timer thread
+    """
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            submit(app, queue, func).result()
+
+    thread = threading.Thread(target=loop, name=f"schedule-{queue}", daemon=True)
+    thread.start()
+    return thread
+
+
+def submit_extraction(app: Flask, template_id: int, profile: bool = False) -> Future:
+    """Queue form field extraction for a template.
+
+    Args:
+        app: Flask application, used to open an app context in the worker
+        template_id: ID of the template in processing state
+        profile: Capture a profile of the extraction
+
+    Returns:
+        Future of the job
+    """
+    return submit(app, 'extraction', extract_template_fields, template_id, profile)
+
+
+def submit_purge(app: Flask, template_id: Optional[int] = None) -> Future:
+    """Queue removal of rows marked as deleted, with their files.
+
+    Args:
+        app: Flask application, used to open an app context in the worker
+        template_id: Purge this template only, or everything marked as deleted
+
+    Returns:
+        Future of the job
+    """
+    import sweeper
+
+    max_per_second = app.config['SWEEP_MAX_FILES_PER_SECOND']
+    if template_id is None:
+        return submit(app, 'purge', sweeper.purge_deleted, max_per_second=max_per_second)
+    return submit(app, 'purge', sweeper.purge_template, template_id, max_per_second=max_per_second)
+
+
+def is_stale(template) -> bool:
+    """Whether a processing template has waited long enough to be retried.
+
+    ``processing_started_at`` is set when extraction is queued and again when
+    each attempt starts; a template without it is not considered stale.
+    """
+    if template.status != template.STATUS_PROCESSING or template.processing_started_at is None:
+        return False
+    timeout = timedelta(minutes=current_app.config['EXTRACTION_STALE_MINUTES'])
+    return datetime.utcnow() - template.processing_started_at > timeout
+
+
+def extract_template_fields(template_id: int, profile: bool = False) -> None:
+    """Extract and store the form fields of a template, with retries.
+
+    Must run inside an app context. The template ends in ready state with
+    its fields stored, or in failed state with the last error message.
+
+    Args:
+        template_id: ID of the template to process
+        profile: Capture a profile of the extraction
+    """
+    from app import db
+    from models import PDFTemplate
+    import pdf_processor
+
+    max_attempts = current_app.config['EXTRACTION_MAX_ATTEMPTS']
+    while True:
+        template = db.session.get(PDFTemplate, template_id)
+        if template is None:
+            logger.info(f"Template {template_id} was deleted before extraction")
+            return
+
+        template.attempts = (template.attempts or 0) + 1
+        template.processing_started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            label = f"extract template={template_id}"
+            if not storage.fetch(template.file_path):
+                raise FileNotFoundError('Template file is missing from storage')
+            with profiling.session(label, profile) as session:
+                fields = pdf_processor.extract_field_specs(template.file_path)
+        except Exception as e:
+            db.session.rollback()
+            template = db.session.get(PDFTemplate, template_id)
+            if template is None:
+                return
+            template.error_message = str(e)
+            if template.attempts < max_attempts:
+                db.session.commit()
+                delay = RETRY_BACKOFF_SECONDS * 2 ** (template.attempts - 1)
+                logger.warning(
+                    f"Extraction attempt {template.attempts} for template {template_id} failed: {str(e)}, "
+                    f"retrying in {delay:.0f}s"
+                )
+                time.sleep(delay)
+                continue
+            template.status = PDFTemplate.STATUS_FAILED
+            db.session.commit()
+            logger.error(f"Extraction for template {template_id} failed after {template.attempts} attempts")
+            return
+
+        if not fields:
+            template.status = PDFTemplate.STATUS_FAILED
+            template.error_message = 'No form fields found in the PDF'
+            db.session.commit()
+            return
+
+        if session:
+            template.profile_path = session.write(f"{template.file_path}.profile.txt")
+            storage.publish(template.profile_path)
+
+        # Replaces fields left over from an earlier partial attempt, and copies
+        # the unchanged ones of the previous version
+        versions.store_fields(template, fields)
+        # Makes every process recompile its cached schema of the template
+        template.schema_version = (template.schema_version or 0) + 1
+        template.status = PDFTemplate.STATUS_READY
+        template.error_message = None
+        versions.mark_superseded(template)
+        db.session.commit()
+        logger.info(f"Extracted {len(fields)} fields for template {template_id}")
+        return
@@ -0,0 +1,289 @@
+"""In-process metrics with Prometheus text exposition.
+
+Provides thread-safe counters, gauges and histograms that are cheap enough to
+update on the hot path (a lock and a bisect per observation) and a registry
+that renders them in the Prometheus text format for the ``/metrics`` endpoint.
+No external service or client library is required.
+
+Metrics live in the memory of the process that records them, so with several
+gunicorn workers each worker reports its own values.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for a metric family with an optional set of label names."""
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A monotonically increasing counter."""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the counter by ``amount``."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the current value for the given labels."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down, such as a queue depth."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge to ``value``."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increase the gauge by ``amount``."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrease the gauge by ``amount``."""
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        """Return the current value for the given labels."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """A histogram of observed values with fixed upper bounds."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record one observation."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the ``with`` block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Return the number of observations for the given labels."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{self._labels(key, {'le': _format_value(bound)})} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add ``metric`` to the registry, returning an existing one with the same name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Create and register a counter."""
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Create and register a gauge."""
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Create and register a histogram."""
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# PDF processing
+PDF_STAGE_SECONDS = histogram(
+    'pdf_stage_duration_seconds', 'Duration of pdf_processor stages', ('stage',))
+PDF_STAGE_ERRORS = counter(
+    'pdf_stage_errors_total', 'Failed pdf_processor stages', ('stage',))
+PDF_FILL_FALLBACK = counter(
+    'pdf_fill_fallback_total', 'Fills that fell back to the reportlab overlay method')
+PDF_FIELDS_FILLED = counter(
+    'pdf_fields_filled_total', 'Form fields written into filled PDFs', ('method',))
+PDF_OPTIMIZE_BYTES = counter(
+    'pdf_optimize_bytes_total', 'Size of filled PDFs before and after optimization', ('level', 'phase'))
+
+# Web application
+HTTP_REQUEST_SECONDS = histogram(
+    'http_request_duration_seconds', 'Duration of HTTP requests', ('endpoint', 'method'))
+HTTP_REQUESTS = counter(
+    'http_requests_total', 'HTTP requests by response status', ('endpoint', 'method', 'status'))
+HTTP_IN_FLIGHT = gauge(
+    'http_requests_in_flight', 'HTTP requests currently being handled')
+SUBMIT_STAGE_SECONDS = histogram(
+    'submit_form_stage_duration_seconds', 'Duration of the stages of submit_form', ('stage',))
+
+# Caches and queues report here as they are added
+CACHE_REQUESTS = counter(
+    'cache_requests_total', 'Cache lookups by result (hit or miss)', ('cache', 'result'))
+QUEUE_DEPTH = gauge(
+    'queue_depth', 'Items waiting in work queues', ('queue',))
+JOBS = counter(
+    'jobs_total', 'Database jobs by outcome (claimed, completed, retried, failed, lost)', ('queue', 'result'))
+JOB_SECONDS = histogram(
+    'job_duration_seconds', 'Duration of database jobs run by workers', ('queue',))
+
+# Admission control of PDF processing
+PDF_SLOTS_IN_USE = gauge(
+    'pdf_slots_in_use', 'PDF processing slots held by requests')
+ADMISSION_WAIT_SECONDS = histogram(
+    'admission_wait_seconds', 'Time requests waited for a PDF processing slot', ('kind',))
+ADMISSION_REJECTED = counter(
+    'admission_rejected_total', 'Requests rejected by admission control', ('kind', 'status'))
+
+# Warm-up of hot templates at process start
+WARMUP_SECONDS = gauge(
+    'warmup_seconds', 'Duration of the last warm-up of this process')
+WARMUP_TEMPLATES = gauge(
+    'warmup_templates', 'Templates preloaded into the fill cache by the last warm-up')
+
+# Storage maintenance
+SWEEP_FILES_REMOVED = counter(
+    'sweep_files_removed_total', 'Files removed by purges and the orphan sweep')
+SWEEP_BYTES_REMOVED = counter(
+    'sweep_bytes_removed_total', 'Bytes reclaimed by purges and the orphan sweep')
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count a cache lookup for the hit rate of ``cache``."""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def render() -> str:
+    """Render the default registry in the Prometheus text format."""
+    return REGISTRY.render()
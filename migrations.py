@@ -0,0 +1,67 @@
+"""Minimal schema upgrades for existing databases.
+
+``create_all`` creates missing tables but never alters existing ones, so
+databases created by an older version would miss columns added since. This
+module adds such columns in place. Only nullable columns or columns with a
+server default can be added this way, which is how new columns are declared
+in this project.
+"""
+
+import logging
+from typing import List
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine, metadata) -> List[str]:
+    """Add columns declared in ``metadata`` but missing from existing tables.
+
+    Args:
+        engine: SQLAlchemy engine bound to the database to upgrade
+        metadata: MetaData holding the current table definitions
+
+    Indexes declared on the added columns are created as well.
+
+    Returns:
+        List of added columns as ``table.column`` strings
+    """
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added = []
+
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            new_columns = set()
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    logger.warning(
+                        f"Cannot add NOT NULL column {table.name}.{column.name} without a server default"
+                    )
+                    continue
+                ddl = (
+                    f"ALTER TABLE {preparer.quote(table.name)} "
+                    f"ADD COLUMN {preparer.quote(column.name)} {column.type.compile(engine.dialect)}"
+                )
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    # Plain strings are literals, text() clauses are raw SQL
+                    ddl += f" DEFAULT '{default}'" if isinstance(default, str) else f" DEFAULT {default.text}"
+                conn.execute(text(ddl))
+                new_columns.add(column.name)
+                added.append(f"{table.name}.{column.name}")
+
+            # Create the indexes declared on the new columns
+            for index in table.indexes:
+                if new_columns.intersection(column.name for column in index.columns):
+                    index.create(conn, checkfirst=True)
+
+    if added:
+        logger.info(f"Added missing database columns: {', '.join(added)}")
+    return added
@@ -1,8 +1,11 @@
 from app import db
 from datetime import datetime
 import json
+import os
 from typing import Optional, List, Dict, Any
 
+from werkzeug.utils import secure_filename
+
 
 class PDFTemplate(db.Model):
     """Represents a PDF template with fillable form fields.
@@ -10,27 +13,74 @@ class PDFTemplate(db.Model):
     This model stores information about uploaded PDF templates that contain
     fillable form fields. Each template can have multiple form fields and
     multiple filled instances.
+
+    Form fields are extracted in the background after upload; ``status``
+    tracks that job (processing, ready or failed).
+
+    A template uploaded as a new version of another points at it through
+    ``supersedes_id``; the older version is marked ``superseded_at`` once the
+    new one is ready, and keeps its filled forms.
     """
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False, index=True)
     file_path = db.Column(db.String(512), nullable=False, unique=True)
     original_filename = db.Column(db.String(255), nullable=False)
+    sha256 = db.Column(db.String(64), index=True)  # Digest of the template file
+    profile_path = db.Column(db.String(512))  # Profile report of field extraction, if captured
+    status = db.Column(db.String(20), default=STATUS_READY, server_default=STATUS_READY, index=True)
+    error_message = db.Column(db.Text)  # Reason of the last failed extraction attempt
+    attempts = db.Column(db.Integer, default=0, server_default='0')  # Extraction attempts made
+    schema_version = db.Column(db.Integer, default=0, server_default='0')  # Bumped whenever the fields are replaced
+    version = db.Column(db.Integer, default=1, server_default='1')  # 1 for a new template, +1 per new version
+    supersedes_id = db.Column(db.Integer, db.ForeignKey('pdf_template.id'), index=True)  # Previous version
+    superseded_at = db.Column(db.DateTime, index=True)  # Set when a newer version is ready
+    field_changes = db.Column(db.Text)  # JSON of the fields added, removed and changed since the previous version
+    processing_started_at = db.Column(db.DateTime)  # Set when extraction is queued and when each attempt starts
+    deleted_at = db.Column(db.DateTime, index=True)  # Set when deleted, until purged in the background
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    # Retention of filled outputs, None falls back to the app-wide defaults
+    retention_days = db.Column(db.Integer)  # Keep outputs of forms younger than this in the hot folder
+    retention_max_forms = db.Column(db.Integer)  # Keep outputs of this many newest forms
+    retention_max_bytes = db.Column(db.BigInteger)  # Keep newest outputs up to this many bytes
+
     # Relationships
-    fields: db.relationship = db.relationship(
+    fields = db.relationship(
         'FormField',
         backref='template',
         cascade='all, delete-orphan',
-        lazy='joined'
+        lazy='select'
     )
-    filled_forms: db.relationship = db.relationship(
+    filled_forms = db.relationship(
         'FilledForm',
         backref='template',
         cascade='all, delete-orphan',
         lazy='select'
     )
 
+    @classmethod
+    def get_active_or_404(cls, template_id: int) -> 'PDFTemplate':
+        """Return a template that is not deleted, or abort with 404."""
+        return cls.query.filter_by(id=template_id, deleted_at=None).first_or_404()
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether form fields have been extracted and the template can be filled."""
+        return self.status in (None, self.STATUS_READY)
+
+    def get_field_changes(self) -> Dict[str, List[str]]:
+        """Parse and return the field differences to the previous version, empty if unknown."""
+        if not self.field_changes:
+            return {}
+        try:
+            return json.loads(self.field_changes)
+        except (json.JSONDecodeError, TypeError):
+            return {}
+
     def __repr__(self) -> str:
         """String representation of PDFTemplate."""
         return f"<PDFTemplate {self.id}: {self.name}>"
@@ -40,7 +90,8 @@ class FormField(db.Model):
     """Represents a form field in a PDF template.
 
     This model stores metadata about individual form fields found in a PDF template,
-    including the field name and type.
+    including the field name and type. Checkboxes, radio buttons and choice
+    lists also store the export values the PDF accepts in ``options``.
     """
     id = db.Column(db.Integer, primary_key=True)
     template_id = db.Column(
@@ -50,9 +101,23 @@ class FormField(db.Model):
         index=True
     )
     field_name = db.Column(db.String(255), nullable=False, index=True)
-    field_type = db.Column(db.String(50), default='text')
+    field_type = db.Column(db.String(50), default='text')  # One of fieldtypes.TYPES
+    options = db.Column(db.Text)  # JSON list of export values of buttons and choice lists
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def get_options(self) -> List[str]:
+        """Parse and return the export values of the field, empty for text fields."""
+        if not self.options:
+            return []
+        try:
+            return json.loads(self.options)
+        except (json.JSONDecodeError, TypeError):
+            return []
+
+    def set_options(self, options: List[str]) -> None:
+        """Store the export values of the field as a JSON string, or None if empty."""
+        self.options = json.dumps(list(options)) if options else None
+
     def __repr__(self) -> str:
         """String representation of FormField."""
         return f"<FormField {self.id}: {self.field_name} ({self.field_type})>"
@@ -64,7 +129,15 @@ class FilledForm(db.Model):
     This model stores information about completed forms generated from templates,
     including references to the generated PDF and PNG files, and the form data
     as JSON.
+
+    When filling or rendering is queued as a job (``FILL_MODE`` or
+    ``RENDER_MODE`` set to ``queue``), ``status`` tracks the pending step.
     """
+    STATUS_FILLING = 'filling'
+    STATUS_RENDERING = 'rendering'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
     id = db.Column(db.Integer, primary_key=True)
     template_id = db.Column(
         db.Integer,
@@ -74,9 +147,25 @@ class FilledForm(db.Model):
     )
     pdf_path = db.Column(db.String(512))
     png_path = db.Column(db.String(512))
+    profile_path = db.Column(db.String(512))  # Profile report of the fill, if captured
+    pdf_sha256 = db.Column(db.String(64))  # Digest of the filled PDF, used as its ETag
+    png_sha256 = db.Column(db.String(64))  # Digest of the PNG preview, used as its ETag
+    archive_path = db.Column(db.String(512))  # Archive bundle holding a copy of the filled PDF
     data = db.Column(db.Text)  # JSON string of form data
+    status = db.Column(db.String(20), default=STATUS_READY, server_default=STATUS_READY)
+    deleted_at = db.Column(db.DateTime, index=True)  # Set when deleted, until purged in the background
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    @classmethod
+    def get_active_or_404(cls, form_id: int) -> 'FilledForm':
+        """Return a filled form that is not deleted, or abort with 404."""
+        return cls.query.filter_by(id=form_id, deleted_at=None).first_or_404()
+
+    @property
+    def has_pdf(self) -> bool:
+        """Whether the filled PDF has been generated."""
+        return self.status not in (self.STATUS_FILLING, self.STATUS_FAILED)
+
     def get_data(self) -> Dict[str, Any]:
         """Parse and return form data as dictionary.
 
@@ -102,6 +191,71 @@ class FilledForm(db.Model):
         """
         self.data = json.dumps(data, default=str)
 
+    def assign_output_paths(self, template: 'PDFTemplate', upload_folder: str) -> None:
+        """Set the paths of the filled PDF and its PNG preview; the form needs an ID.
+
+        Args:
+            template: Template the form is filled from
+            upload_folder: Folder holding generated files
+        """
+        self.pdf_path = os.path.join(upload_folder, f"filled_{self.id}_{secure_filename(template.original_filename)}")
+        self.png_path = self.pdf_path.replace('.pdf', '.png')
+
+    def file_version(self, filetype: str) -> Optional[str]:
+        """Return a short content version for download URLs of a file.
+
+        Download links carry this value so that browsers may cache the file
+        as immutable; the link changes whenever the content does.
+
+        Args:
+            filetype: 'pdf' or 'png'
+
+        Returns:
+            The first 16 hex digits of the file digest, or None if unknown
+        """
+        digest = {'pdf': self.pdf_sha256, 'png': self.png_sha256}.get(filetype)
+        return digest[:16] if digest else None
+
     def __repr__(self) -> str:
         """String representation of FilledForm."""
         return f"<FilledForm {self.id}: template_id={self.template_id}>"
+
+
+class Job(db.Model):
+    """A unit of background work in the shared job table.
+
+    Jobs are claimed by workers on any node with a lease: the claiming worker
+    owns the job until ``lease_expires_at`` and extends the lease with
+    heartbeats while it runs. Jobs whose lease expires (e.g. because their
+    worker died) are requeued until ``max_attempts`` is reached.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    __table_args__ = (
+        db.Index('ix_job_claim', 'status', 'queue', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(50), nullable=False)  # Job kind, e.g. fill or render
+    payload = db.Column(db.Text)  # JSON arguments of the job
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED, server_default=STATUS_QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=3, server_default='3')
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)  # Not claimed before this time
+    lease_owner = db.Column(db.String(255))  # Worker holding the job while running
+    lease_expires_at = db.Column(db.DateTime, index=True)
+    heartbeat_at = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)  # Reason of the last failed attempt
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def get_payload(self) -> Dict[str, Any]:
+        """Parse and return the job arguments."""
+        return json.loads(self.payload) if self.payload else {}
+
+    def __repr__(self) -> str:
+        """String representation of Job."""
+        return f"<Job {self.id}: {self.queue} ({self.status})>"
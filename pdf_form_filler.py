@@ -18,6 +18,10 @@ from datetime import datetime
 import tempfile
 import logging
 
+import migrations
+import profiling
+import storage
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,16 +31,12 @@ logger = logging.getLogger(__name__)
 base_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(base_dir, 'pdf_forms.db')
 
-# Import required libraries
+# Import required libraries. Only SQLAlchemy is needed up front; the PDF
+# libraries are imported inside the functions that use them so that the
+# listing commands start without loading them.
 try:
     from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey
-    from sqlalchemy.ext.declarative import declarative_base
-    from sqlalchemy.orm import sessionmaker, relationship
-    import PyPDF2
-    from pdfrw import PdfReader, PdfWriter, PdfDict, PdfName
-    from pdf2image import convert_from_path
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
+    from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 except ImportError as e:
     logger.error(f"Required libraries not found: {str(e)}")
     print(f"Error: Missing required libraries. Please install: {str(e)}")
@@ -79,6 +79,7 @@ class FilledForm(Base):
     template_id = Column(Integer, ForeignKey('pdf_template.id'), nullable=False)
     pdf_path = Column(String(512))
     png_path = Column(String(512))
+    profile_path = Column(String(512))  # Profile report of the fill, if captured
     data = Column(Text)  # JSON string of form data
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -94,6 +95,8 @@ def extract_form_fields(pdf_path):
         list: List of form field names
     """
     try:
+        import PyPDF2
+
         reader = PyPDF2.PdfReader(pdf_path)
         fields = []
         
@@ -127,6 +130,9 @@ def fill_pdf_form(template_path, field_data, output_path):
         bool: True if successful, False otherwise
     """
     try:
+        import PyPDF2
+        from pdfrw import PdfReader, PdfWriter, PdfDict
+
         # Try using pdfrw first (more reliable for forms)
         reader = PdfReader(template_path)
         
@@ -178,6 +184,10 @@ def _fill_pdf_form_fallback(template_path, field_data, output_path):
         output_path (str): Path to save the filled PDF
     """
     try:
+        import PyPDF2
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+
         # Create a temporary PDF with form field values
         temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
         c = canvas.Canvas(temp_pdf.name, pagesize=letter)
@@ -263,6 +273,8 @@ def convert_pdf_to_png(pdf_path, png_path):
         bool: True if successful, False otherwise
     """
     try:
+        from pdf2image import convert_from_path
+
         # Convert the first page of the PDF to PNG
         images = convert_from_path(pdf_path, dpi=150, first_page=1, last_page=1)
         
@@ -278,10 +290,18 @@ def convert_pdf_to_png(pdf_path, png_path):
         logger.error(f"Error converting PDF to PNG: {str(e)}")
         raise
 
-def setup_database():
+# Working copy of the upload folder, written through to the storage backend
+# shared with the web app (STORAGE_BACKEND); set up in main()
+file_storage = None
+
+def setup_database(create_tables=True):
     """
     Set up the database connection and create tables if they don't exist.
     
+    Args:
+        create_tables (bool): Run ``create_all`` on the schema. Read-only
+            commands can skip this when the database is known to exist.
+        
     Returns:
         session: SQLAlchemy session
     """
@@ -294,7 +314,9 @@ def setup_database():
         engine = create_engine(f"sqlite:///{db_path}")
         
         # Create tables if they don't exist
-        Base.metadata.create_all(engine)
+        if create_tables:
+            Base.metadata.create_all(engine)
+            migrations.add_missing_columns(engine, Base.metadata)
         
         # Create a session
         Session = sessionmaker(bind=engine)
@@ -330,7 +352,8 @@ def scan_pdf(pdf_path, session, upload_folder):
             
         # Extract form fields from the PDF
         print(f"Scanning {pdf_path} for form fields...")
-        fields = extract_form_fields(pdf_path)
+        with profiling.stage('extract'):
+            fields = extract_form_fields(pdf_path)
         
         if not fields:
             print("No form fields found in the PDF.")
@@ -347,6 +370,7 @@ def scan_pdf(pdf_path, session, upload_folder):
         # Copy the PDF to the upload folder
         import shutil
         shutil.copy2(pdf_path, filepath)
+        file_storage.publish(filepath)
         
         # Ask for template name
         template_name = input("Enter a name for this PDF template: ")
@@ -379,7 +403,7 @@ def scan_pdf(pdf_path, session, upload_folder):
         print(f"Error: {str(e)}")
         sys.exit(1)
 
-def fill_template(template, fields, session, upload_folder):
+def fill_template(template, fields, session, upload_folder, profile=None):
     """
     Prompt for field values and fill out the PDF template.
     
@@ -388,6 +412,7 @@ def fill_template(template, fields, session, upload_folder):
         fields: List of form fields
         session: SQLAlchemy session
         upload_folder (str): Path to upload folder
+        profile: Active profiling.ProfileSession to save with the form, if any
     """
     try:
         # Collect field data
@@ -411,22 +436,32 @@ def fill_template(template, fields, session, upload_folder):
         )
         
         print("\nGenerating filled PDF...")
-        fill_pdf_form(template.file_path, field_data, output_pdf_path)
+        if not file_storage.fetch(template.file_path):
+            raise FileNotFoundError(f"Template file not found: {template.file_path}")
+        with profiling.stage('fill'):
+            fill_pdf_form(template.file_path, field_data, output_pdf_path)
         
         # Convert PDF to PNG
         print("Converting PDF to PNG...")
         png_path = output_pdf_path.replace('.pdf', '.png')
-        convert_pdf_to_png(output_pdf_path, png_path)
+        with profiling.stage('render'):
+            convert_pdf_to_png(output_pdf_path, png_path)
         
         # Update the filled form record with file paths
         filled_form.pdf_path = output_pdf_path
         filled_form.png_path = png_path
+        if profile:
+            filled_form.profile_path = profile.write(output_pdf_path.replace('.pdf', '_profile.txt'))
         filled_form.data = json.dumps(field_data)  # Store as JSON string
+        for path in (output_pdf_path, png_path, filled_form.profile_path):
+            file_storage.publish(path)
         session.commit()
         
         print("\nForm filled successfully!")
         print(f"PDF saved to: {output_pdf_path}")
         print(f"PNG saved to: {png_path}")
+        if filled_form.profile_path:
+            print(f"Profile saved to: {filled_form.profile_path}")
         
     except Exception as e:
         logger.error(f"Error filling PDF: {str(e)}")
@@ -519,29 +554,42 @@ def main():
     parser.add_argument('pdf_path', nargs='?', help='Path to the PDF file')
     parser.add_argument('--list-templates', action='store_true', help='List all PDF templates')
     parser.add_argument('--list-forms', action='store_true', help='List all filled forms')
+    parser.add_argument('--no-create-tables', action='store_true',
+                        help='Skip creating database tables on start (for listing an existing database)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Capture cProfile and tracemalloc statistics for the extract, fill and render stages')
     
     args = parser.parse_args()
     
+    global file_storage
+    try:
+        backend = storage.create_storage(os.environ.get('STORAGE_BACKEND', ''))
+    except storage.StorageError as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+    
     # Set up database connection
-    session, upload_folder = setup_database()
+    session, upload_folder = setup_database(create_tables=not args.no_create_tables)
+    file_storage = storage.WorkingCopy(backend, upload_folder)
     
     try:
-        if args.list_templates:
-            # List templates and optionally fill one out
-            result = list_templates(session)
-            if result:
-                template, fields = result
-                fill_template(template, fields, session, upload_folder)
-        elif args.list_forms:
-            # List filled forms
-            list_filled_forms(session)
-        elif args.pdf_path:
-            # Scan PDF and fill out template
-            template, fields = scan_pdf(args.pdf_path, session, upload_folder)
-            fill_template(template, fields, session, upload_folder)
-        else:
-            # If no arguments provided, show help
-            parser.print_help()
+        with profiling.session('pdf_form_filler CLI', profiling.should_profile(args.profile)) as profile:
+            if args.list_templates:
+                # List templates and optionally fill one out
+                result = list_templates(session)
+                if result:
+                    template, fields = result
+                    fill_template(template, fields, session, upload_folder, profile)
+            elif args.list_forms:
+                # List filled forms
+                list_filled_forms(session)
+            elif args.pdf_path:
+                # Scan PDF and fill out template
+                template, fields = scan_pdf(args.pdf_path, session, upload_folder)
+                fill_template(template, fields, session, upload_folder, profile)
+            else:
+                # If no arguments provided, show help
+                parser.print_help()
     finally:
         session.close()
 
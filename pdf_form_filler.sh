@@ -15,6 +15,7 @@ display_help() {
     echo "  -h, --help            Display this help message"
     echo "  -l, --list-templates  List all available PDF templates"
     echo "  -f, --list-forms      List all filled forms"
+    echo "  --no-create-tables    Skip table creation on start (after -l/-f)"
     echo ""
     echo "Examples:"
     echo "  $0 sample.pdf         Scan a new PDF and fill out the form"
@@ -29,10 +30,10 @@ case "$1" in
         exit 0
         ;;
     -l|--list-templates)
-        ./pdf_form_filler.py --list-templates
+        ./pdf_form_filler.py --list-templates "${@:2}"
         ;;
     -f|--list-forms)
-        ./pdf_form_filler.py --list-forms
+        ./pdf_form_filler.py --list-forms "${@:2}"
         ;;
     "")
         display_help
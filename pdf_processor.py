@@ -1,12 +1,26 @@
+import contextlib
+import functools
+import io
 import logging
+import mmap
 import os
+import re
+import shutil
 import tempfile
-from typing import List, Dict, Any
-import PyPDF2
-from pdfrw import PdfReader, PdfWriter, PdfDict, PdfName
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from pdf2image import convert_from_path
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Dict, Any, NamedTuple, Optional, Tuple
+
+import fieldtypes
+import metrics
+import optimize
+import profiling
+
+# The PDF libraries (PyPDF2, pdfrw, reportlab, pdf2image) are imported inside
+# the functions that use them so that importing this module stays cheap for
+# callers that never touch a PDF, such as the CLI listing commands.
 
 # Configure logging from environment variable
 log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -31,14 +45,511 @@ class PDFConversionError(Exception):
     """Exception raised when PDF to image conversion fails."""
     pass
 
-def extract_form_fields(pdf_path: str) -> List[str]:
-    """Extract form field names from a PDF file.
+
+def _stage(name: str) -> Callable:
+    """Decorator recording the duration and failures of a processing stage.
+
+    The stage is also profiled when a profile session is active.
+
+    Args:
+        name: Stage label used in the ``pdf_stage_*`` metrics
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with profiling.stage(name):
+                    return func(*args, **kwargs)
+            except Exception:
+                metrics.PDF_STAGE_ERRORS.inc(stage=name)
+                raise
+            finally:
+                metrics.PDF_STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+        return wrapper
+    return decorator
+
+
+# Bytes read from the end of the file to find startxref, and the most read
+# for a trailer or object dictionary during the AcroForm check
+_TAIL_SIZE = 4096
+_DICT_READ_SIZE = 64 * 1024
+_XREF_ENTRY_SIZE = 20
+
+_STARTXREF_RE = re.compile(rb'startxref\s+(\d+)')
+_REF_RE = r'\s+(\d+)\s+(\d+)\s+R'
+_ROOT_RE = re.compile(rb'/Root' + _REF_RE.encode())
+_PREV_RE = re.compile(rb'/Prev\s+(\d+)')
+_OBJ_HEADER_RE = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+
+# Parsed templates kept for fills per process (0 disables the cache)
+FILL_CACHE_SIZE = int(os.environ.get('FILL_CACHE_SIZE', '32'))
+# Templates of at least this many MB are filled with an incremental update
+# read through mmap instead of a full parse (0 disables)
+FILL_INCREMENTAL_MB = float(os.environ.get('FILL_INCREMENTAL_MB', '32'))
+# Optimization of filled PDFs: none, fast or size, see optimize.py
+PDF_OPTIMIZE = os.environ.get('PDF_OPTIMIZE', 'none').lower()
+# Previews: 'full' renders every filled PDF with poppler, 'composite' draws
+# the values over a cached render of the template
+PREVIEW_MODE = os.environ.get('PREVIEW_MODE', 'full').lower()
+# Rendered template pages kept per process for composite previews
+PREVIEW_CACHE_SIZE = int(os.environ.get('PREVIEW_CACHE_SIZE', '16'))
+PREVIEW_DPI = 150
+
+# Deepest /Parent chain followed when naming a widget, against reference cycles
+_MAX_FIELD_DEPTH = 32
+# Field flags (/Ff) of button fields
+_FF_RADIO = 1 << 15
+_FF_PUSHBUTTON = 1 << 16
+_FF_MULTILINE = 1 << 12
+_FF_PASSWORD = 1 << 13
+# Annotation flag of widgets that are not displayed
+_F_HIDDEN = 1 << 1
+
+
+@contextlib.contextmanager
+def _mapped(path: str) -> Iterator[mmap.mmap]:
+    """Map a file read-only, so that only the pages actually read are loaded."""
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_RANDOM'):
+        # Objects are looked up by offset; readahead would map in the images between them
+        data.madvise(mmap.MADV_RANDOM)
+    try:
+        yield data
+    finally:
+        try:
+            data.close()
+        except BufferError:
+            # Still referenced by a live match object; unmapped once collected
+            pass
+
+
+def _read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+def _dict_int(data: bytes, key: bytes) -> Optional[int]:
+    match = re.search(rb'/' + key + rb'\s+(\d+)(?!\s+\d+\s+R)', data)
+    return int(match.group(1)) if match else None
+
+
+def _dict_ints(data: bytes, key: bytes) -> Optional[List[int]]:
+    match = re.search(rb'/' + key + rb'\s*\[([\d\s]*)\]', data)
+    return [int(v) for v in match.group(1).split()] if match else None
+
+
+def _find_in_xref_table(f, offset: int, obj_num: int) -> Tuple[Optional[int], bytes]:
+    """Look up ``obj_num`` in a classic xref table without reading all entries.
+
+    Returns:
+        (object offset or None, trailer dictionary bytes)
+    """
+    f.seek(offset)
+    if f.readline().strip() != b'xref':
+        raise ValueError("xref keyword not found")
+    found = None
+    while True:
+        line_start = f.tell()
+        line = f.readline()
+        if line.strip().startswith(b'trailer'):
+            f.seek(line_start)
+            return found, f.read(_DICT_READ_SIZE)
+        start, count = (int(v) for v in line.split())
+        entries_start = f.tell()
+        if found is None and start <= obj_num < start + count:
+            entry = _read_at(f, entries_start + (obj_num - start) * _XREF_ENTRY_SIZE, _XREF_ENTRY_SIZE)
+            obj_offset, _, kind = entry.split()[:3]
+            if kind == b'n':
+                found = int(obj_offset)
+        f.seek(entries_start + count * _XREF_ENTRY_SIZE)
+
+
+def _find_in_xref_stream(f, offset: int, obj_num: int) -> Tuple[Optional[int], bytes]:
+    """Look up ``obj_num`` in a cross-reference stream.
+
+    Only the xref stream object itself is read and inflated.
+
+    Returns:
+        (object offset or None, stream dictionary bytes)
+
+    Raises:
+        ValueError: If the stream uses features this reader does not handle,
+            or the object is stored inside an object stream
+    """
+    data = _read_at(f, offset, _DICT_READ_SIZE)
+    if not _OBJ_HEADER_RE.match(data) or b'/XRef' not in data:
+        raise ValueError("startxref does not point to an xref table or stream")
+    stream_pos = data.index(b'stream')
+    header = data[:stream_pos]
+    length = _dict_int(header, b'Length')
+    widths = _dict_ints(header, b'W')
+    if length is None or not widths or len(widths) != 3:
+        raise ValueError("Unsupported xref stream dictionary")
+    body_start = offset + stream_pos + len(b'stream')
+    body = _read_at(f, body_start, length + 2)
+    body = body[2:] if body.startswith(b'\r\n') else body[1:]
+    body = body[:length]
+    if b'/FlateDecode' in header:
+        body = zlib.decompress(body)
+    elif b'/Filter' in header:
+        raise ValueError("Unsupported xref stream filter")
+
+    row = sum(widths)
+    predictor = _dict_int(header, b'Predictor') or 1
+    if predictor >= 10:
+        # PNG predictors: every row is prefixed with a filter type byte
+        columns = _dict_int(header, b'Columns') or row
+        rows, previous = [], bytearray(columns)
+        for i in range(0, len(body), columns + 1):
+            filter_type, raw = body[i], bytearray(body[i + 1:i + 1 + columns])
+            if filter_type == 2:
+                raw = bytearray((a + b) & 0xFF for a, b in zip(raw, previous))
+            elif filter_type != 0:
+                raise ValueError("Unsupported PNG predictor in xref stream")
+            rows.append(bytes(raw))
+            previous = raw
+        body = b''.join(rows)
+    elif predictor != 1:
+        raise ValueError("Unsupported xref stream predictor")
+
+    index = _dict_ints(header, b'Index') or [0, _dict_int(header, b'Size') or 0]
+    position = 0
+    for start, count in zip(index[0::2], index[1::2]):
+        if start <= obj_num < start + count:
+            entry = body[(position + obj_num - start) * row:(position + obj_num - start + 1) * row]
+            fields = []
+            cursor = 0
+            for width in widths:
+                fields.append(int.from_bytes(entry[cursor:cursor + width], 'big') if width else None)
+                cursor += width
+            kind = 1 if fields[0] is None else fields[0]
+            if kind == 1:
+                return fields[1], header
+            if kind == 2:
+                raise ValueError("Document catalog is inside an object stream")
+            return None, header
+        position += count
+    return None, header
+
+
+def check_acroform(pdf_path: str) -> Optional[bool]:
+    """Check whether a PDF has an interactive form, reading only the xref and trailer.
+
+    Follows ``startxref`` to the cross-reference table or stream, finds the
+    document catalog (``/Root``) through it and checks the catalog for an
+    ``/AcroForm`` entry. Only a few kilobytes of the file are read, so this
+    is suitable for rejecting uploads before a full parse.
 
     Args:
         pdf_path: Path to the PDF file
 
     Returns:
-        List of form field names found in the PDF
+        True if the catalog has an /AcroForm entry, False if it does not,
+        None if the structure could not be read cheaply and a full parse
+        is needed to decide
+    """
+    try:
+        with open(pdf_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            tail = _read_at(f, max(0, size - _TAIL_SIZE), _TAIL_SIZE)
+            matches = _STARTXREF_RE.findall(tail)
+            if not matches:
+                return None
+            offset = int(matches[-1])
+
+            root_num, root_offset, seen = None, None, set()
+            while offset is not None and offset not in seen and root_offset is None:
+                seen.add(offset)
+                if _read_at(f, offset, 4) == b'xref':
+                    lookup = _find_in_xref_table
+                else:
+                    lookup = _find_in_xref_stream
+                if root_num is None:
+                    # The first trailer names the catalog, so read it first
+                    _, trailer = lookup(f, offset, -1)
+                    root = _ROOT_RE.search(trailer)
+                    if not root:
+                        return None
+                    root_num = int(root.group(1))
+                root_offset, trailer = lookup(f, offset, root_num)
+                prev = _PREV_RE.search(trailer)
+                offset = int(prev.group(1)) if prev else None
+
+            if root_offset is None:
+                return None
+            catalog = _read_at(f, root_offset, _DICT_READ_SIZE)
+            header = _OBJ_HEADER_RE.match(catalog)
+            if not header or int(header.group(1)) != root_num:
+                return None
+            end = catalog.find(b'endobj')
+            if end == -1:
+                return None
+            return b'/AcroForm' in catalog[:end]
+    except (OSError, ValueError, IndexError, zlib.error) as e:
+        logger.debug(f"Quick AcroForm check failed for {pdf_path}: {e}")
+        return None
+
+
+# Tokens of a PDF object. Literal strings are matched whole unless they
+# contain nested parentheses, which leave a lone "(" token behind.
+_TOKEN_RE = re.compile(
+    rb'<<|>>|\[|\]|\((?:[^()\\]|\\.)*\)|\(|<[0-9A-Fa-f\s]*>|/[^\s/\[\]()<>{}%]*|[^\s/\[\]()<>{}%]+',
+    re.DOTALL
+)
+_COMMENT_RE = re.compile(rb'%[^\r\n]*')
+
+
+class _UnsupportedObject(Exception):
+    """Raised when a field object cannot be read without a full parse."""
+    pass
+
+
+def _decode_string_token(token: bytes) -> str:
+    """Decode a literal or hex string token the way PyPDF2 does."""
+    from PyPDF2.generic import create_string_object, read_hex_string_from_stream, read_string_from_stream
+
+    if token.startswith(b'<'):
+        return str(read_hex_string_from_stream(io.BytesIO(token)))
+    if b'\\' in token:
+        return str(read_string_from_stream(io.BytesIO(token)))
+    return str(create_string_object(token[1:-1]))
+
+
+def _top_level_index(tokens: List[bytes], key: bytes) -> Optional[int]:
+    """Return the index of ``key`` at the top level of a tokenized dictionary."""
+    i = -1
+    while True:
+        try:
+            i = tokens.index(key, i + 1)
+        except ValueError:
+            return None
+        # Count brackets in C rather than walking every token
+        head = tokens[:i]
+        if head.count(b'<<') + head.count(b'[') - head.count(b'>>') - head.count(b']') == 1:
+            return i
+
+
+def _scan_field_object(reader, data: bytes, idnum: int) -> Tuple[Optional[str], Optional[List[Tuple[int, int]]],
+                                                                   Optional[str], Optional[int]]:
+    """Read ``/T``, ``/Kids``, ``/FT`` and ``/Ff`` of a field object straight from the file bytes.
+
+    The object is split into tokens with a single regular expression pass;
+    nested dictionaries such as appearance streams and widget
+    characteristics are skipped rather than built, which is most of the cost
+    of resolving a field with PyPDF2.
+
+    Returns:
+        (partial name or None, (object number, generation) of the kids or
+        None, field type name such as '/Btn' or None, field flags or None)
+
+    Raises:
+        _UnsupportedObject: If the object is compressed, indirect values are
+            used for /T, /Kids or /Ff, or the syntax is not understood
+    """
+    offset = None
+    for generation in reader.xref.values():
+        offset = generation.get(idnum, offset)
+    if offset is None:
+        raise _UnsupportedObject("Object is not in the cross-reference table")
+    header = _OBJ_HEADER_RE.match(data, offset)
+    if not header or int(header.group(1)) != idnum:
+        raise _UnsupportedObject("Object header not found")
+    end = data.find(b'endobj', header.end())
+    if end == -1:
+        raise _UnsupportedObject("Object end not found")
+    body = data[header.end():end]
+    if b'%' in body:
+        body = _COMMENT_RE.sub(b' ', body)
+    tokens = _TOKEN_RE.findall(body)
+    if not tokens or tokens[0] != b'<<' or b'(' in tokens or b'stream' in tokens:
+        raise _UnsupportedObject("Not a plain dictionary")
+
+    partial, kids, field_type, flags = None, None, None, None
+    for key in (b'/T', b'/Kids', b'/FT', b'/Ff'):
+        i = _top_level_index(tokens, key)
+        if i is None or i + 1 >= len(tokens):
+            continue
+
+        value = tokens[i + 1]
+        if key == b'/T':
+            if not value.startswith((b'(', b'<')) or value == b'<<':
+                raise _UnsupportedObject("Field name is not a direct string")
+            partial = _decode_string_token(value)
+        elif key == b'/FT':
+            if not value.startswith(b'/'):
+                raise _UnsupportedObject("Field type is not a direct name")
+            field_type = value.decode('latin-1')
+        elif key == b'/Ff':
+            if not value.isdigit() or tokens[i + 3:i + 4] == [b'R']:
+                raise _UnsupportedObject("Field flags are not a direct integer")
+            flags = int(value)
+        else:
+            if value != b'[':
+                raise _UnsupportedObject("Kids is not a direct array")
+            values = tokens[i + 2:tokens.index(b']', i + 1)]
+            if len(values) % 3 or any(r != b'R' for r in values[2::3]):
+                raise _UnsupportedObject("Kids array holds direct objects")
+            kids = list(zip(map(int, values[0::3]), map(int, values[1::3])))
+    return partial, kids, field_type, flags
+
+
+def _read_field_node(reader, data: Optional[bytes], node) -> Tuple[Optional[str], List[Any], Optional[str], Optional[int]]:
+    """Return the partial name, kids, field type and flags of a field tree node.
+
+    Indirect nodes are scanned from the raw file bytes when possible, and
+    resolved with PyPDF2 otherwise.
+    """
+    idnum = getattr(node, 'idnum', None)
+    if data is not None and idnum is not None:
+        try:
+            from PyPDF2.generic import IndirectObject
+
+            partial, kids, field_type, flags = _scan_field_object(reader, data, idnum)
+            return partial, [IndirectObject(num, gen, reader) for num, gen in kids or ()], field_type, flags
+        except (_UnsupportedObject, ValueError, IndexError) as e:
+            logger.debug(f"Resolving field object {idnum} with a full parse: {e}")
+    obj = node.get_object()
+    # Indexing resolves indirect values, get() does not
+    partial, kids, field_type, flags = (obj[key] if key in obj else None for key in ('/T', '/Kids', '/FT', '/Ff'))
+    return ((str(partial) if partial is not None else None), list(kids or ()),
+            (str(field_type) if field_type is not None else None), (int(flags) if flags is not None else None))
+
+
+def _iter_form_fields(reader) -> Iterator[Tuple[str, Any, Optional[str], int]]:
+    """Walk the form fields of a PyPDF2 reader.
+
+    Fields are read from the ``/Root/AcroForm/Fields`` tree in a single pass.
+    Terminal fields are yielded with their fully qualified name (partial
+    names of the ancestors joined with dots); kids without a ``/T`` entry are
+    widget annotations of their parent and are not fields themselves. Only
+    when the document has no AcroForm are the page ``/Annots`` scanned for
+    named annotations instead.
+
+    Field objects are not resolved: only their names and kids are read, so
+    walking a large form costs little more than reading its name strings.
+    The generator is lazy, so callers that only need some of the names can
+    stop early without touching the rest of the document.
+
+    Args:
+        reader: PyPDF2 PdfReader of the document
+
+    Yields:
+        Tuples of (qualified field name, field object or indirect reference;
+        call ``get_object()`` on it for the field dictionary, field type name
+        such as '/Tx' or '/Btn' or None, field flags). Type and flags are
+        inherited from the ancestors when the field does not set them.
+    """
+    root = reader.trailer['/Root'].get_object()
+    acroform = root.get('/AcroForm')
+    if acroform is not None:
+        acroform = acroform.get_object()
+
+    if acroform is not None and '/Fields' in acroform:
+        # Raw bytes of the file for the fast scan, when it is mapped or held in memory
+        stream = reader.stream
+        getvalue = getattr(stream, 'getvalue', None)
+        data = stream if isinstance(stream, mmap.mmap) else getvalue() if getvalue else None
+
+        seen_refs = set()
+        # Stack of (node, (partial name, kids, type, flags), parent qualified name,
+        # inherited (type, flags)), in document order
+        stack = [(field, None, '', (None, None)) for field in reversed(acroform['/Fields'].get_object())]
+        while stack:
+            node, info, parent_name, inherited = stack.pop()
+            ref = getattr(node, 'idnum', None)
+            if ref is not None:
+                # Guard against cyclic or shared /Kids references
+                if ref in seen_refs:
+                    continue
+                seen_refs.add(ref)
+
+            partial, kids, field_type, flags = info or _read_field_node(reader, data, node)
+            field_type = field_type if field_type is not None else inherited[0]
+            flags = flags if flags is not None else inherited[1]
+            name = parent_name
+            if partial is not None:
+                name = f"{parent_name}.{partial}" if parent_name else partial
+
+            # Kids without /T are the widgets of this field
+            kid_infos = [(kid, _read_field_node(reader, data, kid)) for kid in kids]
+            field_kids = [(kid, kid_info, name, (field_type, flags))
+                          for kid, kid_info in kid_infos if kid_info[0] is not None]
+            if field_kids:
+                stack.extend(reversed(field_kids))
+            elif name:
+                yield name, node, field_type, flags or 0
+        return
+
+    for page in reader.pages:
+        for annot in page.get('/Annots') or ():
+            try:
+                annot_obj = annot.get_object()
+                if '/T' in annot_obj:
+                    field_type = annot_obj.get('/FT')
+                    yield (str(annot_obj['/T']).strip("()"), annot_obj,
+                           str(field_type) if field_type is not None else None, int(annot_obj.get('/Ff', 0)))
+            except Exception as e:
+                logger.debug(f"Could not extract annotation: {e}")
+
+
+def _field_kind(field_type: Optional[str], flags: int) -> Optional[str]:
+    """Map the /FT and /Ff of a field to a :mod:`fieldtypes` type, None for push buttons."""
+    if field_type == '/Btn':
+        if flags & _FF_PUSHBUTTON:
+            return None
+        return fieldtypes.RADIO if flags & _FF_RADIO else fieldtypes.CHECKBOX
+    if field_type == '/Ch':
+        return fieldtypes.CHOICE
+    return fieldtypes.TEXT
+
+
+def _field_options(node, kind: str) -> List[str]:
+    """Return the export values of a button or choice field.
+
+    Buttons export the names of the "on" appearance states of their widgets
+    (the field itself when it has no widget kids); choice fields the entries
+    of ``/Opt``, taking the export value of [export, display] pairs.
+    """
+    obj = node.get_object()
+    options = []
+    if kind == fieldtypes.CHOICE:
+        for option in obj.get('/Opt') or ():
+            option = option.get_object()
+            if isinstance(option, list):
+                option = option[0].get_object() if option else ''
+            options.append(str(option))
+    else:
+        for widget in obj.get('/Kids') or [obj]:
+            appearances = widget.get_object().get('/AP')
+            normal = appearances.get_object().get('/N') if appearances is not None else None
+            if normal is None or not hasattr(normal.get_object(), 'keys'):
+                continue
+            for state in normal.get_object().keys():
+                state = str(state)[1:]
+                if state != fieldtypes.OFF and state not in options:
+                    options.append(state)
+    return options
+
+
+@_stage('extract')
+def extract_field_specs(pdf_path: str, limit: Optional[int] = None) -> List[Tuple[str, str, List[str]]]:
+    """Extract the form fields of a PDF file with their types.
+
+    Push buttons carry no data and are left out. Options are only read for
+    checkboxes, radio buttons and choice lists, which resolves those field
+    objects in full; text fields are read from their names alone.
+
+    Args:
+        pdf_path: Path to the PDF file
+        limit: Stop after this many fields (all fields when None)
+
+    Returns:
+        List of (field name, field type, options) of the unique fields, in
+        document order. Types are those of :mod:`fieldtypes`; options are the
+        export values of buttons and choice lists and empty for text fields
 
     Raises:
         PDFExtractionError: If PDF reading or field extraction fails
@@ -47,35 +558,23 @@ def extract_form_fields(pdf_path: str) -> List[str]:
         raise PDFExtractionError(f"PDF file not found: {pdf_path}")
 
     try:
-        reader = PyPDF2.PdfReader(pdf_path)
-        fields = []
+        import PyPDF2
 
-        # Try to get form fields using the best available method
-        try:
-            if hasattr(reader, 'get_fields') and reader.get_fields():
-                form_fields = reader.get_fields()
-                fields.extend(form_fields.keys())
-            elif hasattr(reader, 'get_form_text_fields'):
-                form_fields = reader.get_form_text_fields()
-                if form_fields:
-                    fields.extend(form_fields.keys() if isinstance(form_fields, dict) else form_fields)
-        except Exception as e:
-            logger.warning(f"Standard field extraction failed: {str(e)}, trying fallback method")
-            # Fallback: extract fields from annotations
-            try:
-                for page in reader.pages:
-                    if '/Annots' in page:
-                        for annot in page['/Annots']:
-                            try:
-                                annot_obj = annot.get_object()
-                                if '/T' in annot_obj:
-                                    field_name = str(annot_obj['/T']).strip("()")
-                                    if field_name not in fields:
-                                        fields.append(field_name)
-                            except Exception as inner_e:
-                                logger.debug(f"Could not extract annotation: {inner_e}")
-            except Exception as fallback_e:
-                logger.warning(f"Fallback field extraction also failed: {fallback_e}")
+        fields = []
+        seen = set()
+        # Objects are read from the mapping as they are resolved, so page
+        # contents and images are never loaded
+        with _mapped(pdf_path) as data:
+            reader = PyPDF2.PdfReader(data)
+            for field_name, node, field_type, flags in _iter_form_fields(reader):
+                kind = _field_kind(field_type, flags)
+                if field_name in seen or kind is None:
+                    continue
+                seen.add(field_name)
+                options = _field_options(node, kind) if kind != fieldtypes.TEXT else []
+                fields.append((field_name, kind, options))
+                if limit is not None and len(fields) >= limit:
+                    break
 
         if fields:
             logger.info(f"Extracted {len(fields)} form fields from PDF")
@@ -90,11 +589,359 @@ def extract_form_fields(pdf_path: str) -> List[str]:
         logger.error(f"Error extracting form fields from {pdf_path}: {str(e)}", exc_info=True)
         raise PDFExtractionError(f"Failed to extract form fields: {str(e)}")
 
-def fill_pdf_form(template_path: str, field_data: Dict[str, Any], output_path: str) -> bool:
-    """Fill a PDF form with data and save it to a new file.
 
-    This function attempts to fill a PDF form using pdfrw first, then falls back
-    to reportlab if the initial method doesn't work.
+def extract_form_fields(pdf_path: str, limit: Optional[int] = None) -> List[str]:
+    """Extract form field names from a PDF file.
+
+    Args:
+        pdf_path: Path to the PDF file
+        limit: Stop after this many field names (all fields when None)
+
+    Returns:
+        List of unique form field names found in the PDF, in document order
+
+    Raises:
+        PDFExtractionError: If PDF reading or field extraction fails
+    """
+    return [name for name, _, _ in extract_field_specs(pdf_path, limit)]
+
+def _field_names(annotation) -> Tuple[str, Optional[str]]:
+    """Return the fully qualified and the partial name of a widget annotation.
+
+    The qualified name joins ``/T`` of the annotation and its ``/Parent``
+    chain with dots, as returned by :func:`extract_form_fields`; the partial
+    name is the annotation's own ``/T``, which older templates stored.
+    Works with both pdfrw and PyPDF2 objects.
+    """
+    from pdfrw import PdfDict
+
+    def partial_name(node) -> Optional[str]:
+        if isinstance(node, PdfDict):
+            return node.T.decode() if node.T is not None else None
+        value = node.get_object().get('/T')  # PyPDF2
+        return str(value) if value is not None else None
+
+    def parent_of(node):
+        if isinstance(node, PdfDict):
+            return node.Parent
+        return node.get_object().get('/Parent')
+
+    partial = partial_name(annotation)
+    names = [partial] if partial is not None else []
+    node, depth = parent_of(annotation), 0
+    while node is not None and depth < _MAX_FIELD_DEPTH:
+        name = partial_name(node)
+        if name is not None:
+            names.append(name)
+        node, depth = parent_of(node), depth + 1
+    return '.'.join(reversed(names)), partial
+
+
+def _match_field_name(annotation, field_data: Dict[str, Any]) -> Optional[str]:
+    """Return the key of ``field_data`` that names a widget annotation.
+
+    The fully qualified name is tried first, then the partial name alone
+    (see :func:`_field_names`).
+
+    Returns:
+        The matching key, or None if the field has no data
+    """
+    qualified, partial = _field_names(annotation)
+    if qualified in field_data:
+        return qualified
+    if partial is not None and partial in field_data:
+        return partial
+    return None
+
+
+def _inherited(annotation, key: str):
+    """Return an inheritable entry of a pdfrw widget or the nearest ancestor setting it."""
+    node, depth = annotation, 0
+    while node is not None and depth < _MAX_FIELD_DEPTH:
+        value = node[key]
+        if value is not None:
+            return value
+        node, depth = node.Parent, depth + 1
+    return None
+
+
+class _Changes:
+    """Journal of the entries a fill sets on pdfrw objects, so they can be undone."""
+
+    def __init__(self):
+        self._original = {}
+
+    def set(self, node, key: str, value) -> None:
+        from pdfrw import PdfName
+
+        name = PdfName(key)
+        self._original.setdefault((id(node), name), (node, name, node.get(name)))
+        node[name] = value
+
+    def undo(self) -> None:
+        for node, name, value in self._original.values():
+            # Setting None removes the entry again
+            node[name] = value
+        self._original.clear()
+
+
+def _button_state(states: List[str], text: str, flags: int) -> Optional[str]:
+    """Return the appearance state of a button widget selected by ``text``.
+
+    Args:
+        states: Names of the widget's normal appearance states, without '/'
+        text: Stripped value of the field
+        flags: Field flags (/Ff)
+
+    Returns:
+        The "on" state to switch the widget to, or None to switch it off
+    """
+    on_states = [state for state in states if state != fieldtypes.OFF]
+    state = next((s for s in on_states if s == text), None)
+    if state is None and not flags & _FF_RADIO and on_states:
+        lowered = text.lower()
+        if lowered in fieldtypes.TRUE_VALUES or lowered == on_states[0].lower():
+            state = on_states[0]
+    return state
+
+
+def _fill_widget(annotation, value: Any, changes: _Changes) -> None:
+    """Set the value of the field of a pdfrw widget annotation.
+
+    Text and choice fields get ``value`` as a PDF string and lose their
+    appearance stream, which viewers regenerate (``NeedAppearances``).
+    Buttons keep their appearances: the widget whose export name matches
+    ``value`` is switched on through ``/AS`` and the field's ``/V`` set to
+    that name; other widgets of the field are switched off. Checkboxes also
+    accept the truthy and falsy values of :mod:`fieldtypes`.
+    """
+    from pdfrw import PdfDict, PdfName, PdfString
+
+    # Widgets of fields with several widgets hold no /T; the value goes on the field
+    field = annotation if annotation.T is not None else annotation.Parent
+    field_type = _inherited(annotation, '/FT')
+    flags = int(_inherited(annotation, '/Ff') or 0)
+    text = '' if value is None else str(value).strip()
+
+    if field_type != '/Btn' or flags & _FF_PUSHBUTTON:
+        changes.set(field, 'V', PdfString.encode(text))
+        changes.set(annotation, 'AP', PdfDict())
+        return
+
+    normal = annotation.AP.N if annotation.AP is not None else None
+    states = [str(state)[1:] for state in (normal.keys() if isinstance(normal, PdfDict) else ())]
+    state = _button_state(states, text, flags)
+
+    changes.set(annotation, 'AS', PdfName(state or fieldtypes.OFF))
+    if state is not None:
+        changes.set(field, 'V', PdfName(state))
+    elif field.V is None or text.lower() in fieldtypes.FALSE_VALUES:
+        changes.set(field, 'V', PdfName(fieldtypes.OFF))
+
+
+class _CachedTemplate:
+    """A parsed template kept for fills; ``lock`` is held while a fill uses it."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.lock = threading.Lock()
+
+
+_template_cache: 'OrderedDict[Tuple[str, int, int], _CachedTemplate]' = OrderedDict()
+_template_cache_lock = threading.Lock()
+
+
+def _template_key(template_path: str) -> Tuple[str, int, int]:
+    # A replaced file gets a new key, so stale parses are never used
+    stat = os.stat(template_path)
+    return os.path.abspath(template_path), stat.st_mtime_ns, stat.st_size
+
+
+def _cached_template(template_path: str, create: bool = True) -> Optional[_CachedTemplate]:
+    """Return the cached parse of a template, parsing and caching it on a miss if ``create``."""
+    from pdfrw import PdfReader
+
+    if FILL_CACHE_SIZE <= 0:
+        return None
+    key = _template_key(template_path)
+    if _fills_incrementally(key[2]):
+        # Too large to hold parsed; a fill that gets here parses its own copy
+        return None
+    with _template_cache_lock:
+        entry = _template_cache.get(key)
+        if entry is not None:
+            _template_cache.move_to_end(key)
+    metrics.record_cache('fill_template', entry is not None)
+    if entry is not None or not create:
+        return entry
+
+    entry = _CachedTemplate(PdfReader(template_path))
+    with _template_cache_lock:
+        # Another thread may have parsed it meanwhile; keep the first
+        entry = _template_cache.setdefault(key, entry)
+        _template_cache.move_to_end(key)
+        for stale in [k for k in _template_cache if k[0] == key[0] and k != key]:
+            del _template_cache[stale]
+        while len(_template_cache) > FILL_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return entry
+
+
+def _load_all_objects(reader) -> int:
+    """Resolve every object reachable from the trailer of a pdfrw reader.
+
+    pdfrw loads indirect objects when they are first accessed. Loading them
+    all up front means a preloaded template is complete before workers are
+    forked, so they share it instead of each loading objects on first use.
+
+    Returns:
+        Number of dictionaries and arrays visited
+    """
+    from pdfrw import PdfArray, PdfDict
+
+    seen = set()
+    stack = [reader]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, PdfDict):
+            stack.extend(value for value in obj.values() if isinstance(value, (PdfDict, PdfArray)))
+        elif isinstance(obj, PdfArray):
+            stack.extend(value for value in obj if isinstance(value, (PdfDict, PdfArray)))
+    return len(seen)
+
+
+def preload_template(template_path: str) -> bool:
+    """Parse a template into the fill cache ahead of its first fill.
+
+    Unlike a parse on a cache miss, all objects of the template are loaded.
+
+    Returns:
+        True if the template was parsed, False if it was cached already,
+        caching is disabled (``FILL_CACHE_SIZE=0``) or the template is filled
+        incrementally (``FILL_INCREMENTAL_MB``)
+    """
+    if FILL_CACHE_SIZE <= 0:
+        return False
+    with _template_cache_lock:
+        cached = _template_key(template_path) in _template_cache
+    if cached:
+        return False
+    entry = _cached_template(template_path)
+    if entry is None:
+        return False
+    with entry.lock:
+        _load_all_objects(entry.reader)
+    return True
+
+
+def clear_template_cache() -> None:
+    """Drop every parsed template from the fill cache."""
+    with _template_cache_lock:
+        _template_cache.clear()
+
+
+def _fills_incrementally(size: int) -> bool:
+    """Whether a template of ``size`` bytes is filled with an incremental update."""
+    return FILL_INCREMENTAL_MB > 0 and size >= FILL_INCREMENTAL_MB * 1024 * 1024
+
+
+def _subsections(numbers: List[int]) -> List[Tuple[int, List[int]]]:
+    """Group sorted object numbers into runs of consecutive numbers for a cross-reference section."""
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1][-1] == number - 1:
+            runs[-1][1].append(number)
+        else:
+            runs.append((number, [number]))
+    return runs
+
+
+def _write_incremental_update(out, reader, changed: Dict[int, Tuple[int, Any]], prev_xref: int,
+                              as_stream: bool) -> None:
+    """Append new revisions of objects and their cross-reference section to ``out``.
+
+    Args:
+        out: Output file positioned after a copy of the original document
+        reader: PyPDF2 reader of the original document
+        changed: Object number to (generation, PyPDF2 object) of the objects to write
+        prev_xref: Offset of the original cross-reference section, stored as /Prev
+        as_stream: Write a cross-reference stream rather than a table, as
+            the original document does
+    """
+    from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+    offsets = {}
+    for number in sorted(changed):
+        generation, obj = changed[number]
+        offsets[number] = (out.tell(), generation)
+        out.write(f"{number} {generation} obj\n".encode())
+        obj.write_to_stream(out, None)
+        out.write(b"\nendobj\n")
+
+    # PyPDF2 keeps /Size only from classic trailers
+    trailer = reader.trailer
+    numbers = [number for generation in reader.xref.values() for number in generation]
+    numbers.extend(reader.xref_objStm)
+    size = max([int(trailer.get('/Size', 0))] + [number + 1 for number in numbers + list(changed)])
+    new_trailer = DictionaryObject()
+    for key in ('/Root', '/Info', '/ID'):
+        if key in trailer:
+            new_trailer[NameObject(key)] = trailer.raw_get(key)
+    new_trailer[NameObject('/Prev')] = NumberObject(prev_xref)
+    xref_offset = out.tell()
+
+    if as_stream:
+        # The stream is an object of its own and lists itself
+        offsets[size] = (xref_offset, 0)
+        size += 1
+        width = 4 if xref_offset < 1 << 32 else 8
+        numbers = sorted(offsets)
+        body = zlib.compress(b''.join(
+            b'\x01' + offsets[number][0].to_bytes(width, 'big') + offsets[number][1].to_bytes(2, 'big')
+            for number in numbers
+        ))
+        new_trailer.update({
+            NameObject('/Type'): NameObject('/XRef'),
+            NameObject('/Size'): NumberObject(size),
+            NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+            NameObject('/Index'): ArrayObject(NumberObject(value) for start, run in _subsections(numbers)
+                                              for value in (start, len(run))),
+            NameObject('/Filter'): NameObject('/FlateDecode'),
+            NameObject('/Length'): NumberObject(len(body)),
+        })
+        out.write(f"{size - 1} 0 obj\n".encode())
+        new_trailer.write_to_stream(out, None)
+        out.write(b"\nstream\n" + body + b"\nendstream\nendobj\n")
+    else:
+        new_trailer[NameObject('/Size')] = NumberObject(size)
+        out.write(b"xref\n")
+        for start, run in _subsections(sorted(offsets)):
+            out.write(f"{start} {len(run)}\n".encode())
+            for number in run:
+                out.write(f"{offsets[number][0]:010d} {offsets[number][1]:05d} n\r\n".encode())
+        out.write(b"trailer\n")
+        new_trailer.write_to_stream(out, None)
+        out.write(b"\n")
+    out.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+@_stage('fill_incremental')
+def _fill_pdf_form_incremental(template_path: str, field_data: Dict[str, Any], output_path: str) -> int:
+    """Fill a PDF form by appending an incremental update to the template.
+
+    The template is mapped with mmap and read through PyPDF2, which loads
+    objects from the cross-reference data only when they are accessed: the
+    catalog, the AcroForm field tree and the field and widget objects of the
+    fields being filled. The output is a copy of the template followed by
+    new revisions of the changed objects and a cross-reference section
+    pointing back to the original one. Page contents and images are never
+    read, so memory use does not depend on their size.
+
+    Values are set as by :func:`fill_pdf_form`. Fields are matched by their
+    qualified name, or else by their partial name.
 
     Args:
         template_path: Path to the PDF template
@@ -102,37 +949,204 @@ def fill_pdf_form(template_path: str, field_data: Dict[str, Any], output_path: s
         output_path: Path to save the filled PDF
 
     Returns:
-        True if successful
+        Number of widgets filled
 
     Raises:
-        PDFFillingError: If both primary and fallback methods fail
+        _UnsupportedObject: If the template is encrypted, has no AcroForm or
+            uses direct objects for fields or widgets
     """
-    if not os.path.exists(template_path):
-        raise PDFFillingError(f"Template PDF not found: {template_path}")
+    import PyPDF2
+    from PyPDF2.generic import BooleanObject, IndirectObject, NameObject, TextStringObject
 
-    if not field_data:
-        logger.warning("No form data provided, copying template as-is")
-        field_data = {}
+    with _mapped(template_path) as data:
+        tail = data[max(0, len(data) - _TAIL_SIZE):]
+        matches = _STARTXREF_RE.findall(tail)
+        if not matches:
+            raise _UnsupportedObject("startxref not found")
+        prev_xref = int(matches[-1])
+        as_stream = data[prev_xref:prev_xref + 4] != b'xref'
 
+        reader = PyPDF2.PdfReader(data)
+        if reader.is_encrypted:
+            raise _UnsupportedObject("Template is encrypted")
+        root_ref = reader.trailer.raw_get('/Root')
+        root = root_ref.get_object()
+        if '/AcroForm' not in root:
+            raise _UnsupportedObject("Template has no AcroForm")
+
+        changed = {}
+
+        def touch(ref):
+            if not isinstance(ref, IndirectObject):
+                raise _UnsupportedObject("Field or widget is a direct object")
+            obj = ref.get_object()
+            changed[ref.idnum] = (ref.generation, obj)
+            return obj
+
+        filled = 0
+        for name, node, field_type, flags in _iter_form_fields(reader):
+            key = name if name in field_data else name.rsplit('.', 1)[-1]
+            if key not in field_data:
+                continue
+            field = touch(node)
+            kids = field.get('/Kids')
+            widgets = [touch(kid) for kid in kids] if kids else [field]
+            value = field_data[key]
+            text = '' if value is None else str(value).strip()
+
+            if field_type != '/Btn' or flags & _FF_PUSHBUTTON:
+                field[NameObject('/V')] = TextStringObject(text)
+                for widget in widgets:
+                    widget.pop('/AP', None)
+            else:
+                selected = None
+                for widget in widgets:
+                    appearances = widget.get('/AP')
+                    normal = appearances.get('/N') if appearances is not None else None
+                    states = [str(state)[1:] for state in normal.keys()] if hasattr(normal, 'keys') else []
+                    state = _button_state(states, text, flags)
+                    widget[NameObject('/AS')] = NameObject(f"/{state or fieldtypes.OFF}")
+                    selected = selected or state
+                if selected is not None:
+                    field[NameObject('/V')] = NameObject(f"/{selected}")
+                elif '/V' not in field or text.lower() in fieldtypes.FALSE_VALUES:
+                    field[NameObject('/V')] = NameObject(f"/{fieldtypes.OFF}")
+            filled += len(widgets)
+
+        if filled:
+            # Text appearances were dropped, so have viewers regenerate them
+            acroform_ref = root.raw_get('/AcroForm')
+            if isinstance(acroform_ref, IndirectObject):
+                acroform = touch(acroform_ref)
+            else:
+                touch(root_ref)
+                acroform = acroform_ref
+            acroform[NameObject('/NeedAppearances')] = BooleanObject(True)
+
+        # Copied by the kernel (sendfile) rather than through the mapping,
+        # which would count every page of the template as resident
+        shutil.copyfile(template_path, output_path)
+        if changed:
+            with open(output_path, 'ab') as out:
+                if data[-1:] not in (b'\n', b'\r'):
+                    out.write(b'\n')
+                _write_incremental_update(out, reader, changed, prev_xref, as_stream)
+
+    return filled
+
+
+@_stage('optimize')
+def optimize_output(pdf_path: str) -> Optional[optimize.OptimizeResult]:
+    """Optimize a filled PDF in place at the ``PDF_OPTIMIZE`` level.
+
+    A file that cannot be optimized is kept as written.
+
+    Returns:
+        The optimization result, or None if it failed
+    """
     try:
-        # Try using pdfrw first (more reliable for native PDF forms)
+        result = optimize.optimize_pdf(pdf_path, PDF_OPTIMIZE)
+    except optimize.OptimizationError as e:
+        logger.warning(str(e))
+        return None
+    metrics.PDF_OPTIMIZE_BYTES.inc(result.bytes_before, level=result.level, phase='before')
+    metrics.PDF_OPTIMIZE_BYTES.inc(result.bytes_after, level=result.level, phase='after')
+    return result
+
+
+def _fill_pdf_form_native(template_path: str, field_data: Dict[str, Any], output_path: str) -> int:
+    """Fill a PDF form with pdfrw and write the whole document.
+
+    The cached parse of the template is used unless another fill holds it;
+    the values set on it are undone once the output is written.
+
+    Returns:
+        Number of widgets filled
+    """
+    from pdfrw import PdfReader, PdfWriter, PdfObject
+
+    cached = _cached_template(template_path)
+    if cached is not None and cached.lock.acquire(blocking=False):
+        reader = cached.reader
+    else:
+        cached = None
         reader = PdfReader(template_path)
 
+    changes = _Changes()
+    try:
         filled_count = 0
         for page in reader.pages:
             if page.Annots:
                 for annotation in page.Annots:
-                    if hasattr(annotation, 'T') and annotation.T:
-                        field_name = str(annotation.T).strip("()")
-                        if field_name in field_data:
-                            annotation.update(
-                                PdfDict(V=field_data[field_name], AP=PdfDict())
-                            )
+                    # Widgets of radio groups and other multi-widget fields have no /T
+                    if annotation.T or (annotation.Subtype == '/Widget' and annotation.Parent is not None):
+                        field_name = _match_field_name(annotation, field_data)
+                        if field_name is not None:
+                            _fill_widget(annotation, field_data[field_name], changes)
                             filled_count += 1
 
+        if filled_count and reader.Root.AcroForm is not None:
+            # Text appearances were dropped, so have viewers regenerate them
+            changes.set(reader.Root.AcroForm, 'NeedAppearances', PdfObject('true'))
+
         writer = PdfWriter()
         writer.write(output_path, reader)
+    finally:
+        if cached is not None:
+            changes.undo()
+            cached.lock.release()
+
+    return filled_count
+
+
+@_stage('fill')
+def fill_pdf_form(template_path: str, field_data: Dict[str, Any], output_path: str) -> bool:
+    """Fill a PDF form with data and save it to a new file.
+
+    This function attempts to fill a PDF form using pdfrw first, then falls back
+    to reportlab if the initial method doesn't work. Parsed templates are
+    kept in a per-process cache of ``FILL_CACHE_SIZE`` entries. Templates of
+    at least ``FILL_INCREMENTAL_MB`` are neither parsed nor cached but filled
+    through mmap with an incremental update
+    (:func:`_fill_pdf_form_incremental`) when their structure allows. Other
+    outputs are then optimized at the ``PDF_OPTIMIZE`` level
+    (:func:`optimize_output`); incremental ones are left as they are so that
+    the template is not rewritten. Values are written
+    according to the field type: strings for text and choice fields, the
+    export name and ``/AS`` appearance state for checkboxes and radio buttons.
+
+    Args:
+        template_path: Path to the PDF template
+        field_data: Dictionary mapping field names to values
+        output_path: Path to save the filled PDF
+
+    Returns:
+        True if successful
+
+    Raises:
+        PDFFillingError: If both primary and fallback methods fail
+    """
+    if not os.path.exists(template_path):
+        raise PDFFillingError(f"Template PDF not found: {template_path}")
+
+    if not field_data:
+        logger.warning("No form data provided, copying template as-is")
+        field_data = {}
+
+    if _fills_incrementally(os.path.getsize(template_path)):
+        try:
+            filled_count = _fill_pdf_form_incremental(template_path, field_data, output_path)
+            metrics.PDF_FIELDS_FILLED.inc(filled_count, method='incremental')
+            logger.info(f"Successfully filled {filled_count} fields in PDF incrementally and saved to {output_path}")
+            return True
+        except Exception as e:
+            logger.warning(f"Incremental fill failed ({str(e)}), parsing the whole template")
 
+    try:
+        # Try using pdfrw first (more reliable for native PDF forms)
+        filled_count = _fill_pdf_form_native(template_path, field_data, output_path)
+        optimize_output(output_path)
+        metrics.PDF_FIELDS_FILLED.inc(filled_count, method='native')
         logger.info(f"Successfully filled {filled_count} fields in PDF and saved to {output_path}")
         return True
 
@@ -140,14 +1154,17 @@ def fill_pdf_form(template_path: str, field_data: Dict[str, Any], output_path: s
         raise
     except Exception as e:
         logger.warning(f"pdfrw method failed ({str(e)}), trying fallback method")
+        metrics.PDF_FILL_FALLBACK.inc()
         try:
             _fill_pdf_form_fallback(template_path, field_data, output_path)
+            optimize_output(output_path)
             logger.info(f"Successfully filled PDF using fallback method and saved to {output_path}")
             return True
         except Exception as fallback_error:
             logger.error(f"Both PDF filling methods failed: {str(fallback_error)}", exc_info=True)
             raise PDFFillingError(f"Failed to fill PDF form: {str(fallback_error)}")
 
+@_stage('fill_fallback')
 def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], output_path: str) -> None:
     """Fallback method for filling PDF forms using reportlab overlay.
 
@@ -163,7 +1180,12 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
         PDFFillingError: If the fallback method fails
     """
     temp_pdf = None
+    stack = contextlib.ExitStack()
     try:
+        import PyPDF2
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+
         # Create a temporary PDF with form field values
         temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
         temp_pdf_name = temp_pdf.name
@@ -171,26 +1193,36 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
 
         c = canvas.Canvas(temp_pdf_name, pagesize=letter)
 
-        # Extract the coordinates of form fields from the template
-        reader = PyPDF2.PdfReader(template_path)
+        # Extract the coordinates of form fields from the template, read
+        # through a mapping so that the file is not copied into memory
+        data = stack.enter_context(_mapped(template_path))
+        reader = PyPDF2.PdfReader(data)
 
-        # Collect field information for each page
-        field_info = {}
+        # Collect field information for each widget
+        field_info = []
         for page_num, page in enumerate(reader.pages):
             if '/Annots' in page:
                 annotations = page['/Annots']
                 for annotation in annotations:
                     try:
                         annot_obj = annotation.get_object()
-                        if annot_obj.get('/Subtype') == '/Widget' and '/T' in annot_obj:
-                            field_name = str(annot_obj['/T']).strip("()")
-                            if field_name in field_data:
+                        if annot_obj.get('/Subtype') == '/Widget' and ('/T' in annot_obj or '/Parent' in annot_obj):
+                            field_name = _match_field_name(annot_obj, field_data)
+                            if field_name is not None:
+                                value = field_data[field_name]
+                                if '/AS' in annot_obj:
+                                    # Button widget: mark it only if it is the selected state
+                                    states = annot_obj['/AP']['/N'].get_object()
+                                    if value == fieldtypes.OFF or f"/{value}" not in states:
+                                        continue
+                                    value = 'X'
                                 rect = annot_obj.get('/Rect', [0, 0, 0, 0])
-                                field_info[field_name] = {
+                                field_info.append({
+                                    'name': field_name,
                                     'page': page_num,
                                     'rect': rect,
-                                    'value': field_data[field_name]
-                                }
+                                    'value': value
+                                })
                     except Exception as e:
                         logger.debug(f"Could not process annotation: {e}")
 
@@ -200,7 +1232,7 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
                 c.showPage()
 
             # Add text for fields on this page
-            for field_name, info in field_info.items():
+            for info in field_info:
                 if info['page'] == page_num:
                     try:
                         rect = info['rect']
@@ -213,18 +1245,17 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
                         # Add the text
                         c.drawString(x, y, str(info['value']))
                     except Exception as e:
-                        logger.warning(f"Could not draw field '{field_name}': {e}")
+                        logger.warning(f"Could not draw field '{info['name']}': {e}")
 
         c.save()
 
         # Merge the template and the temporary PDF with text
         output = PyPDF2.PdfWriter()
-        template = PyPDF2.PdfReader(template_path)
         overlay = PyPDF2.PdfReader(temp_pdf_name)
 
         # Merge each page
-        for i in range(len(template.pages)):
-            page = template.pages[i]
+        for i in range(len(reader.pages)):
+            page = reader.pages[i]
             if i < len(overlay.pages):
                 page.merge_page(overlay.pages[i])
             output.add_page(page)
@@ -233,12 +1264,14 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
         with open(output_path, 'wb') as f:
             output.write(f)
 
+        metrics.PDF_FIELDS_FILLED.inc(len(field_info), method='fallback')
         logger.info(f"Successfully filled PDF using fallback method")
 
     except Exception as e:
         logger.error(f"Error in fallback PDF filling method: {str(e)}", exc_info=True)
         raise PDFFillingError(f"Fallback method failed: {str(e)}")
     finally:
+        stack.close()
         # Clean up the temporary file
         if temp_pdf:
             try:
@@ -246,6 +1279,26 @@ def _fill_pdf_form_fallback(template_path: str, field_data: Dict[str, Any], outp
             except Exception as e:
                 logger.debug(f"Could not delete temporary file: {e}")
 
+def _render_page(pdf_path: str, page: int, dpi: int):
+    """Rasterize one page of a PDF with poppler.
+
+    Args:
+        pdf_path: Path to the PDF file
+        page: Index of the page, from 0
+        dpi: Resolution of the image
+
+    Returns:
+        The page as a PIL image
+    """
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page + 1, last_page=page + 1, fmt='png')
+    if not images:
+        raise PDFConversionError("No images generated from PDF")
+    return images[0]
+
+
+@_stage('render')
 def convert_pdf_to_png(pdf_path: str, png_path: str) -> bool:
     """Convert the first page of a PDF file to PNG format.
 
@@ -263,20 +1316,7 @@ def convert_pdf_to_png(pdf_path: str, png_path: str) -> bool:
         raise PDFConversionError(f"PDF file not found: {pdf_path}")
 
     try:
-        # Convert the first page of the PDF to PNG with reasonable DPI
-        images = convert_from_path(
-            pdf_path,
-            dpi=150,
-            first_page=1,
-            last_page=1,
-            fmt='png'
-        )
-
-        if not images:
-            raise PDFConversionError("No images generated from PDF")
-
-        # Save the first page as PNG
-        images[0].save(png_path, 'PNG')
+        _render_page(pdf_path, 0, PREVIEW_DPI).save(png_path, 'PNG')
         logger.info(f"Successfully converted PDF to PNG and saved to {png_path}")
         return True
 
@@ -285,3 +1325,347 @@ def convert_pdf_to_png(pdf_path: str, png_path: str) -> bool:
     except Exception as e:
         logger.error(f"Error converting PDF to PNG: {str(e)}", exc_info=True)
         raise PDFConversionError(f"Failed to convert PDF to PNG: {str(e)}")
+
+
+class _PreviewWidget(NamedTuple):
+    """A widget of a template page, placed on the page's rendered image."""
+
+    qualified: str
+    partial: Optional[str]
+    # Left, top, right and bottom edge in pixels
+    box: Tuple[int, int, int, int]
+    button: bool
+    # Names of the normal appearance states of buttons, without '/'
+    states: Tuple[str, ...]
+    flags: int
+    # Font size in pixels, 0 to fit the box
+    font_size: float
+    # Quadding: 0 left, 1 centered, 2 right
+    align: int
+
+
+class _PreviewBackground:
+    """A template page rendered without values, with the widgets to draw them into."""
+
+    def __init__(self, image, widgets: List[_PreviewWidget]):
+        self.image = image
+        self.widgets = widgets
+
+
+_preview_cache: 'OrderedDict[Tuple[str, int, int, int, int], _PreviewBackground]' = OrderedDict()
+_preview_cache_lock = threading.Lock()
+
+_DA_FONT_SIZE_RE = re.compile(r'([\d.]+)\s+Tf')
+
+
+def _preview_widgets(template_path: str, page_number: int, dpi: int) -> List[_PreviewWidget]:
+    """Read the widgets of a template page and place them at ``dpi``.
+
+    Raises:
+        PDFConversionError: If the page is rotated, which is not composited
+    """
+    import PyPDF2
+
+    scale = dpi / 72.0
+    with _mapped(template_path) as data:
+        reader = PyPDF2.PdfReader(data)
+        if page_number >= len(reader.pages):
+            raise PDFConversionError(f"Template has no page {page_number + 1}")
+        page = reader.pages[page_number]
+        if int(page.get('/Rotate', 0) or 0) % 360:
+            raise PDFConversionError("Rotated pages are not composited")
+        acroform = reader.trailer['/Root'].get('/AcroForm')
+        acroform = acroform.get_object() if acroform is not None else {}
+        media_box = page.mediabox
+        left, top = float(media_box.left), float(media_box.top)
+
+        widgets = []
+        for ref in page.get('/Annots') or []:
+            annotation = ref.get_object()
+            if annotation.get('/Subtype') != '/Widget' or int(annotation.get('/F', 0)) & _F_HIDDEN:
+                continue
+
+            def inherited(key: str, default=None):
+                node, depth = annotation, 0
+                while node is not None and depth < _MAX_FIELD_DEPTH:
+                    node = node.get_object()
+                    if key in node:
+                        return node[key]
+                    node, depth = node.get('/Parent'), depth + 1
+                return acroform.get(key, default)
+
+            x0, y0, x1, y1 = [float(v) for v in annotation.get('/Rect', (0, 0, 0, 0))]
+            box = (round((min(x0, x1) - left) * scale), round((top - max(y0, y1)) * scale),
+                   round((max(x0, x1) - left) * scale), round((top - min(y0, y1)) * scale))
+            if box[2] <= box[0] or box[3] <= box[1]:
+                continue
+
+            flags = int(inherited('/Ff', 0))
+            button = inherited('/FT') == '/Btn'
+            if button and flags & _FF_PUSHBUTTON:
+                continue
+            states: Tuple[str, ...] = ()
+            if button:
+                appearance = annotation.get('/AP')
+                normal = appearance.get_object().get('/N') if appearance is not None else None
+                normal = normal.get_object() if normal is not None else None
+                if isinstance(normal, dict):
+                    states = tuple(str(state)[1:] for state in normal.keys())
+
+            match = _DA_FONT_SIZE_RE.search(str(inherited('/DA', '')))
+            qualified, partial = _field_names(annotation)
+            widgets.append(_PreviewWidget(
+                qualified, partial, box, button, states, flags,
+                float(match.group(1)) * scale if match else 0.0, int(inherited('/Q', 0)),
+            ))
+    return widgets
+
+
+def _write_blank_template(template_path: str, names: List[str], output_path: str) -> None:
+    """Write a copy of a template with the fields ``names`` emptied.
+
+    Text and choice fields lose their value and appearance streams, which
+    poppler regenerates with the widgets' borders and backgrounds only, and
+    buttons are switched off, so that defaults saved in the template are not
+    rendered. The copy is an incremental update when the template allows.
+    """
+    blank = dict.fromkeys(names, '')
+    try:
+        _fill_pdf_form_incremental(template_path, blank, output_path)
+    except _UnsupportedObject:
+        _fill_pdf_form_native(template_path, blank, output_path)
+
+
+@_stage('render_background')
+def _render_background(template_path: str, page: int, dpi: int) -> _PreviewBackground:
+    widgets = _preview_widgets(template_path, page, dpi)
+    if not widgets:
+        return _PreviewBackground(_render_page(template_path, page, dpi).convert('RGB'), widgets)
+
+    blank = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    blank.close()
+    try:
+        _write_blank_template(template_path, sorted({widget.qualified for widget in widgets}), blank.name)
+        image = _render_page(blank.name, page, dpi).convert('RGB')
+    finally:
+        os.unlink(blank.name)
+    return _PreviewBackground(image, widgets)
+
+
+def _preview_background(template_path: str, page: int, dpi: int) -> _PreviewBackground:
+    """Return the rendered template page, rendering and caching it on a miss."""
+    path, mtime, size = _template_key(template_path)
+    key = (path, mtime, size, page, dpi)
+    with _preview_cache_lock:
+        entry = _preview_cache.get(key)
+        if entry is not None:
+            _preview_cache.move_to_end(key)
+    metrics.record_cache('preview_background', entry is not None)
+    if entry is not None:
+        return entry
+
+    entry = _render_background(template_path, page, dpi)
+    if PREVIEW_CACHE_SIZE > 0:
+        with _preview_cache_lock:
+            # Another thread may have rendered it meanwhile; keep the first
+            entry = _preview_cache.setdefault(key, entry)
+            _preview_cache.move_to_end(key)
+            for stale in [k for k in _preview_cache if k[0] == path and k[1:3] != key[1:3]]:
+                del _preview_cache[stale]
+            while len(_preview_cache) > PREVIEW_CACHE_SIZE:
+                _preview_cache.popitem(last=False)
+    return entry
+
+
+@functools.lru_cache(maxsize=64)
+def _preview_font(size: int):
+    from PIL import ImageFont
+
+    return ImageFont.load_default(size=size)
+
+
+@functools.lru_cache(maxsize=8192)
+def _preview_glyph(size: int, char: str):
+    """Return the mask of a character, its offset from the pen position on the baseline and its advance.
+
+    FreeType takes about half a millisecond to rasterize a short string, more
+    than the rest of a widget, so previews draw text from glyphs rendered
+    once per font size.
+    """
+    from PIL import Image, ImageDraw
+
+    font = _preview_font(size)
+    left, top, right, bottom = font.getbbox(char, anchor='ls')
+    mask = None
+    if right > left and bottom > top:
+        mask = Image.new('L', (right - left, bottom - top))
+        ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=font, anchor='ls')
+    return mask, left, top, font.getlength(char)
+
+
+def _draw_line(image, text: str, size: int, x: float, baseline: int, align: int) -> None:
+    """Draw one line of text in black from cached glyphs, aligned at ``x`` as by /Q."""
+    glyphs = [_preview_glyph(size, char) for char in text]
+    if align:
+        x -= sum(glyph[3] for glyph in glyphs) / (2 if align == 1 else 1)
+    for mask, left, top, advance in glyphs:
+        if x >= image.width:
+            break
+        if mask is not None:
+            image.paste((0, 0, 0), (round(x) + left, baseline + top), mask)
+        x += advance
+
+
+def _draw_widget(image, widget: _PreviewWidget, value: Any, dpi: int) -> bool:
+    """Draw the value of a field into its widget on ``image``.
+
+    Text is clipped to the widget. Buttons are drawn as a cross (checkboxes)
+    or a dot (radio buttons) when ``value`` selects them, as in
+    :func:`_fill_widget`.
+
+    Returns:
+        True if anything was drawn
+    """
+    from PIL import ImageDraw
+
+    text = '' if value is None else str(value).strip()
+    region = image.crop(widget.box)
+    width, height = region.size
+    padding = max(1, round(2 * dpi / 72))
+
+    if widget.button:
+        if _button_state(list(widget.states), text, widget.flags) is None:
+            return False
+        draw = ImageDraw.Draw(region)
+        inset = max(1, min(width, height) // 5)
+        mark = (inset, inset, width - 1 - inset, height - 1 - inset)
+        if widget.flags & _FF_RADIO:
+            draw.ellipse(mark, fill='black')
+        else:
+            stroke = max(1, min(width, height) // 10)
+            draw.line(mark, fill='black', width=stroke)
+            draw.line((mark[0], mark[3], mark[2], mark[1]), fill='black', width=stroke)
+    else:
+        if not text:
+            return False
+        if widget.flags & _FF_PASSWORD:
+            text = '*' * len(text)
+        multiline = widget.flags & _FF_MULTILINE
+        size = max(1, round(widget.font_size or (height - 2 * padding) * (1.0 if multiline else 0.75)))
+        ascent, descent = _preview_font(size).getmetrics()
+        x = [padding, width / 2, width - padding][widget.align % 3]
+        if multiline:
+            for i, line in enumerate(text.splitlines()):
+                _draw_line(region, line, size, x, padding + ascent + i * (ascent + descent), widget.align % 3)
+        else:
+            # Centered vertically, as Pillow's 'm' anchor
+            baseline = round(height / 2 + (ascent - descent) / 2)
+            _draw_line(region, text.splitlines()[0], size, x, baseline, widget.align % 3)
+
+    image.paste(region, widget.box[:2])
+    return True
+
+
+@_stage('composite')
+def composite_preview(template_path: str, field_data: Dict[str, Any], png_path: str,
+                      page: int = 0, dpi: int = PREVIEW_DPI) -> int:
+    """Render the preview of a filled form over a cached render of its template.
+
+    The template page is rasterized once per page and DPI, with its fields
+    emptied (:func:`_write_blank_template`), and kept in a per-process
+    cache of ``PREVIEW_CACHE_SIZE`` entries. A preview copies that image
+    and draws the values of ``field_data`` into the widgets, so
+    it does not run poppler. Values are drawn on a single line (unless the
+    field is multiline) in Pillow's default font, sized from the field's
+    default appearance, and approximate what viewers show.
+
+    Args:
+        template_path: Path to the PDF template
+        field_data: Dictionary mapping field names to values
+        png_path: Path to save the PNG file
+        page: Index of the page to render, from 0
+        dpi: Resolution of the image
+
+    Returns:
+        Number of widgets drawn
+
+    Raises:
+        PDFConversionError: If the template cannot be rendered or composited
+    """
+    if not os.path.exists(template_path):
+        raise PDFConversionError(f"Template file not found: {template_path}")
+
+    try:
+        background = _preview_background(template_path, page, dpi)
+        image = background.image.copy()
+        drawn = 0
+        for widget in background.widgets:
+            if widget.qualified in field_data:
+                value = field_data[widget.qualified]
+            elif widget.partial is not None and widget.partial in field_data:
+                value = field_data[widget.partial]
+            else:
+                continue
+            drawn += _draw_widget(image, widget, value, dpi)
+        image.save(png_path, 'PNG')
+    except PDFConversionError:
+        raise
+    except Exception as e:
+        logger.error(f"Error compositing preview: {str(e)}", exc_info=True)
+        raise PDFConversionError(f"Failed to composite preview: {str(e)}")
+
+    logger.info(f"Composited {drawn} fields over template {template_path} and saved to {png_path}")
+    return drawn
+
+
+def render_preview(pdf_path: str, png_path: str, template_path: Optional[str] = None,
+                   field_data: Optional[Dict[str, Any]] = None) -> bool:
+    """Render the PNG preview of a filled form according to ``PREVIEW_MODE``.
+
+    With ``composite``, the preview is drawn over the cached render of the
+    template (:func:`composite_preview`) when the template and the form data
+    are given, and the filled PDF is rendered in full if that fails.
+
+    Args:
+        pdf_path: Path to the filled PDF
+        png_path: Path to save the PNG file
+        template_path: Path to the PDF template the form was filled from
+        field_data: Dictionary mapping field names to the filled values
+
+    Returns:
+        True if successful
+
+    Raises:
+        PDFConversionError: If PDF to PNG conversion fails
+    """
+    if PREVIEW_MODE == 'composite' and template_path and field_data is not None:
+        try:
+            composite_preview(template_path, field_data, png_path)
+            return True
+        except PDFConversionError as e:
+            logger.info(f"Rendering full preview of {pdf_path} instead: {str(e)}")
+    return convert_pdf_to_png(pdf_path, png_path)
+
+
+def preload_preview_background(template_path: str) -> bool:
+    """Render a template's first page into the preview cache ahead of its first preview.
+
+    Returns:
+        True if the page was rendered, False if it was cached already or
+        composite previews are off
+    """
+    if PREVIEW_MODE != 'composite' or PREVIEW_CACHE_SIZE <= 0:
+        return False
+    path, mtime, size = _template_key(template_path)
+    with _preview_cache_lock:
+        cached = (path, mtime, size, 0, PREVIEW_DPI) in _preview_cache
+    if cached:
+        return False
+    _preview_background(template_path, 0, PREVIEW_DPI)
+    return True
+
+
+def clear_preview_cache() -> None:
+    """Drop every rendered template page from the preview cache."""
+    with _preview_cache_lock:
+        _preview_cache.clear()
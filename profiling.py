@@ -0,0 +1,212 @@
+"""On-demand cProfile and tracemalloc capture for PDF processing stages.
+
+Profiling is off unless a profile session is active in the current context.
+A session is opened per request (``X-Profile`` header or ``?profile=1``), per
+CLI run (``--profile``) or automatically for one in ``PROFILE_SAMPLE_RATE``
+requests. While a session is active, every ``pdf_processor`` stage is run
+under cProfile with tracemalloc tracing, and the collected statistics are
+written as a plain text report.
+
+cProfile (from Python 3.12) and tracemalloc can only be active once per
+process, so stages are captured one at a time: a profiled stage waits while
+another thread captures one. tracemalloc still traces the whole process, so
+with threaded workers the top allocations and the peak of a stage can include
+allocations made by concurrent requests that are not being profiled.
+"""
+
+import cProfile
+import contextvars
+import io
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Number of entries kept from the cProfile and tracemalloc statistics
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+
+_current_session: contextvars.ContextVar = contextvars.ContextVar('profile_session', default=None)
+_sample_counter = itertools.count(1)
+_sample_lock = threading.Lock()
+# Held while a stage is captured; _capture_owner is the thread holding it
+_capture_lock = threading.Lock()
+_capture_owner: Optional[int] = None
+
+
+class StageProfile:
+    """Profiling results of one stage."""
+
+    def __init__(self, name: str, duration: float, stats: str, allocations: List[str], peak_bytes: int):
+        self.name = name
+        self.duration = duration
+        self.stats = stats
+        self.allocations = allocations
+        self.peak_bytes = peak_bytes
+
+
+class ProfileSession:
+    """Collects stage profiles for one request or CLI run."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.created_at = datetime.now(timezone.utc)
+        self.stages: List[StageProfile] = []
+        self._active = False
+
+    @contextmanager
+    def capture(self, name: str) -> Iterator[None]:
+        """Profile the ``with`` block as stage ``name``.
+
+        Nested stages (such as the fallback inside a fill) are included in
+        the enclosing stage instead of being profiled separately, as are
+        stages of another session opened in the same thread meanwhile.
+        Waits while another thread captures a stage.
+        """
+        global _capture_owner
+
+        if self._active or _capture_owner == threading.get_ident():
+            yield
+            return
+
+        with _capture_lock:
+            _capture_owner = threading.get_ident()
+            self._active = True
+            # Tracing may have been started outside, e.g. with -X tracemalloc
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                duration = time.perf_counter() - start
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+                self._active = False
+                _capture_owner = None
+                self.stages.append(StageProfile(
+                    name, duration, _format_stats(profiler), _format_allocations(snapshot), peak
+                ))
+
+    def report(self) -> str:
+        """Render the collected profiles as a text report."""
+        lines = [
+            f"Profile: {self.label}",
+            f"Captured: {self.created_at.isoformat()}",
+            "",
+        ]
+        for stage in self.stages:
+            lines.append(
+                f"== Stage: {stage.name} ({stage.duration * 1000:.1f} ms, "
+                f"peak traced memory {stage.peak_bytes / (1024 * 1024):.1f} MB) =="
+            )
+            lines.append(f"-- cProfile (top {PROFILE_TOP_FUNCTIONS} by cumulative time) --")
+            lines.append(stage.stats.rstrip())
+            lines.append(f"-- tracemalloc (top {PROFILE_TOP_ALLOCATIONS} allocations by line) --")
+            lines.extend(stage.allocations)
+            lines.append("")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> Optional[str]:
+        """Write the report to ``path`` if any stage was captured.
+
+        Returns:
+            The path written, or None if there was nothing to write
+        """
+        if not self.stages:
+            return None
+        with open(path, 'w') as f:
+            f.write(self.report())
+        logger.info(f"Wrote profile for {self.label} to {path}")
+        return path
+
+
+def _format_stats(profiler: cProfile.Profile) -> str:
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    return stream.getvalue()
+
+
+def _format_allocations(snapshot: tracemalloc.Snapshot) -> List[str]:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    return [
+        f"{index}. {stat}"
+        for index, stat in enumerate(snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS], 1)
+    ]
+
+
+def sample_rate() -> int:
+    """Return N from ``PROFILE_SAMPLE_RATE`` (profile 1 in N runs), 0 when disabled."""
+    try:
+        return max(int(os.environ.get('PROFILE_SAMPLE_RATE', '0')), 0)
+    except ValueError:
+        return 0
+
+
+def should_profile(requested: bool = False) -> bool:
+    """Decide whether to profile the current request or run.
+
+    Args:
+        requested: True if profiling was explicitly asked for
+
+    Returns:
+        True if explicitly requested or selected by the sampling rate
+    """
+    if requested:
+        return True
+    rate = sample_rate()
+    if not rate:
+        return False
+    with _sample_lock:
+        return next(_sample_counter) % rate == 0
+
+
+@contextmanager
+def session(label: str, enabled: bool = True) -> Iterator[Optional[ProfileSession]]:
+    """Activate a profile session for the current context.
+
+    Args:
+        label: Description of what is being profiled, used in the report
+        enabled: If False, no session is opened and None is yielded
+
+    Yields:
+        The active ProfileSession, or None when disabled
+    """
+    if not enabled:
+        yield None
+        return
+    profile = ProfileSession(label)
+    token = _current_session.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_session.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Profile the ``with`` block as stage ``name`` if a session is active."""
+    profile = _current_session.get()
+    if profile is None:
+        yield
+        return
+    with profile.capture(name):
+        yield
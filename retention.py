@@ -0,0 +1,343 @@
+"""Retention and tiered storage of filled outputs.
+
+Each template has a retention policy: keep the outputs of forms younger than
+``retention_days``, of the newest ``retention_max_forms`` forms and of the
+newest forms up to ``retention_max_bytes`` in the upload folder (the hot
+tier). Columns left empty fall back to the ``RETENTION_*`` settings.
+
+Compaction moves the outputs of forms outside the policy ("cold" forms) out
+of the hot tier in two steps:
+
+1. PNG previews are deleted, since they can be rendered again from the PDF.
+2. Forms still outside the policy have their PDF moved into a compressed zip
+   bundle in ``ARCHIVE_FOLDER`` (the archive tier).
+
+Archived PDFs are extracted back into the hot tier on download, and missing
+previews are rendered again. A bundle is written and synced (and stored in
+the storage backend) before the rows point at it, and hot files are only
+deleted after that commit, so an interrupted compaction never loses a file.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import select
+
+import admission
+import jobs
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Row IDs per UPDATE statement, below the SQLite bound parameter limit
+UPDATE_CHUNK_SIZE = 500
+
+
+def init_app(app: Flask) -> None:
+    """Read the retention settings for ``app``.
+
+    Reads ``ARCHIVE_FOLDER``, the policy defaults ``RETENTION_DAYS``,
+    ``RETENTION_MAX_FORMS`` and ``RETENTION_MAX_MB`` (unset for no limit)
+    and ``RETENTION_INTERVAL_MINUTES`` (compact periodically in each worker
+    process once :func:`start` is called, 0 to only compact through
+    ``flask compact``).
+    """
+    def optional_number(name: str) -> Optional[int]:
+        value = os.environ.get(name, '').strip()
+        return int(value) if value else None
+
+    default_archive = app.config['UPLOAD_FOLDER'].rstrip(os.sep) + '_archive'
+    app.config.setdefault('ARCHIVE_FOLDER', os.environ.get('ARCHIVE_FOLDER', default_archive))
+    app.config.setdefault('RETENTION_DAYS', optional_number('RETENTION_DAYS'))
+    app.config.setdefault('RETENTION_MAX_FORMS', optional_number('RETENTION_MAX_FORMS'))
+    max_mb = optional_number('RETENTION_MAX_MB')
+    app.config.setdefault('RETENTION_MAX_BYTES', max_mb * 1024 * 1024 if max_mb is not None else None)
+    app.config.setdefault('RETENTION_INTERVAL_MINUTES', float(os.environ.get('RETENTION_INTERVAL_MINUTES', '0')))
+    os.makedirs(app.config['ARCHIVE_FOLDER'], exist_ok=True)
+
+
+def start(app: Flask) -> Optional[threading.Thread]:
+    """Schedule periodic compaction in this process, unless ``RETENTION_INTERVAL_MINUTES`` is 0.
+
+    Returns:
+        The timer thread, or None
+    """
+    if app.config['RETENTION_INTERVAL_MINUTES'] <= 0:
+        return None
+    return jobs.schedule(app, 'retention', app.config['RETENTION_INTERVAL_MINUTES'] * 60, compact_all)
+
+
+@dataclass
+class Policy:
+    """Effective retention limits of a template, None meaning no limit."""
+
+    days: Optional[int] = None
+    max_forms: Optional[int] = None
+    max_bytes: Optional[int] = None
+
+    @classmethod
+    def for_template(cls, template) -> 'Policy':
+        config = current_app.config
+        return cls(
+            days=template.retention_days if template.retention_days is not None else config['RETENTION_DAYS'],
+            max_forms=(template.retention_max_forms if template.retention_max_forms is not None
+                       else config['RETENTION_MAX_FORMS']),
+            max_bytes=(template.retention_max_bytes if template.retention_max_bytes is not None
+                       else config['RETENTION_MAX_BYTES']),
+        )
+
+    @property
+    def unlimited(self) -> bool:
+        return self.days is None and self.max_forms is None and self.max_bytes is None
+
+
+@dataclass
+class CompactionResult:
+    """Outcome of compacting one or more templates."""
+
+    previews_dropped: int = 0
+    pdfs_archived: int = 0
+    bytes_freed: int = 0
+    errors: int = 0
+
+
+def _size(path: Optional[str]) -> int:
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def _cold_forms(forms: List, policy: Policy, include_png: bool) -> List:
+    """Return the forms outside ``policy``, given forms ordered newest first.
+
+    Args:
+        forms: Rows with id, created_at, pdf_path and png_path
+        policy: Limits to apply
+        include_png: Count PNG previews towards the byte limit
+    """
+    cutoff = datetime.utcnow() - timedelta(days=policy.days) if policy.days is not None else None
+    cold, total = [], 0
+    for position, form in enumerate(forms):
+        total += _size(form.pdf_path) + (_size(form.png_path) if include_png else 0)
+        if ((cutoff is not None and form.created_at < cutoff)
+                or (policy.max_forms is not None and position >= policy.max_forms)
+                or (policy.max_bytes is not None and total > policy.max_bytes)):
+            cold.append(form)
+    return cold
+
+
+def _stored(path: str) -> bool:
+    """Whether a hot file exists locally or in the storage backend."""
+    if os.path.exists(path):
+        return True
+    backend = storage.backend()
+    return backend is not None and backend.exists(storage.key_for(path))
+
+
+def _drop(path: str, result: CompactionResult) -> None:
+    """Remove a hot file from the upload folder and the storage backend."""
+    storage.remove(path)
+    if os.path.exists(path):
+        result.bytes_freed += _size(path)
+        os.remove(path)
+
+
+def _write_bundle(archive_folder: str, template_id: int, paths: List[str]) -> str:
+    """Write ``paths`` into a new zip bundle and return its path."""
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    bundle_path = os.path.join(archive_folder, f"template_{template_id}_{stamp}.zip")
+    temp_path = bundle_path + '.part'
+    try:
+        with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+            for path in paths:
+                bundle.write(path, arcname=os.path.basename(path))
+        with open(temp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return bundle_path
+
+
+def _update_forms(form_ids: List[int], values: dict) -> None:
+    """Set ``values`` on the given filled forms in chunks, in one transaction."""
+    from app import db
+    from models import FilledForm
+
+    for i in range(0, len(form_ids), UPDATE_CHUNK_SIZE):
+        db.session.query(FilledForm).filter(FilledForm.id.in_(form_ids[i:i + UPDATE_CHUNK_SIZE])).update(
+            values, synchronize_session=False
+        )
+    db.session.commit()
+
+
+def compact_template(template_id: int) -> CompactionResult:
+    """Apply the retention policy of one template.
+
+    Must run inside an app context.
+
+    Args:
+        template_id: ID of the template to compact
+
+    Returns:
+        Counts of dropped previews, archived PDFs and freed bytes
+    """
+    from app import db
+    from models import PDFTemplate, FilledForm
+
+    result = CompactionResult()
+    template = db.session.get(PDFTemplate, template_id)
+    if template is None or template.deleted_at is not None:
+        return result
+    policy = Policy.for_template(template)
+    if policy.unlimited:
+        return result
+
+    forms = db.session.execute(
+        select(FilledForm.id, FilledForm.created_at, FilledForm.pdf_path, FilledForm.png_path,
+               FilledForm.archive_path)
+        .where(FilledForm.template_id == template_id, FilledForm.deleted_at.is_(None))
+        .order_by(FilledForm.created_at.desc(), FilledForm.id.desc())
+    ).all()
+
+    # Step 1: drop the regenerable previews of cold forms
+    previews = [form for form in _cold_forms(forms, policy, include_png=True)
+                if form.png_path and _stored(form.png_path)]
+    if previews:
+        _update_forms([form.id for form in previews], {FilledForm.png_sha256: None})
+    for form in previews:
+        _drop(form.png_path, result)
+        result.previews_dropped += 1
+
+    # Step 2: archive the PDFs of forms still outside the policy
+    to_bundle, already_archived = [], []
+    for form in _cold_forms(forms, policy, include_png=False):
+        if not form.pdf_path or not _stored(form.pdf_path):
+            continue
+        if form.archive_path and _stored(form.archive_path):
+            # Restored on an earlier download: the bundle still holds it
+            already_archived.append(form)
+        else:
+            to_bundle.append(form)
+
+    # PDFs filled on other nodes may only be in the storage backend
+    fetched = [form for form in to_bundle if storage.fetch(form.pdf_path)]
+    if len(fetched) < len(to_bundle):
+        missing = [form.pdf_path for form in to_bundle if form not in fetched]
+        logger.warning(f"Template {template_id}: could not fetch {len(missing)} PDFs to archive, "
+                       f"e.g. {missing[0]}")
+        result.errors += len(missing)
+    to_bundle = fetched
+
+    if to_bundle:
+        bundle_path = _write_bundle(current_app.config['ARCHIVE_FOLDER'], template_id,
+                                    [form.pdf_path for form in to_bundle])
+        storage.publish(bundle_path)
+        _update_forms([form.id for form in to_bundle], {FilledForm.archive_path: bundle_path})
+    for form in to_bundle + already_archived:
+        _drop(form.pdf_path, result)
+        result.pdfs_archived += 1
+
+    if result.previews_dropped or result.pdfs_archived:
+        logger.info(
+            f"Compacted template {template_id}: {result.previews_dropped} previews dropped, "
+            f"{result.pdfs_archived} PDFs archived, {result.bytes_freed} bytes freed"
+        )
+    return result
+
+
+def compact_all() -> CompactionResult:
+    """Apply the retention policy of every template.
+
+    Must run inside an app context. A template that fails to compact is
+    logged and counted in ``errors``, and the others are still compacted.
+    """
+    from app import db
+    from models import PDFTemplate
+
+    total = CompactionResult()
+    template_ids = db.session.scalars(select(PDFTemplate.id).where(PDFTemplate.deleted_at.is_(None))).all()
+    for template_id in template_ids:
+        try:
+            result = compact_template(template_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Compacting template {template_id} failed: {str(e)}", exc_info=True)
+            total.errors += 1
+            continue
+        total.previews_dropped += result.previews_dropped
+        total.pdfs_archived += result.pdfs_archived
+        total.bytes_freed += result.bytes_freed
+        total.errors += result.errors
+    return total
+
+
+def restore_pdf(filled_form) -> bool:
+    """Extract an archived PDF back into the hot tier.
+
+    Args:
+        filled_form: FilledForm whose PDF is missing from the upload folder
+
+    Returns:
+        True if the PDF is in place afterwards
+    """
+    if storage.fetch(filled_form.pdf_path):
+        return True
+    if not filled_form.pdf_path or not storage.fetch(filled_form.archive_path):
+        return False
+
+    start = time.perf_counter()
+    member = os.path.basename(filled_form.pdf_path)
+    # Concurrent downloads of the form each extract to their own file
+    fd, temp_path = tempfile.mkstemp(prefix='.restore_', suffix='.part', dir=os.path.dirname(filled_form.pdf_path))
+    try:
+        with os.fdopen(fd, 'wb') as target, zipfile.ZipFile(filled_form.archive_path) as bundle, \
+                bundle.open(member) as source:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(temp_path, filled_form.pdf_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    logger.info(f"Restored {member} from {filled_form.archive_path} in {time.perf_counter() - start:.3f}s")
+    return True
+
+
+def regenerate_png(filled_form) -> bool:
+    """Render a dropped PNG preview again from the filled PDF.
+
+    Args:
+        filled_form: FilledForm whose preview is missing
+
+    Returns:
+        True if the preview is in place afterwards
+
+    Raises:
+        admission.Overloaded: If no render slot is available
+    """
+    import pdf_processor
+
+    if storage.fetch(filled_form.png_path):
+        return True
+    if not filled_form.png_path or not restore_pdf(filled_form):
+        return False
+    with admission.slot(admission.RENDER):
+        try:
+            pdf_processor.convert_pdf_to_png(filled_form.pdf_path, filled_form.png_path)
+        except Exception as e:
+            logger.warning(f"Could not regenerate preview of filled form {filled_form.id}: {str(e)}")
+            return False
+    storage.publish(filled_form.png_path)
+    return True
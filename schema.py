@@ -0,0 +1,155 @@
+"""Compiled per-template field schemas, cached in process memory.
+
+Rendering the form of a template and reading a submission only need the
+field names, types and options, but loading ``FormField`` rows builds one ORM object
+per field on every request, which dominates for templates with thousands of
+fields. A :class:`CompiledSchema` holds the fields as plain tuples, read
+with a single column query, together with the form's input markup rendered
+once from ``templates/_fields.html``.
+
+Schemas are cached per process under ``(template_id, file_path,
+schema_version)``. ``PDFTemplate.schema_version`` is bumped whenever the
+fields of a template are replaced, so every process picks up the new schema
+on its next request without any cross-process invalidation. SQLite reuses
+the ID of the highest row once it is purged, so the key also holds the
+file path, which is unique to each upload.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from flask import Flask, current_app, render_template
+from markupsafe import Markup
+from sqlalchemy import select
+
+import fieldtypes
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Field tuple layout: (name, type, required, options), see fieldtypes.Field
+NAME, TYPE, REQUIRED, OPTIONS = range(4)
+
+# Cache key: (template_id, file_path, schema_version)
+SchemaKey = Tuple[int, str, int]
+
+
+class CompiledSchema(NamedTuple):
+    """Fields of a template version and their pre-rendered form inputs."""
+
+    template_id: int
+    version: int
+    fields: Tuple[fieldtypes.Field, ...]
+    html: Markup
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(field[NAME] for field in self.fields)
+
+    def extract(self, form) -> Dict[str, str]:
+        """Read and coerce the submitted value of every field from ``form``.
+
+        Args:
+            form: Request form data (a MultiDict)
+
+        Returns:
+            Field name to value: stripped text, the export name or 'Off' for
+            buttons, empty for missing text and choice fields
+
+        Raises:
+            fieldtypes.FieldValueError: If a button or choice value is not one
+                of the field's options
+        """
+        values = form.to_dict(flat=True) if hasattr(form, 'to_dict') else dict(form)
+        return fieldtypes.coerce_records(self.fields, [values])[0]
+
+
+class SchemaCache:
+    """Thread-safe LRU cache of compiled schemas."""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[SchemaKey, CompiledSchema]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: SchemaKey) -> Optional[CompiledSchema]:
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+            return compiled
+
+    def put(self, key: SchemaKey, compiled: CompiledSchema) -> None:
+        with self._lock:
+            # Older versions of the template, and templates that had its ID
+            # before, can never be requested again
+            for stale in [stale for stale in self._entries if stale[0] == key[0]]:
+                del self._entries[stale]
+            self._entries[key] = compiled
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, template_id: int) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == template_id]:
+                del self._entries[key]
+
+
+def init_app(app: Flask) -> None:
+    """Create the schema cache for ``app``, sized by ``SCHEMA_CACHE_SIZE``."""
+    app.config.setdefault('SCHEMA_CACHE_SIZE', int(os.environ.get('SCHEMA_CACHE_SIZE', '128')))
+    app.extensions['schema_cache'] = SchemaCache(app.config['SCHEMA_CACHE_SIZE'])
+
+
+def compile_schema(template_id: int, version: int) -> CompiledSchema:
+    """Read the fields of a template and render their form inputs.
+
+    Must run inside an app context.
+    """
+    from app import db
+    from models import FormField
+
+    rows = db.session.execute(
+        select(FormField.field_name, FormField.field_type, FormField.options)
+        .where(FormField.template_id == template_id)
+        .order_by(FormField.id)
+    ).all()
+    fields = []
+    for name, field_type, options in rows:
+        field_type = field_type if field_type in fieldtypes.TYPES else fieldtypes.TEXT
+        options = tuple(json.loads(options)) if options else ()
+        # An unchecked box is a valid answer, so checkboxes are never required
+        fields.append((name, field_type, field_type != fieldtypes.CHECKBOX, options))
+    fields = tuple(fields)
+    html = Markup(render_template('_fields.html', fields=fields))
+    return CompiledSchema(template_id, version, fields, html)
+
+
+def for_template(template) -> CompiledSchema:
+    """Return the compiled schema of ``template``, compiling it on a miss.
+
+    Args:
+        template: PDFTemplate (only ``id``, ``file_path`` and
+            ``schema_version`` are read)
+    """
+    cache: SchemaCache = current_app.extensions['schema_cache']
+    version = template.schema_version or 0
+    key = (template.id, template.file_path, version)
+    compiled = cache.get(key)
+    metrics.record_cache('schema', compiled is not None)
+    if compiled is None:
+        compiled = compile_schema(template.id, version)
+        cache.put(key, compiled)
+        logger.debug(f"Compiled schema of template {template.id} v{version} with {len(compiled.fields)} fields")
+    return compiled
+
+
+def invalidate(template_id: int) -> None:
+    """Drop the cached schemas of a template in this process, e.g. once it is purged."""
+    cache: Optional[SchemaCache] = current_app.extensions.get('schema_cache')
+    if cache is not None:
+        cache.invalidate(template_id)
@@ -0,0 +1,32 @@
+// Poll the field extraction status of a template until it is ready
+document.addEventListener('DOMContentLoaded', function() {
+    const status = document.getElementById('templateStatus');
+
+    if (!status) {
+        return;
+    }
+
+    const url = status.dataset.statusUrl;
+    const detail = document.getElementById('templateStatusDetail');
+    let delay = 1000;
+
+    function poll() {
+        fetch(url, { headers: { 'Accept': 'application/json' } })
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'processing') {
+                    if (data.attempts > 1) {
+                        detail.textContent = 'Attempt ' + data.attempts + ': ' + (data.error || 'retrying...');
+                    }
+                    // Back off up to 5 seconds between polls
+                    delay = Math.min(delay * 1.5, 5000);
+                    setTimeout(poll, delay);
+                } else {
+                    window.location.reload();
+                }
+            })
+            .catch(() => setTimeout(poll, 5000));
+    }
+
+    setTimeout(poll, delay);
+});
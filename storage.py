@@ -0,0 +1,347 @@
+"""Pluggable storage backends for templates and generated files.
+
+The upload folder (and the archive folder) remain the local working copy:
+the PDF libraries read and write plain files there. With a storage backend
+configured, every stored file is also written through to the backend, files
+missing from the local working copy are fetched from it on demand, and purges
+delete from it. Several app nodes sharing one database can then share
+templates and outputs through the backend.
+
+Backends, selected with ``STORAGE_BACKEND``:
+
+* empty (default): no backend, the working folders are the only copy
+* ``local``: a directory, e.g. a shared mount, set with ``STORAGE_LOCAL_ROOT``
+* ``s3``: an S3-compatible bucket (AWS S3, MinIO, ...), requires boto3.
+  ``S3_BUCKET``, ``S3_PREFIX``, ``S3_ENDPOINT_URL``, ``S3_REGION`` and
+  ``S3_MAX_POOL_CONNECTIONS`` configure it; credentials come from the usual
+  AWS environment variables or config files.
+
+Objects are keyed by their path relative to the upload folder, with files of
+the archive folder under ``archive/``. :class:`WorkingCopy` maps files to
+keys; the module functions use the one of the current app, and the CLI
+builds its own. Flask is only imported by those functions, so the CLI does
+not load it.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Files larger than this are transferred to S3 in parts of MULTIPART_CHUNK_SIZE
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class StorageError(Exception):
+    """Exception raised when a storage backend operation fails."""
+    pass
+
+
+class Storage:
+    """Interface of a storage backend. Keys are relative, '/'-separated paths."""
+
+    def put(self, key: str, local_path: str) -> None:
+        """Store the file at ``local_path`` under ``key``."""
+        raise NotImplementedError
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the content stored under ``key`` in chunks.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under ``key``
+        """
+        raise NotImplementedError
+
+    def get(self, key: str, local_path: str) -> None:
+        """Write the content stored under ``key`` to ``local_path`` atomically.
+
+        Raises:
+            FileNotFoundError: If nothing is stored under ``key``
+        """
+        fd, temp_path = tempfile.mkstemp(prefix='.fetch_', suffix='.part', dir=os.path.dirname(local_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in self.stream(key):
+                    f.write(chunk)
+            os.replace(temp_path, local_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def delete(self, key: str) -> None:
+        """Delete ``key``; deleting a missing key is not an error."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """Return True if something is stored under ``key``."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """Storage in a local directory, such as a mount shared between nodes."""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, *key.split('/')))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise StorageError(f"Key outside of the storage root: {key}")
+        return path
+
+    def put(self, key: str, local_path: str) -> None:
+        path = self._path(key)
+        if os.path.abspath(local_path) == path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.part"
+        shutil.copyfile(local_path, temp_path)
+        os.replace(temp_path, path)
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self._path(key), 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+
+class S3Storage(Storage):
+    """Storage in an S3-compatible bucket.
+
+    One client is shared by all threads of the process, with a connection
+    pool sized by ``max_pool_connections``. Uploads and downloads go through
+    boto3's transfer manager, which streams files from and to disk and
+    switches to parallel multipart transfers above ``MULTIPART_THRESHOLD``.
+    """
+
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, max_pool_connections: int = 10):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError:
+            raise StorageError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=Config(max_pool_connections=max_pool_connections, retries={'mode': 'standard'}),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNK_SIZE,
+            max_concurrency=max(1, max_pool_connections // 2),
+        )
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _is_missing(self, error: Exception) -> bool:
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, key: str, local_path: str) -> None:
+        self.client.upload_file(local_path, self.bucket, self._key(key), Config=self.transfer_config)
+
+    def stream(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        from botocore.exceptions import ClientError
+
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def get(self, key: str, local_path: str) -> None:
+        from botocore.exceptions import ClientError
+
+        fd, temp_path = tempfile.mkstemp(prefix='.fetch_', suffix='.part', dir=os.path.dirname(local_path))
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(key), temp_path, Config=self.transfer_config)
+            os.replace(temp_path, local_path)
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+
+def create_storage(backend: str, environ=os.environ) -> Optional[Storage]:
+    """Create the backend named ``backend`` from environment settings.
+
+    Returns:
+        The backend, or None when ``backend`` is empty
+
+    Raises:
+        StorageError: If the backend is unknown or misconfigured
+    """
+    backend = (backend or '').strip().lower()
+    if not backend:
+        return None
+    if backend == 'local':
+        root = environ.get('STORAGE_LOCAL_ROOT')
+        if not root:
+            raise StorageError("STORAGE_BACKEND=local requires STORAGE_LOCAL_ROOT")
+        return LocalStorage(root)
+    if backend == 's3':
+        bucket = environ.get('S3_BUCKET')
+        if not bucket:
+            raise StorageError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        return S3Storage(
+            bucket,
+            prefix=environ.get('S3_PREFIX', ''),
+            endpoint_url=environ.get('S3_ENDPOINT_URL'),
+            region=environ.get('S3_REGION'),
+            max_pool_connections=int(environ.get('S3_MAX_POOL_CONNECTIONS', '10')),
+        )
+    raise StorageError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def init_app(app: 'Flask') -> None:
+    """Create the storage backend for ``app`` from ``STORAGE_BACKEND``."""
+    app.config.setdefault('STORAGE_BACKEND', os.environ.get('STORAGE_BACKEND', ''))
+    app.extensions['storage'] = create_storage(app.config['STORAGE_BACKEND'])
+    if app.extensions['storage'] is not None:
+        logger.info(f"Storing files through the {app.config['STORAGE_BACKEND']} storage backend")
+
+
+class WorkingCopy:
+    """The upload and archive folders as a local working copy of a backend.
+
+    Args:
+        storage: Storage backend, or None when the folders are the only copy
+        upload_folder: Folder of templates and generated files
+        archive_folder: Folder of archived outputs, stored under ``archive/``
+    """
+
+    def __init__(self, storage: Optional[Storage], upload_folder: str, archive_folder: Optional[str] = None):
+        self.storage = storage
+        self.upload_folder = upload_folder
+        self.archive_folder = archive_folder
+
+    def key_for(self, path: str) -> str:
+        """Return the storage key of a file in the upload or archive folder."""
+        path = os.path.abspath(path)
+        for folder, prefix in ((self.archive_folder, 'archive/'), (self.upload_folder, '')):
+            if folder:
+                folder = os.path.abspath(folder)
+                if os.path.commonpath([folder, path]) == folder:
+                    return prefix + os.path.relpath(path, folder).replace(os.sep, '/')
+        return os.path.basename(path)
+
+    def publish(self, path: Optional[str]) -> None:
+        """Write a local working file through to the storage backend."""
+        if self.storage is None or not path or not os.path.exists(path):
+            return
+        self.storage.put(self.key_for(path), path)
+
+    def fetch(self, path: Optional[str]) -> bool:
+        """Make sure a stored file is present in the local working copy.
+
+        Returns:
+            True if the file exists locally afterwards
+        """
+        if not path:
+            return False
+        if os.path.exists(path):
+            return True
+        if self.storage is None:
+            return False
+        try:
+            self.storage.get(self.key_for(path), path)
+        except FileNotFoundError:
+            return False
+        logger.debug(f"Fetched {path} from storage")
+        return True
+
+    def remove(self, path: Optional[str]) -> None:
+        """Delete a file from the storage backend (the local copy is left alone)."""
+        if self.storage is None or not path:
+            return
+        try:
+            self.storage.delete(self.key_for(path))
+        except Exception as e:
+            logger.warning(f"Could not delete {path} from storage: {str(e)}")
+
+
+def backend() -> Optional[Storage]:
+    """Return the storage backend of the current app, None if not configured."""
+    from flask import current_app
+
+    return current_app.extensions.get('storage')
+
+
+def working_copy() -> WorkingCopy:
+    """Return the working copy of the current app's folders and backend."""
+    from flask import current_app
+
+    config = current_app.config
+    return WorkingCopy(current_app.extensions.get('storage'), config['UPLOAD_FOLDER'], config.get('ARCHIVE_FOLDER'))
+
+
+def key_for(path: str) -> str:
+    """Return the storage key of a file in the upload or archive folder."""
+    return working_copy().key_for(path)
+
+
+def publish(path: Optional[str]) -> None:
+    """Write a local working file through to the storage backend."""
+    working_copy().publish(path)
+
+
+def fetch(path: Optional[str]) -> bool:
+    """Make sure a stored file is present in the local working copy.
+
+    Returns:
+        True if the file exists locally afterwards
+    """
+    return working_copy().fetch(path)
+
+
+def remove(path: Optional[str]) -> None:
+    """Delete a file from the storage backend (the local copy is left alone)."""
+    working_copy().remove(path)
@@ -0,0 +1,305 @@
+"""Purging of deleted rows and garbage collection of orphaned files.
+
+Deleting a template only marks it (and its filled forms) as deleted, which
+is a single short transaction. :func:`purge_deleted` then removes the rows
+with set-based deletes in small chunks, so no request or transaction has to
+touch every filled form of a large template.
+
+The files of purged rows are removed after each chunk is committed, from
+the upload folder and from the storage backend.
+:func:`sweep_orphans` compares the upload folder against the paths
+referenced in the database and reclaims files that no row references any
+more, such as files left behind by crashes or failed requests. Files younger
+than the grace period are kept, since their row may not be committed yet.
+All removals are rate limited so a large purge or sweep does not saturate
+the disk.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Set
+
+from flask import Flask
+from sqlalchemy import delete, select, update
+
+import jobs
+import metrics
+import schema
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Rows removed per DELETE statement and transaction
+PURGE_CHUNK_SIZE = 1000
+# Rows fetched at a time when collecting referenced paths
+REFERENCE_BATCH_SIZE = 5000
+
+
+def init_app(app: Flask) -> None:
+    """Read the sweep settings for ``app``.
+
+    Reads ``SWEEP_GRACE_SECONDS`` (age below which unreferenced files are
+    kept), ``SWEEP_MAX_FILES_PER_SECOND`` (removal rate limit, 0 for none)
+    and ``SWEEP_INTERVAL_MINUTES`` (run :func:`run` periodically in each
+    worker process once :func:`start` is called, 0 to only sweep through
+    ``flask sweep``).
+    """
+    app.config.setdefault('SWEEP_GRACE_SECONDS', int(os.environ.get('SWEEP_GRACE_SECONDS', '3600')))
+    app.config.setdefault('SWEEP_MAX_FILES_PER_SECOND',
+                          float(os.environ.get('SWEEP_MAX_FILES_PER_SECOND', '100')))
+    app.config.setdefault('SWEEP_INTERVAL_MINUTES', float(os.environ.get('SWEEP_INTERVAL_MINUTES', '0')))
+
+
+def start(app: Flask) -> Optional[threading.Thread]:
+    """Schedule periodic sweeps in this process, unless ``SWEEP_INTERVAL_MINUTES`` is 0.
+
+    Returns:
+        The timer thread, or None
+    """
+    if app.config['SWEEP_INTERVAL_MINUTES'] <= 0:
+        return None
+    return jobs.schedule(app, 'sweep', app.config['SWEEP_INTERVAL_MINUTES'] * 60, run)
+
+
+@dataclass
+class SweepResult:
+    """Outcome of a sweep."""
+
+    scanned: int = 0
+    removed: int = 0
+    bytes_removed: int = 0
+    kept_recent: int = 0
+    errors: int = 0
+
+
+class RateLimiter:
+    """Spaces operations evenly to at most ``max_per_second``."""
+
+    def __init__(self, max_per_second: float = 0):
+        self.interval = 1.0 / max_per_second if max_per_second > 0 else 0
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        """Block until the next operation is allowed."""
+        if not self.interval:
+            return
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next = max(self._next, time.monotonic()) + self.interval
+
+
+def _remove_files(paths: Iterable[Optional[str]], limiter: RateLimiter, result: SweepResult) -> None:
+    for path in paths:
+        if not path:
+            continue
+        limiter.wait()
+        storage.remove(path)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"Could not remove file {path}: {str(e)}")
+            result.errors += 1
+            continue
+        result.removed += 1
+        result.bytes_removed += size
+        metrics.SWEEP_FILES_REMOVED.inc()
+        metrics.SWEEP_BYTES_REMOVED.inc(size)
+
+
+def _purge_forms(condition, chunk_size: int, limiter: RateLimiter, result: SweepResult) -> int:
+    """Delete filled forms matching ``condition`` chunk by chunk, then their files."""
+    from app import db
+    from models import FilledForm
+
+    removed = 0
+    while True:
+        rows = db.session.execute(
+            select(FilledForm.id, FilledForm.pdf_path, FilledForm.png_path, FilledForm.profile_path)
+            .where(condition).limit(chunk_size)
+        ).all()
+        if not rows:
+            return removed
+        db.session.execute(
+            delete(FilledForm).where(FilledForm.id.in_([row.id for row in rows]))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        removed += len(rows)
+        _remove_files((path for row in rows for path in row[1:]), limiter, result)
+        if len(rows) < chunk_size:
+            return removed
+
+
+def purge_template(template_id: int, chunk_size: int = PURGE_CHUNK_SIZE,
+                   max_per_second: float = 0) -> SweepResult:
+    """Delete a soft-deleted template, its rows and files in chunks.
+
+    Must run inside an app context. Each chunk is committed on its own, so
+    the database lock is only held briefly and an interrupted purge simply
+    continues on the next run.
+
+    Args:
+        template_id: ID of a template marked as deleted
+        chunk_size: Rows removed per statement
+        max_per_second: Most files removed per second (0 for no limit)
+
+    Returns:
+        Counts of the removed files
+    """
+    from app import db
+    from models import PDFTemplate, FormField, FilledForm
+
+    result = SweepResult()
+    limiter = RateLimiter(max_per_second)
+    template = db.session.get(PDFTemplate, template_id)
+    if template is None or template.deleted_at is None:
+        return result
+    template_files = (template.file_path, template.profile_path)
+
+    forms = _purge_forms(FilledForm.template_id == template_id, chunk_size, limiter, result)
+    db.session.execute(delete(FormField).where(FormField.template_id == template_id))
+    db.session.execute(
+        update(PDFTemplate).where(PDFTemplate.supersedes_id == template_id).values(supersedes_id=None)
+    )
+    db.session.execute(delete(PDFTemplate).where(PDFTemplate.id == template_id))
+    db.session.commit()
+    # Other processes drop theirs when the ID is reused, as the file path differs
+    schema.invalidate(template_id)
+    _remove_files(template_files, limiter, result)
+
+    logger.info(f"Purged template {template_id} with {forms} filled forms and {result.removed} files")
+    return result
+
+
+def purge_deleted(chunk_size: int = PURGE_CHUNK_SIZE, max_per_second: float = 0) -> SweepResult:
+    """Purge every row marked as deleted, with its files.
+
+    Picks up templates whose purge job was lost (for example on restart) and
+    individually deleted filled forms.
+
+    Returns:
+        Counts of the removed files
+    """
+    from app import db
+    from models import PDFTemplate, FilledForm
+
+    result = SweepResult()
+    template_ids = db.session.scalars(select(PDFTemplate.id).where(PDFTemplate.deleted_at.isnot(None))).all()
+    for template_id in template_ids:
+        purged = purge_template(template_id, chunk_size, max_per_second)
+        result.removed += purged.removed
+        result.bytes_removed += purged.bytes_removed
+        result.errors += purged.errors
+    _purge_forms(FilledForm.deleted_at.isnot(None), chunk_size, RateLimiter(max_per_second), result)
+    return result
+
+
+def referenced_paths() -> Set[str]:
+    """Return the real paths of all files referenced by database rows.
+
+    Rows marked as deleted still count, so their files are only reclaimed
+    once the rows are purged.
+    """
+    from app import db
+    from models import PDFTemplate, FilledForm
+
+    columns = (
+        (PDFTemplate.file_path, PDFTemplate.profile_path),
+        (FilledForm.pdf_path, FilledForm.png_path, FilledForm.profile_path, FilledForm.archive_path),
+    )
+    paths = set()
+    for table_columns in columns:
+        rows = db.session.execute(
+            select(*table_columns).execution_options(yield_per=REFERENCE_BATCH_SIZE)
+        )
+        for row in rows:
+            paths.update(os.path.realpath(path) for path in row if path)
+    return paths
+
+
+def sweep_orphans(upload_folder: str, grace_seconds: float, max_per_second: float = 0,
+                  dry_run: bool = False, now: Optional[float] = None) -> SweepResult:
+    """Remove files in ``upload_folder`` that no database row references.
+
+    Must run inside an app context.
+
+    Args:
+        upload_folder: Folder holding templates and generated files
+        grace_seconds: Keep files modified more recently than this
+        max_per_second: Most files removed per second (0 for no limit)
+        dry_run: Only count what would be removed
+        now: Reference time for the grace period (defaults to the current time)
+
+    Returns:
+        Counts of scanned, removed and kept files
+    """
+    result = SweepResult()
+    references = referenced_paths()
+    cutoff = (now if now is not None else time.time()) - grace_seconds
+    limiter = RateLimiter(max_per_second)
+
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            result.scanned += 1
+            path = os.path.realpath(entry.path)
+            if path in references:
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > cutoff:
+                result.kept_recent += 1
+                continue
+
+            if dry_run:
+                result.removed += 1
+                result.bytes_removed += stat.st_size
+                continue
+
+            _remove_files((entry.path,), limiter, result)
+
+    logger.info(
+        f"Swept {upload_folder}: {result.scanned} files scanned, {result.removed} orphans "
+        f"{'found' if dry_run else 'removed'} ({result.bytes_removed} bytes), "
+        f"{result.kept_recent} recent files kept"
+    )
+    return result
+
+
+def run(dry_run: bool = False) -> SweepResult:
+    """Purge deleted rows, then sweep the upload and archive folders with the app settings.
+
+    Must run inside an app context. A dry run only reports the orphans.
+    Archive bundles are orphaned once no filled form references them.
+    """
+    from flask import current_app
+
+    config = current_app.config
+    if not dry_run:
+        purge_deleted(max_per_second=config['SWEEP_MAX_FILES_PER_SECOND'])
+    total = SweepResult()
+    for folder in (config['UPLOAD_FOLDER'], config.get('ARCHIVE_FOLDER')):
+        if not folder or not os.path.isdir(folder):
+            continue
+        result = sweep_orphans(
+            folder,
+            grace_seconds=config['SWEEP_GRACE_SECONDS'],
+            max_per_second=config['SWEEP_MAX_FILES_PER_SECOND'],
+            dry_run=dry_run,
+        )
+        total.scanned += result.scanned
+        total.removed += result.removed
+        total.bytes_removed += result.bytes_removed
+        total.kept_recent += result.kept_recent
+        total.errors += result.errors
+    return total
@@ -0,0 +1,85 @@
+"""Shared test configuration and helpers.
+
+The app module configures itself from the environment when it is imported,
+so the environment points it at a scratch database and upload folder before
+any test imports it. Test modules import the helpers below with ``from
+conftest import ...``.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_scratch = tempfile.mkdtemp(prefix='pdf_forms_tests_')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_scratch, 'test.db')}",
+    'UPLOAD_FOLDER': os.path.join(_scratch, 'uploads'),
+    'ARCHIVE_FOLDER': os.path.join(_scratch, 'archive'),
+    'WTF_CSRF_ENABLED': 'false',
+    'WARMUP_TEMPLATES': '0',
+    'LOG_LEVEL': 'WARNING',
+})
+
+# models imports the app, so it is imported here, once the environment is set
+import app as _app_module  # noqa: E402,F401
+
+
+@pytest.fixture
+def app():
+    """The Flask app inside an app context, with every table emptied afterwards."""
+    from app import app as flask_app, db
+
+    with flask_app.app_context():
+        yield flask_app
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def db(app):
+    from app import db as database
+
+    return database
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_file(path, size):
+    """Write ``size`` random bytes to ``path`` and return the path."""
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def create_template(db, file_path, names=(), previous=None, **columns):
+    """Create and commit a template with a text field for each of ``names``.
+
+    Args:
+        db: The database
+        file_path: File of the template; the schema cache is keyed on it, so
+            tests use a new path for each template
+        names: Field names
+        previous: Template this one is a new version of
+        **columns: Other columns of the template, such as ``status``
+    """
+    from models import FormField, PDFTemplate
+
+    columns.setdefault('name', 'Form')
+    template = PDFTemplate(file_path=file_path, original_filename='form.pdf',
+                           supersedes_id=previous.id if previous else None,
+                           version=previous.version + 1 if previous else 1, **columns)
+    db.session.add(template)
+    db.session.flush()
+    db.session.add_all(FormField(template_id=template.id, field_name=name, field_type='text') for name in names)
+    db.session.commit()
+    return template
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import datasources
+from conftest import create_template
+from models import FilledForm
+
+
+@pytest.fixture
+def template_id(db):
+    template = create_template(db, '/tmp/datasources-form.pdf', ['name', 'email', 'phone'])
+    # fill_batch clears the session
+    return template.id
+
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    return str(path)
+
+
+def filled_data(db, template_id):
+    forms = db.session.query(FilledForm).filter_by(template_id=template_id).order_by(FilledForm.id)
+    return [form.get_data() for form in forms]
+
+
+def test_keys_first_seen_in_a_later_chunk_are_mapped(db, template_id, tmp_path, caplog):
+    source = write_jsonl(tmp_path / 'rows.jsonl', [
+        {'name': 'Ada'},
+        {'name': 'Grace'},
+        {'name': 'Alan', 'Email': 'alan@example.com'},
+        {'name': 'Edsger'},
+    ])
+
+    result = datasources.fill_batch(template_id, datasources.read_jsonl(source, chunk_size=2), queue=True)
+
+    assert (result.rows, result.queued) == (4, 4)
+    assert [row['email'] for row in filled_data(db, template_id)] == ['', '', 'alan@example.com', '']
+    assert "fields have no source column and were left empty: phone" in caplog.text
+
+
+def test_fields_keep_their_first_column(db, template_id, tmp_path):
+    source = write_jsonl(tmp_path / 'rows.jsonl', [
+        {'Name': 'Ada'},
+        {'Name': 'Grace', 'name': 'ignored'},
+    ])
+
+    datasources.fill_batch(template_id, datasources.read_jsonl(source, chunk_size=1), queue=True)
+
+    assert [row['name'] for row in filled_data(db, template_id)] == ['Ada', 'Grace']
@@ -0,0 +1,128 @@
+import PyPDF2
+import pytest
+
+import fieldtypes
+import pdf_processor
+
+WIDGET = b'/Subtype /Widget /Rect [0 0 20 20]'
+
+FORM = [
+    b'<< /Type /Catalog /Pages 2 0 R /AcroForm << /Fields [4 0 R 7 0 R 10 0 R 11 0 R 12 0 R 13 0 R 14 0 R] >> >>',
+    b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+    b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>',
+    # Kids inherit /FT from their parent unless they set their own
+    b'<< /T (address) /FT /Ch /Kids [5 0 R 6 0 R] >>',
+    b'<< /T (city) /Parent 4 0 R /Opt [(Paris) [(ROM) (Rome)]] ' + WIDGET + b' >>',
+    b'<< /T (street) /Parent 4 0 R /FT /Tx ' + WIDGET + b' >>',
+    # A radio group whose kids are all widgets
+    b'<< /T (size) /FT /Btn /Ff 32768 /Kids [8 0 R 9 0 R] >>',
+    b'<< /Parent 7 0 R /AP << /N << /S << >> /Off << >> >> /D << /S << >> >> >> ' + WIDGET + b' >>',
+    b'<< /Parent 7 0 R /AP << /N << /M << >> /Off << >> >> >> ' + WIDGET + b' >>',
+    b'<< /T (name) /FT /Tx ' + WIDGET + b' >>',
+    b'<< /T (name) /FT /Tx ' + WIDGET + b' >>',
+    b'<< /T (submit) /FT /Btn /Ff 65536 ' + WIDGET + b' >>',
+    b'<< /T <6E6F746573> /FT /Tx % comment with /T (ignored)\n' + WIDGET + b' >>',
+    # An indirect name is left to PyPDF2
+    b'<< /T 15 0 R /FT /Btn /AP << /N << /On << >> /Off << >> >> >> ' + WIDGET + b' >>',
+    b'(agree)',
+]
+
+ANNOTATIONS = [
+    b'<< /Type /Catalog /Pages 2 0 R >>',
+    b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+    b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Annots [4 0 R 5 0 R 6 0 R] >>',
+    b'<< /T (first) /FT /Tx ' + WIDGET + b' >>',
+    b'<< /Subtype /Link /Rect [0 0 20 20] >>',
+    b'<< /T (second) /FT /Btn /AP << /N << /Yes << >> /Off << >> >> >> ' + WIDGET + b' >>',
+]
+
+
+def write_pdf(path, objects):
+    """Write ``objects``, numbered from 1 with object 1 the catalog, with a classic xref table."""
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f\r\n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n\r\n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def form(tmp_path):
+    return write_pdf(tmp_path / 'form.pdf', FORM)
+
+
+def test_scan_field_object(form):
+    with open(form, 'rb') as f:
+        data = f.read()
+    reader = PyPDF2.PdfReader(form)
+
+    assert pdf_processor._scan_field_object(reader, data, 4) == ('address', [(5, 0), (6, 0)], '/Ch', None)
+    assert pdf_processor._scan_field_object(reader, data, 5) == ('city', None, None, None)
+    assert pdf_processor._scan_field_object(reader, data, 7) == ('size', [(8, 0), (9, 0)], '/Btn', 32768)
+    # Names in nested dictionaries and comments are not the field's
+    assert pdf_processor._scan_field_object(reader, data, 8) == (None, None, None, None)
+    assert pdf_processor._scan_field_object(reader, data, 13) == ('notes', None, '/Tx', None)
+    with pytest.raises(pdf_processor._UnsupportedObject):
+        pdf_processor._scan_field_object(reader, data, 14)
+
+
+def test_iter_form_fields_inherits_type_and_flags(form):
+    fields = [(name, field_type, flags)
+              for name, _, field_type, flags in pdf_processor._iter_form_fields(PyPDF2.PdfReader(form))]
+
+    assert fields == [
+        ('address.city', '/Ch', 0),
+        ('address.street', '/Tx', 0),
+        ('size', '/Btn', 32768),
+        ('name', '/Tx', 0),
+        ('name', '/Tx', 0),
+        ('submit', '/Btn', 65536),
+        ('notes', '/Tx', 0),
+        ('agree', '/Btn', 0),
+    ]
+
+
+def test_extract_field_specs(form):
+    assert pdf_processor.extract_field_specs(form) == [
+        ('address.city', fieldtypes.CHOICE, ['Paris', 'ROM']),
+        ('address.street', fieldtypes.TEXT, []),
+        # Kids without /T are widgets, not fields of their own
+        ('size', fieldtypes.RADIO, ['S', 'M']),
+        # Duplicates are listed once and push buttons not at all
+        ('name', fieldtypes.TEXT, []),
+        ('notes', fieldtypes.TEXT, []),
+        ('agree', fieldtypes.CHECKBOX, ['On']),
+    ]
+
+
+def test_annotations_are_scanned_without_an_acroform(tmp_path):
+    path = write_pdf(tmp_path / 'annotations.pdf', ANNOTATIONS)
+
+    assert pdf_processor.extract_field_specs(path) == [
+        ('first', fieldtypes.TEXT, []),
+        ('second', fieldtypes.CHECKBOX, ['Yes']),
+    ]
+
+
+def test_limit_stops_reading_fields(form, monkeypatch):
+    read = []
+    read_field_node = pdf_processor._read_field_node
+
+    def recording(reader, data, node):
+        read.append(node.idnum)
+        return read_field_node(reader, data, node)
+
+    monkeypatch.setattr(pdf_processor, '_read_field_node', recording)
+
+    assert pdf_processor.extract_form_fields(form, limit=2) == ['address.city', 'address.street']
+    assert read == [4, 5, 6]
+    read.clear()
+    assert pdf_processor.extract_form_fields(form, limit=3) == ['address.city', 'address.street', 'size']
+    assert max(read) == 9
@@ -0,0 +1,71 @@
+import pytest
+
+import fieldtypes
+
+FIELDS = [
+    ('name', fieldtypes.TEXT, True, ()),
+    ('agree', fieldtypes.CHECKBOX, False, ('On',)),
+    ('subscribe', fieldtypes.CHECKBOX, False, ()),
+    ('size', fieldtypes.RADIO, True, ('S', 'M', 'L')),
+    ('color', fieldtypes.CHOICE, True, ('Red', 'Blue')),
+]
+
+
+def test_coerce_columns():
+    columns = {
+        'name': ['  Ada ', None, 42],
+        'agree': ['yes', 'OFF', 'on'],
+        'subscribe': [True, '', 'x'],
+        'size': ['m', '', 'off'],
+        'color': ['red', 'Blue', None],
+    }
+
+    assert fieldtypes.coerce_columns(FIELDS, columns) == {
+        'name': ['Ada', '', '42'],
+        'agree': ['On', 'Off', 'On'],
+        'subscribe': ['Yes', 'Off', 'Yes'],
+        'size': ['M', 'Off', 'Off'],
+        'color': ['Red', 'Blue', ''],
+    }
+
+
+def test_missing_columns_get_empty_values():
+    coerced = fieldtypes.coerce_columns(FIELDS, {'name': ['a', 'b']})
+
+    assert coerced['agree'] == ['Off', 'Off']
+    assert coerced['size'] == ['Off', 'Off']
+    assert coerced['color'] == ['', '']
+    assert fieldtypes.coerce_columns(FIELDS, {}, rows=1)['name'] == ['']
+
+
+def test_invalid_values_are_all_reported():
+    columns = {
+        'agree': ['maybe', 'yes', 'maybe'],
+        'color': ['Green', 'Red', ['Red']],
+    }
+
+    with pytest.raises(fieldtypes.FieldValueError) as excinfo:
+        fieldtypes.coerce_columns(FIELDS, columns)
+
+    assert excinfo.value.errors == [
+        (0, 'agree', 'maybe'),
+        (0, 'color', 'Green'),
+        (2, 'agree', 'maybe'),
+        (2, 'color', ['Red']),
+    ]
+    assert str(excinfo.value) == "Invalid value 'maybe' for field 'agree' in row 1 and 3 more"
+
+
+def test_choice_options_match_regardless_of_case_unless_ambiguous():
+    field = ('code', fieldtypes.CHOICE, True, ('ab', 'AB', 'Cd'))
+
+    assert fieldtypes.coerce_column(field, ['cd', 'AB', 'Ab']) == (['Cd', 'AB', None], [2])
+
+
+def test_coerce_records():
+    records = [{'name': 'Ada', 'agree': 'x'}, {'size': 'L', 'extra': 'ignored'}]
+
+    assert fieldtypes.coerce_records(FIELDS, records) == [
+        {'name': 'Ada', 'agree': 'On', 'subscribe': 'Off', 'size': 'Off', 'color': ''},
+        {'name': '', 'agree': 'Off', 'subscribe': 'Off', 'size': 'L', 'color': ''},
+    ]
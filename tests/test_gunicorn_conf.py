@@ -0,0 +1,54 @@
+import os
+import runpy
+
+import pytest
+
+import app as app_module
+import retention
+import sweeper
+import warmup
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+@pytest.fixture
+def load_conf(monkeypatch):
+    """Load gunicorn.conf.py with WARMUP_SHARED set as given, recording the threads started."""
+    started = []
+    monkeypatch.setattr(app_module, 'start_background', lambda app: started.append('background'))
+    monkeypatch.setattr(warmup, 'start', lambda app: started.append('warmup'))
+    for name in ('WARMUP_DEFERRED', 'BACKGROUND_DEFERRED'):
+        monkeypatch.delenv(name, raising=False)
+
+    def load(shared):
+        monkeypatch.setenv('WARMUP_SHARED', '1' if shared else '')
+        return runpy.run_path(CONF_PATH), started
+    return load
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_background_threads_start_in_workers_only(load_conf, shared):
+    conf, started = load_conf(shared)
+
+    assert os.environ['BACKGROUND_DEFERRED'] == '1'
+    assert conf.get('preload_app', False) is shared
+    conf['post_fork'](None, None)
+    assert started == (['background'] if shared else ['background', 'warmup'])
+
+
+def test_schedules_disabled_by_default(app):
+    assert sweeper.start(app) is None
+    assert retention.start(app) is None
+
+
+def test_schedules_start_when_configured(app, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(sweeper.jobs, 'schedule',
+                        lambda app, queue, interval, func: scheduled.append((queue, interval)))
+    monkeypatch.setitem(app.config, 'SWEEP_INTERVAL_MINUTES', 5)
+    monkeypatch.setitem(app.config, 'RETENTION_INTERVAL_MINUTES', 60)
+
+    sweeper.start(app)
+    retention.start(app)
+
+    assert scheduled == [('sweep', 300), ('retention', 3600)]
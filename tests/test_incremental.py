@@ -0,0 +1,100 @@
+import pytest
+
+import pdf_processor
+from conftest import read_file
+
+VALUES = {'name': 'Ada Lovelace', 'agree': 'yes', 'size': 'M', 'color': 'Blue'}
+
+
+@pytest.fixture
+def template(tmp_path):
+    """A template with a text field, a checkbox, a radio group and a choice, and a classic xref table."""
+    from reportlab.pdfgen import canvas
+
+    path = str(tmp_path / 'template.pdf')
+    c = canvas.Canvas(path)
+    c.drawString(50, 750, 'Incremental')
+    c.acroForm.textfield(name='name', x=50, y=700, width=200, height=20)
+    c.acroForm.checkbox(name='agree', x=50, y=650, size=20)
+    for index, size in enumerate(('S', 'M', 'L')):
+        c.acroForm.radio(name='size', value=size, selected=size == 'S', x=50 + index * 30, y=600, size=20)
+    c.acroForm.choice(name='color', value='Red', options=['Red', 'Blue'], x=50, y=550, width=100, height=20)
+    c.save()
+    return path
+
+
+@pytest.fixture
+def stream_template(template, tmp_path):
+    """The same template saved with object streams and a cross-reference stream."""
+    pikepdf = pytest.importorskip('pikepdf')
+    path = str(tmp_path / 'stream.pdf')
+    with pikepdf.open(template) as pdf:
+        pdf.save(path, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return path
+
+
+def field_states(pdf_path):
+    """Return the /V of every field and the /AS of every widget of a PDF, read with PyPDF2."""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(pdf_path)
+    values, states = {}, {}
+    for ref in reader.trailer['/Root']['/AcroForm']['/Fields']:
+        field = ref.get_object()
+        name = str(field['/T'])
+        values[name] = field.get('/V')
+        widgets = [kid.get_object() for kid in field['/Kids']] if '/Kids' in field else [field]
+        states[name] = [widget.get('/AS') for widget in widgets]
+    return values, states
+
+
+def assert_filled(pdf_path, values):
+    fields, states = field_states(pdf_path)
+    assert fields['name'] == values['name']
+    assert fields['color'] == values['color']
+    assert fields['agree'] == '/Yes'
+    assert states['agree'] == ['/Yes']
+    assert fields['size'] == f"/{values['size']}"
+    assert states['size'] == [f"/{size}" if size == values['size'] else '/Off' for size in ('S', 'M', 'L')]
+
+
+@pytest.mark.parametrize('source', ['template', 'stream_template'])
+def test_fill_appends_an_update(request, tmp_path, source):
+    template = request.getfixturevalue(source)
+    output = str(tmp_path / 'filled.pdf')
+
+    filled = pdf_processor._fill_pdf_form_incremental(template, VALUES, output)
+
+    assert filled == 6
+    original, updated = read_file(template), read_file(output)
+    assert updated.startswith(original)
+    update = updated[len(original):]
+    if source == 'template':
+        assert b'\nxref\n' in update and b'/Type /XRef' not in update
+    else:
+        assert b'/Type /XRef' in update and b'\nxref\n' not in update
+    assert_filled(output, VALUES)
+    # Fields left out keep their values
+    assert pdf_processor._fill_pdf_form_incremental(template, {'name': 'Grace'}, output) == 1
+    fields, states = field_states(output)
+    assert fields['name'] == 'Grace'
+    assert states['size'] == ['/S', '/Off', '/Off']
+
+
+@pytest.mark.parametrize('source', ['template', 'stream_template'])
+def test_update_stacks_on_an_earlier_update(request, tmp_path, source):
+    template = request.getfixturevalue(source)
+    first, second = str(tmp_path / 'first.pdf'), str(tmp_path / 'second.pdf')
+    pdf_processor._fill_pdf_form_incremental(template, VALUES, first)
+
+    values = {'name': 'Grace Hopper', 'agree': 'no', 'size': 'L', 'color': 'Red'}
+    pdf_processor._fill_pdf_form_incremental(first, values, second)
+
+    assert read_file(second).startswith(read_file(first))
+    assert read_file(second).count(b'%%EOF') == read_file(template).count(b'%%EOF') + 2
+    fields, states = field_states(second)
+    assert (fields['name'], fields['color'], fields['size']) == ('Grace Hopper', 'Red', '/L')
+    assert (fields['agree'], states['agree']) == ('/Off', ['/Off'])
+    assert states['size'] == ['/Off', '/Off', '/L']
+    # The earlier revision is still intact
+    assert_filled(first, VALUES)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from conftest import create_template
+from models import PDFTemplate
+
+
+@pytest.fixture
+def template(db):
+    return create_template(db, '/tmp/form-test.pdf', status=PDFTemplate.STATUS_PROCESSING,
+                           processing_started_at=datetime.utcnow())
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    calls = []
+    monkeypatch.setattr(jobs, 'submit_extraction', lambda app, template_id, profile=False: calls.append(template_id))
+    return calls
+
+
+def test_queued_template_is_not_stale(app, template):
+    assert not jobs.is_stale(template)
+
+
+def test_template_without_start_time_is_not_stale(app, template):
+    template.processing_started_at = None
+    assert not jobs.is_stale(template)
+
+
+def test_template_past_the_timeout_is_stale(app, template):
+    minutes = app.config['EXTRACTION_STALE_MINUTES']
+    template.processing_started_at = datetime.utcnow() - timedelta(minutes=minutes + 1)
+    assert jobs.is_stale(template)
+    template.status = PDFTemplate.STATUS_READY
+    assert not jobs.is_stale(template)
+
+
+def test_retry_of_a_queued_template_is_refused(app, db, template, submitted):
+    response = app.test_client().post(f'/template/{template.id}/retry')
+    assert response.status_code == 302
+    assert submitted == []
+
+
+def test_retry_queues_once_and_restarts_the_timeout(app, db, template, submitted):
+    template.status = PDFTemplate.STATUS_FAILED
+    template.processing_started_at = None
+    db.session.commit()
+    client = app.test_client()
+
+    client.post(f'/template/{template.id}/retry')
+    client.post(f'/template/{template.id}/retry')
+
+    assert submitted == [template.id]
+    db.session.refresh(template)
+    assert template.status == PDFTemplate.STATUS_PROCESSING
+    assert template.processing_started_at is not None
+    assert not jobs.is_stale(template)
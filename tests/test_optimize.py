@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import optimize
+
+
+@pytest.fixture
+def duplicated_pdf(tmp_path):
+    """A PDF whose three pages draw the same image, stored three times."""
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    path = str(tmp_path / 'duplicated.pdf')
+    image = Image.frombytes('RGB', (64, 64), os.urandom(64 * 64 * 3))
+    c = canvas.Canvas(path)
+    for _ in range(3):
+        # A new reader per page stops reportlab from sharing the image itself
+        c.drawImage(ImageReader(image.copy()), 0, 0, width=200, height=200)
+        c.showPage()
+    c.save()
+    return path
+
+
+def test_unknown_level_is_rejected(duplicated_pdf):
+    with pytest.raises(optimize.OptimizationError):
+        optimize.optimize_pdf(duplicated_pdf, 'smallest')
+
+
+def test_none_leaves_the_file_alone(duplicated_pdf):
+    before = open(duplicated_pdf, 'rb').read()
+    result = optimize.optimize_pdf(duplicated_pdf, 'none')
+    assert result.bytes_saved == 0
+    assert open(duplicated_pdf, 'rb').read() == before
+
+
+def test_fast_does_not_rewrite_with_pdfrw(duplicated_pdf, monkeypatch):
+    monkeypatch.setattr(optimize, 'engine', lambda: 'pdfrw')
+    before = open(duplicated_pdf, 'rb').read()
+    result = optimize.optimize_pdf(duplicated_pdf, 'fast')
+    assert result.engine == 'none'
+    assert open(duplicated_pdf, 'rb').read() == before
+
+
+@pytest.mark.parametrize('name', ['pdfrw', 'pikepdf'])
+def test_size_stores_duplicate_images_once(duplicated_pdf, monkeypatch, name):
+    if name == 'pikepdf':
+        pytest.importorskip('pikepdf')
+    monkeypatch.setattr(optimize, 'engine', lambda: name)
+    result = optimize.optimize_pdf(duplicated_pdf, 'size')
+    assert result.engine == name
+    assert result.duplicates >= 2
+    assert result.bytes_after < result.bytes_before
+    assert os.path.getsize(duplicated_pdf) == result.bytes_after
+
+    from pdfrw import PdfReader
+    images = {id(page.Resources.XObject[key]) for page in PdfReader(duplicated_pdf).pages
+              for key in page.Resources.XObject}
+    assert len(images) == 1
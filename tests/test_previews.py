@@ -0,0 +1,89 @@
+import shutil
+
+import pytest
+
+import pdf_processor
+
+
+@pytest.fixture
+def template(tmp_path):
+    """A template saved with a default text, a checked box and a selected choice."""
+    from reportlab.pdfgen import canvas
+
+    path = str(tmp_path / 'defaults.pdf')
+    c = canvas.Canvas(path)
+    c.drawString(50, 750, 'Defaults')
+    c.acroForm.textfield(name='name', value='Default name', x=50, y=700, width=200, height=20)
+    c.acroForm.checkbox(name='agree', checked=True, x=50, y=650, size=20)
+    c.acroForm.choice(name='color', value='Red', options=['Red', 'Blue'], x=50, y=600, width=100, height=20)
+    c.save()
+    return path
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    pdf_processor.clear_preview_cache()
+    yield
+    pdf_processor.clear_preview_cache()
+
+
+def widget_states(pdf_path):
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(pdf_path)
+    states = {}
+    for ref in reader.pages[0]['/Annots']:
+        annotation = ref.get_object()
+        appearance = annotation.get('/AP')
+        states[annotation['/T']] = (annotation.get('/V'), annotation.get('/AS'),
+                                    bool(appearance and appearance.get('/N')))
+    return states
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_blank_template_clears_defaults(template, tmp_path, monkeypatch, incremental):
+    if not incremental:
+        def unsupported(*args):
+            raise pdf_processor._UnsupportedObject("Field or widget is a direct object")
+        monkeypatch.setattr(pdf_processor, '_fill_pdf_form_incremental', unsupported)
+    output = str(tmp_path / 'blank.pdf')
+
+    pdf_processor._write_blank_template(template, ['agree', 'color', 'name'], output)
+
+    states = widget_states(output)
+    assert states['name'] == ('', None, False)
+    assert states['color'] == ('', None, False)
+    # Buttons keep their appearances, switched off
+    assert states['agree'] == ('/Off', '/Off', True)
+    assert widget_states(template)['agree'] == ('/Yes', '/Yes', True)
+
+
+def test_background_is_rendered_from_blank_copy(template, monkeypatch):
+    from PIL import Image
+
+    rendered = []
+
+    def render_page(pdf_path, page, dpi):
+        rendered.append(widget_states(pdf_path))
+        return Image.new('RGB', (10, 10), 'white')
+    monkeypatch.setattr(pdf_processor, '_render_page', render_page)
+
+    background = pdf_processor._preview_background(template, 0, 72)
+
+    assert {widget.qualified for widget in background.widgets} == {'name', 'agree', 'color'}
+    assert rendered == [{'name': ('', None, False), 'agree': ('/Off', '/Off', True), 'color': ('', None, False)}]
+
+
+@pytest.mark.skipif(shutil.which('pdftoppm') is None, reason='requires poppler')
+def test_background_hides_template_defaults(template):
+    def dark_pixels(image, box):
+        # Inside the widget's border
+        region = image.convert('L').crop((box[0] + 3, box[1] + 3, box[2] - 3, box[3] - 3))
+        return sum(region.point(lambda level: 255 if level < 128 else 0).histogram()[255:])
+
+    original = pdf_processor._render_page(template, 0, 72)
+    background = pdf_processor._preview_background(template, 0, 72)
+
+    for widget in background.widgets:
+        assert dark_pixels(original, widget.box) > 0, widget.qualified
+        assert dark_pixels(background.image, widget.box) == 0, widget.qualified
@@ -0,0 +1,71 @@
+import threading
+import time
+import tracemalloc
+
+import profiling
+
+
+def _profile(label, seconds, results, errors):
+    try:
+        with profiling.session(label) as session:
+            with profiling.stage('fill'):
+                data = [bytearray(1024) for _ in range(512)]
+                time.sleep(seconds)
+                del data
+        results.append(session)
+    except Exception as e:  # pragma: no cover - reported by the assertion
+        errors.append(e)
+
+
+def test_concurrent_captures_are_serialized():
+    results, errors = [], []
+    threads = [threading.Thread(target=_profile, args=(f"run {i}", 0.1 if i % 2 else 0.02, results, errors))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(results) == 4
+    for session in results:
+        assert [stage.name for stage in session.stages] == ['fill']
+        assert session.stages[0].peak_bytes >= 512 * 1024
+    assert not tracemalloc.is_tracing()
+
+
+def test_nested_stages_are_part_of_the_enclosing_stage():
+    with profiling.session('nested') as session:
+        with profiling.stage('fill'):
+            with profiling.stage('fallback'):
+                pass
+    assert [stage.name for stage in session.stages] == ['fill']
+
+
+def test_session_in_the_same_thread_does_not_capture_twice():
+    with profiling.session('outer') as outer:
+        with profiling.stage('fill'):
+            with profiling.session('inner') as inner:
+                with profiling.stage('render'):
+                    pass
+    assert [stage.name for stage in outer.stages] == ['fill']
+    assert inner.stages == []
+
+
+def test_requests_need_the_profile_token(app):
+    from app import profiling_requested
+
+    app.config['PROFILE_TOKEN'] = ''
+    with app.test_request_context('/?profile=1', headers={'X-Profile': '1'}):
+        assert not profiling_requested()
+
+    app.config['PROFILE_TOKEN'] = 's3cret'
+    try:
+        with app.test_request_context('/?profile=1'):
+            assert not profiling_requested()
+        with app.test_request_context('/', headers={'X-Profile': 's3cret'}):
+            assert profiling_requested()
+        with app.test_request_context('/?profile=s3cret'):
+            assert profiling_requested()
+    finally:
+        app.config['PROFILE_TOKEN'] = ''
@@ -0,0 +1,150 @@
+import os
+import threading
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from flask import current_app
+
+import retention
+import storage
+from conftest import create_template, read_file
+from models import FilledForm
+
+
+@pytest.fixture
+def archived(app, tmp_path):
+    """A form whose PDF is only left in its archive."""
+    content = os.urandom(4 * 1024 * 1024)
+    pdf_path = str(tmp_path / 'filled_1_form.pdf')
+    archive_path = str(tmp_path / 'archive.zip')
+    with zipfile.ZipFile(archive_path, 'w') as bundle:
+        bundle.writestr('filled_1_form.pdf', content)
+    return SimpleNamespace(pdf_path=pdf_path, archive_path=archive_path), content
+
+
+def test_restore_pdf(archived, tmp_path):
+    form, content = archived
+
+    assert retention.restore_pdf(form)
+
+    assert read_file(form.pdf_path) == content
+    assert sorted(os.listdir(tmp_path)) == ['archive.zip', 'filled_1_form.pdf']
+
+
+def test_concurrent_restores(app, archived, tmp_path):
+    form, content = archived
+    results, errors = [], []
+
+    def restore():
+        with app.app_context():
+            try:
+                results.append(retention.restore_pdf(form))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=restore) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert results == [True] * 8
+    assert read_file(form.pdf_path) == content
+    assert sorted(os.listdir(tmp_path)) == ['archive.zip', 'filled_1_form.pdf']
+
+
+def test_failed_restore_leaves_no_temporary_file(archived, tmp_path):
+    form, _ = archived
+    form.pdf_path = str(tmp_path / 'not_archived.pdf')
+
+    with pytest.raises(KeyError):
+        retention.restore_pdf(form)
+
+    assert os.listdir(tmp_path) == ['archive.zip']
+
+
+@pytest.fixture
+def backend(app, tmp_path, monkeypatch):
+    """A LocalStorage backend standing in for storage shared with other nodes."""
+    shared = storage.LocalStorage(str(tmp_path / 'shared'))
+    monkeypatch.setitem(app.extensions, 'storage', shared)
+    return shared
+
+
+def create_form(db, template, name, content=b'%PDF-1.4 filled'):
+    """Create a filled form of ``template`` with its PDF in the upload folder."""
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    form = FilledForm(template_id=template.id, pdf_path=path)
+    db.session.add(form)
+    db.session.commit()
+    return form
+
+
+@pytest.fixture
+def cold_template(db):
+    """A template whose retention policy archives every form."""
+    return create_template(db, '/tmp/retention-form.pdf', retention_max_forms=0)
+
+
+def archive_parts():
+    return [name for name in os.listdir(current_app.config['ARCHIVE_FOLDER']) if name.endswith('.part')]
+
+
+def test_compaction_fetches_pdfs_only_in_the_backend(db, backend, cold_template):
+    form = create_form(db, cold_template, 'filled_remote.pdf', b'%PDF-1.4 other node')
+    storage.publish(form.pdf_path)
+    # Filled on another node: the PDF is only in the shared storage
+    os.remove(form.pdf_path)
+
+    result = retention.compact_all()
+
+    assert (result.pdfs_archived, result.errors) == (1, 0)
+    db.session.refresh(form)
+    with zipfile.ZipFile(form.archive_path) as bundle:
+        assert bundle.read('filled_remote.pdf') == b'%PDF-1.4 other node'
+    assert not os.path.exists(form.pdf_path)
+    assert not backend.exists(storage.key_for(form.pdf_path))
+
+
+def test_compaction_skips_pdfs_it_cannot_fetch(db, backend, cold_template, monkeypatch):
+    kept = create_form(db, cold_template, 'filled_kept.pdf')
+    lost = create_form(db, cold_template, 'filled_lost.pdf')
+    os.remove(lost.pdf_path)
+    # Listed by the backend, but gone when fetched
+    monkeypatch.setattr(retention, '_stored', lambda path: True)
+
+    result = retention.compact_template(cold_template.id)
+
+    assert (result.pdfs_archived, result.errors) == (1, 1)
+    db.session.refresh(kept)
+    db.session.refresh(lost)
+    assert kept.archive_path is not None and lost.archive_path is None
+    assert archive_parts() == []
+
+
+def test_failed_bundle_leaves_no_partial_file(app):
+    with pytest.raises(FileNotFoundError):
+        retention._write_bundle(current_app.config['ARCHIVE_FOLDER'], 1, ['/nonexistent/filled.pdf'])
+
+    assert archive_parts() == []
+
+
+def test_failed_template_does_not_stop_compaction(db, cold_template, monkeypatch):
+    other = create_template(db, '/tmp/retention-other.pdf', name='Other', retention_max_forms=0)
+    create_form(db, cold_template, 'filled_first.pdf')
+    create_form(db, other, 'filled_second.pdf')
+    write_bundle = retention._write_bundle
+
+    def fail_first(archive_folder, template_id, paths):
+        if template_id == cold_template.id:
+            raise OSError("disk full")
+        return write_bundle(archive_folder, template_id, paths)
+    monkeypatch.setattr(retention, '_write_bundle', fail_first)
+
+    result = retention.compact_all()
+
+    assert (result.pdfs_archived, result.errors) == (1, 1)
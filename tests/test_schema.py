@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import pytest
+
+import schema
+import sweeper
+from conftest import create_template
+from models import FormField, PDFTemplate
+
+
+@pytest.fixture(autouse=True)
+def cache(app):
+    cache = schema.SchemaCache()
+    app.extensions['schema_cache'], previous = cache, app.extensions['schema_cache']
+    yield cache
+    app.extensions['schema_cache'] = previous
+
+
+def test_schema_is_cached_per_version(db):
+    template = create_template(db, '/tmp/schema-a.pdf', ['first', 'second'])
+    compiled = schema.for_template(template)
+
+    assert compiled.names == ('first', 'second')
+    assert schema.for_template(template) is compiled
+    template.schema_version = 1
+    assert schema.for_template(template) is not compiled
+
+
+def test_reused_id_does_not_hit_the_previous_template(db):
+    first = create_template(db, '/tmp/schema-a.pdf', ['first'])
+    template_id = first.id
+    assert schema.for_template(first).names == ('first',)
+    # Purged elsewhere: SQLite hands the ID of the highest row out again
+    db.session.query(FormField).delete()
+    db.session.delete(first)
+    db.session.commit()
+
+    second = create_template(db, '/tmp/schema-b.pdf', ['second'], id=template_id)
+
+    assert schema.for_template(second).names == ('second',)
+
+
+def test_purge_invalidates_the_schema(db, cache):
+    template = create_template(db, '/tmp/schema-a.pdf', ['first'])
+    template_id = template.id
+    schema.for_template(template)
+    template.deleted_at = datetime.utcnow()
+    db.session.commit()
+
+    sweeper.purge_template(template_id)
+
+    assert db.session.get(PDFTemplate, template_id) is None
+    assert not [key for key in cache._entries if key[0] == template_id]
@@ -0,0 +1,109 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import storage
+from conftest import read_file, write_file
+
+BUCKET = 'pdf-forms-test'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """An S3Storage on a bucket of moto's in-memory S3, with small multipart parts."""
+    moto = pytest.importorskip('moto')
+    for name, value in (('AWS_ACCESS_KEY_ID', 'testing'), ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                        ('AWS_SESSION_TOKEN', 'testing'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+        monkeypatch.setenv(name, value)
+    # S3 takes parts of at least 5 MB
+    monkeypatch.setattr(storage, 'MULTIPART_THRESHOLD', 5 * 1024 * 1024)
+    monkeypatch.setattr(storage, 'MULTIPART_CHUNK_SIZE', 5 * 1024 * 1024)
+    with moto.mock_aws():
+        backend = storage.S3Storage(BUCKET, prefix='/forms/', region='us-east-1')
+        backend.client.create_bucket(Bucket=BUCKET)
+        yield backend
+
+
+def test_s3_put_get_stream(s3, tmp_path):
+    source = write_file(str(tmp_path / 'template.pdf'), 1000)
+
+    s3.put('templates/template.pdf', source)
+
+    assert s3.exists('templates/template.pdf')
+    head = s3.client.head_object(Bucket=BUCKET, Key='forms/templates/template.pdf')
+    assert head['ContentLength'] == 1000
+    assert b''.join(s3.stream('templates/template.pdf', chunk_size=300)) == read_file(source)
+    target = str(tmp_path / 'fetched.pdf')
+    s3.get('templates/template.pdf', target)
+    assert read_file(target) == read_file(source)
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.part')] == []
+
+
+def test_s3_missing_key(s3, tmp_path):
+    assert not s3.exists('missing.pdf')
+    with pytest.raises(FileNotFoundError):
+        list(s3.stream('missing.pdf'))
+    with pytest.raises(FileNotFoundError):
+        s3.get('missing.pdf', str(tmp_path / 'missing.pdf'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_s3_delete(s3, tmp_path):
+    s3.put('output.pdf', write_file(str(tmp_path / 'output.pdf'), 10))
+
+    s3.delete('output.pdf')
+
+    assert not s3.exists('output.pdf')
+    # Deleting a missing key is not an error
+    s3.delete('output.pdf')
+
+
+def test_s3_multipart_transfer(s3, tmp_path):
+    size = 11 * 1024 * 1024
+    source = write_file(str(tmp_path / 'scan.pdf'), size)
+
+    s3.put('scan.pdf', source)
+
+    head = s3.client.head_object(Bucket=BUCKET, Key='forms/scan.pdf')
+    assert head['ContentLength'] == size
+    # Multipart uploads have an ETag of the form "<digest>-<parts>"
+    assert head['ETag'].strip('"').endswith('-3')
+    target = str(tmp_path / 'fetched.pdf')
+    s3.get('scan.pdf', target)
+    assert read_file(target) == read_file(source)
+
+
+def test_working_copy_keys(tmp_path):
+    upload, archive = str(tmp_path / 'uploads'), str(tmp_path / 'uploads_archive')
+    files = storage.WorkingCopy(None, upload, archive)
+
+    assert files.key_for(os.path.join(upload, 'a.pdf')) == 'a.pdf'
+    assert files.key_for(os.path.join(upload, 'sub', 'b.png')) == 'sub/b.png'
+    assert files.key_for(os.path.join(archive, '2024', 'c.zip')) == 'archive/2024/c.zip'
+    assert files.key_for(str(tmp_path / 'elsewhere' / 'd.pdf')) == 'd.pdf'
+
+
+def test_working_copy_publish_and_fetch(tmp_path):
+    upload = str(tmp_path / 'uploads')
+    os.makedirs(upload)
+    files = storage.WorkingCopy(storage.LocalStorage(str(tmp_path / 'shared')), upload)
+    path = write_file(os.path.join(upload, 'template.pdf'), 100)
+    content = read_file(path)
+
+    files.publish(path)
+    os.remove(path)
+
+    assert files.fetch(path)
+    assert read_file(path) == content
+    files.remove(path)
+    os.remove(path)
+    assert not files.fetch(path)
+
+
+def test_cli_does_not_import_flask():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = "import sys, pdf_form_filler; print('flask' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == 'False'
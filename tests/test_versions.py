@@ -0,0 +1,92 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+import versions
+from conftest import create_template
+from models import FormField
+
+V1_SPECS = [
+    ('name', 'text', []),
+    ('email', 'text', []),
+    ('agree', 'checkbox', ['Yes']),
+    ('color', 'choice', ['Red', 'Blue']),
+    ('notes', 'text', []),
+]
+
+
+def stored_fields(db, template):
+    rows = db.session.execute(
+        select(FormField.field_name, FormField.field_type, FormField.options)
+        .where(FormField.template_id == template.id)
+        .order_by(FormField.id)
+    ).all()
+    return [(name, field_type, json.loads(options) if options else []) for name, field_type, options in rows]
+
+
+@pytest.fixture
+def first(db):
+    template = create_template(db, '/tmp/versions-v1.pdf')
+    versions.store_fields(template, V1_SPECS)
+    db.session.commit()
+    return template
+
+
+def test_first_version_inserts_all_fields(db, first):
+    assert stored_fields(db, first) == V1_SPECS
+    assert first.field_changes is None
+
+
+def test_unchanged_version_copies_fields_in_order(db, first):
+    second = create_template(db, '/tmp/versions-v2.pdf', previous=first)
+
+    changes = versions.store_fields(second, V1_SPECS)
+    db.session.commit()
+
+    assert changes == {'added': [], 'removed': [], 'changed': []}
+    assert stored_fields(db, second) == V1_SPECS
+    # The previous version keeps its fields
+    assert stored_fields(db, first) == V1_SPECS
+
+
+def test_added_removed_and_changed_fields(db, first):
+    second = create_template(db, '/tmp/versions-v2.pdf', previous=first)
+    specs = [
+        ('phone', 'text', []),
+        ('name', 'text', []),
+        ('agree', 'checkbox', ['On']),
+        ('color', 'choice', ['Red', 'Blue']),
+        ('size', 'radio', ['S', 'M', 'L']),
+        ('notes', 'choice', ['Short', 'Long']),
+    ]
+
+    changes = versions.store_fields(second, specs)
+    db.session.commit()
+
+    assert changes == {'added': ['phone', 'size'], 'removed': ['email'], 'changed': ['agree', 'notes']}
+    assert json.loads(second.field_changes) == changes
+    # Copied and inserted runs end up in document order
+    assert stored_fields(db, second) == specs
+
+
+def test_reordered_fields_keep_the_new_order(db, first):
+    second = create_template(db, '/tmp/versions-v2.pdf', previous=first)
+    specs = list(reversed(V1_SPECS))
+
+    changes = versions.store_fields(second, specs)
+    db.session.commit()
+
+    assert changes == {'added': [], 'removed': [], 'changed': []}
+    assert stored_fields(db, second) == specs
+
+
+def test_extracting_again_replaces_the_fields(db, first):
+    second = create_template(db, '/tmp/versions-v2.pdf', previous=first)
+    versions.store_fields(second, V1_SPECS)
+    db.session.commit()
+
+    versions.store_fields(second, V1_SPECS[:2])
+    db.session.commit()
+
+    assert stored_fields(db, second) == V1_SPECS[:2]
@@ -0,0 +1,153 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import workqueue
+from models import Job
+
+QUEUE = 'test'
+
+
+@pytest.fixture
+def failures(monkeypatch):
+    """Register a handler for the test queue, recording the failure hook calls."""
+    calls = []
+    monkeypatch.setitem(workqueue.HANDLERS, QUEUE, (lambda payload: None,
+                                                    lambda payload, error: calls.append((payload, error))))
+    return calls
+
+
+def enqueue(db, count=1, max_attempts=None):
+    jobs = [workqueue.enqueue(QUEUE, {'index': index}, max_attempts=max_attempts) for index in range(count)]
+    db.session.commit()
+    return [job.id for job in jobs]
+
+
+def expire(db, job_id):
+    db.session.query(Job).filter_by(id=job_id).update({'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def make_due(db, job_id):
+    db.session.query(Job).filter_by(id=job_id).update({'run_after': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def reload(db, job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_job_is_claimed_once(db):
+    [job_id] = enqueue(db)
+
+    [job] = workqueue.claim('worker-a', [QUEUE])
+
+    assert job.id == job_id
+    assert (job.status, job.lease_owner, job.attempts) == (Job.STATUS_RUNNING, 'worker-a', 1)
+    assert workqueue.claim('worker-b', [QUEUE]) == []
+
+
+def test_concurrent_claims_do_not_overlap(app, db):
+    job_ids = enqueue(db, count=40)
+    claimed = {}
+    lock = threading.Lock()
+
+    def work(owner):
+        with app.app_context():
+            while True:
+                jobs = workqueue.claim(owner, [QUEUE], limit=3)
+                if not jobs:
+                    break
+                with lock:
+                    for job in jobs:
+                        claimed.setdefault(job.id, []).append(owner)
+            db.session.remove()
+
+    threads = [threading.Thread(target=work, args=(f"worker-{index}",)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+    assert all(len(owners) == 1 for owners in claimed.values())
+
+
+def test_heartbeat_only_extends_own_leases(db):
+    [job_id] = enqueue(db)
+    workqueue.claim('worker-a', [QUEUE], lease_seconds=10)
+    expires = reload(db, job_id).lease_expires_at
+
+    assert workqueue.heartbeat('worker-b', [job_id], lease_seconds=600) == 0
+    assert reload(db, job_id).lease_expires_at == expires
+    assert workqueue.heartbeat('worker-a', [job_id], lease_seconds=600) == 1
+    assert reload(db, job_id).lease_expires_at > expires + timedelta(seconds=500)
+
+
+def test_live_lease_is_not_requeued(db):
+    enqueue(db)
+    workqueue.claim('worker-a', [QUEUE])
+
+    assert workqueue.requeue_expired() == 0
+
+
+def test_expired_lease_is_requeued_and_lost(db):
+    [job_id] = enqueue(db)
+    workqueue.claim('worker-a', [QUEUE])
+    expire(db, job_id)
+
+    assert workqueue.requeue_expired() == 1
+
+    job = reload(db, job_id)
+    assert (job.status, job.lease_owner, job.attempts) == (Job.STATUS_QUEUED, None, 1)
+    assert job.run_after > datetime.utcnow()
+    assert 'worker-a' in job.error_message
+    # The worker that lost the lease can no longer renew or complete the job
+    assert workqueue.heartbeat('worker-a', [job_id]) == 0
+    assert not workqueue.complete(job_id, 'worker-a')
+    # Nor is it claimed again before its backoff
+    assert workqueue.claim('worker-b', [QUEUE]) == []
+    make_due(db, job_id)
+    [job] = workqueue.claim('worker-b', [QUEUE])
+    assert (job.lease_owner, job.attempts) == ('worker-b', 2)
+    assert workqueue.complete(job_id, 'worker-b')
+
+
+def test_job_fails_after_max_attempts(db, failures):
+    [job_id] = enqueue(db, max_attempts=2)
+
+    for attempt in range(2):
+        make_due(db, job_id)
+        assert len(workqueue.claim('worker-a', [QUEUE])) == 1
+        expire(db, job_id)
+        assert workqueue.requeue_expired() == 1
+        assert failures == ([] if attempt == 0 else [({'index': 0}, "Lease of worker-a expired")])
+
+    job = reload(db, job_id)
+    assert (job.status, job.attempts) == (Job.STATUS_FAILED, 2)
+    assert job.finished_at is not None
+    make_due(db, job_id)
+    assert workqueue.claim('worker-b', [QUEUE]) == []
+
+
+def test_handler_changes_are_dropped_when_the_lease_is_lost(app, db, monkeypatch):
+    monkeypatch.setitem(workqueue.HANDLERS, QUEUE, (lambda payload: workqueue.enqueue('followup', payload), None))
+    [job_id] = enqueue(db)
+    workqueue.claim('worker-a', [QUEUE])
+    expire(db, job_id)
+    workqueue.requeue_expired()
+    make_due(db, job_id)
+    workqueue.claim('worker-b', [QUEUE])
+
+    workqueue.Worker(app, [QUEUE], owner='worker-a')._execute(job_id, QUEUE, {'index': 0})
+
+    assert db.session.query(Job).filter_by(queue='followup').count() == 0
+    job = reload(db, job_id)
+    assert (job.status, job.lease_owner) == (Job.STATUS_RUNNING, 'worker-b')
+
+    workqueue.Worker(app, [QUEUE], owner='worker-b')._execute(job_id, QUEUE, {'index': 0})
+
+    assert db.session.query(Job).filter_by(queue='followup').count() == 1
+    assert reload(db, job_id).status == Job.STATUS_DONE
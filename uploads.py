@@ -0,0 +1,152 @@
+"""Streaming handling of uploaded PDF files.
+
+Uploaded files are written straight into the upload folder while the request
+body is parsed. The SHA-256 digest is computed and the ``%PDF`` header and
+``%%EOF`` trailer are captured in the same pass, so an upload is never held
+in memory, never copied a second time and can be rejected before any PDF
+parsing happens.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from typing import IO, Optional
+
+from flask import Request, current_app
+from werkzeug.datastructures import FileStorage
+
+logger = logging.getLogger(__name__)
+
+# The header must start within the first 1024 bytes and the %%EOF marker
+# must be within the last 1024 bytes of the file (PDF 1.7, annex H)
+PDF_HEADER = b'%PDF-'
+PDF_EOF = b'%%EOF'
+MARKER_WINDOW = 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InvalidPDFError(Exception):
+    """Exception raised when an uploaded file is not a structurally valid PDF."""
+    pass
+
+
+class HashingFileStream:
+    """Writable file that hashes its content and keeps the PDF markers.
+
+    The data goes to a temporary file in ``directory`` so that it can later
+    be moved to its final name with an atomic rename. The temporary file is
+    removed on close unless it was persisted.
+    """
+
+    def __init__(self, directory: str):
+        fd, self.temp_path = tempfile.mkstemp(prefix='.upload_', suffix='.part', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha256 = hashlib.sha256()
+        self._head = b''
+        self._tail = b''
+        self.size = 0
+        self.persisted = False
+
+    def write(self, data: bytes) -> int:
+        self._sha256.update(data)
+        if len(self._head) < MARKER_WINDOW:
+            self._head += data[:MARKER_WINDOW - len(self._head)]
+        self._tail = (self._tail + data[-MARKER_WINDOW:])[-MARKER_WINDOW:]
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name: str):
+        # read, readline, seek, tell, flush... go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    @property
+    def sha256(self) -> str:
+        """Hex digest of everything written so far."""
+        return self._sha256.hexdigest()
+
+    def validate_pdf(self) -> None:
+        """Check the PDF header and trailer markers seen while writing.
+
+        Raises:
+            InvalidPDFError: If the header or the %%EOF marker is missing
+        """
+        if PDF_HEADER not in self._head:
+            raise InvalidPDFError("File does not start with a PDF header")
+        if PDF_EOF not in self._tail:
+            raise InvalidPDFError("File is truncated (missing %%EOF trailer)")
+
+    def persist(self, path: str) -> None:
+        """Move the written data to ``path``."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        os.replace(self.temp_path, path)
+        self.persisted = True
+
+    def close(self) -> None:
+        self._file.close()
+        if not self.persisted:
+            try:
+                os.unlink(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    """Request class that streams uploaded files into the upload folder."""
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None) -> IO[bytes]:
+        return HashingFileStream(current_app.config['UPLOAD_FOLDER'])
+
+
+def save_upload(file: FileStorage, path: str) -> HashingFileStream:
+    """Validate an uploaded PDF and store it at ``path``.
+
+    Files parsed by :class:`UploadRequest` are already on disk and only need
+    to be renamed. Other streams are copied in chunks through a
+    :class:`HashingFileStream` so they get the same checks.
+
+    Args:
+        file: Uploaded file from ``request.files``
+        path: Final location of the file
+
+    Returns:
+        The stream holding the digest and size of the upload
+
+    Raises:
+        InvalidPDFError: If the file is not a structurally valid PDF
+    """
+    stream = file.stream
+    if not isinstance(stream, HashingFileStream):
+        stream = HashingFileStream(os.path.dirname(path))
+        try:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                stream.write(chunk)
+        except Exception:
+            stream.close()
+            raise
+
+    try:
+        stream.validate_pdf()
+        stream.persist(path)
+    finally:
+        if stream is not file.stream:
+            stream.close()
+    logger.debug(f"Stored upload {path} ({stream.size} bytes, sha256 {stream.sha256})")
+    return stream
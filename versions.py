@@ -0,0 +1,184 @@
+"""Template versions.
+
+Uploading a file as a new version of a template creates a new
+``PDFTemplate`` row pointing at the version it supersedes
+(``supersedes_id``). Filled forms keep pointing at the version they were
+filled from, and each version has its own compiled schema, so replacing a
+template leaves the cached schemas of other versions and templates alone.
+The previous version is marked ``superseded_at`` once the new one is ready
+and is then hidden from the template list.
+
+The fields of the new version are diffed against the previous version:
+fields whose name, type and options are unchanged are copied with
+``INSERT ... SELECT`` runs in document order, and only added or changed
+fields are inserted from the extraction. A file with the same digest as the
+previous version is not extracted at all; all its fields are copied.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, insert, literal, select
+
+logger = logging.getLogger(__name__)
+
+# Longest supersedes chain followed, against reference cycles
+MAX_VERSIONS = 1000
+
+Spec = Tuple[str, str, List[str]]
+
+
+def history(template) -> List:
+    """Return ``template`` and the versions it supersedes, newest first."""
+    from app import db
+    from models import PDFTemplate
+
+    versions = [template]
+    while versions[-1].supersedes_id is not None and len(versions) < MAX_VERSIONS:
+        previous = db.session.get(PDFTemplate, versions[-1].supersedes_id)
+        if previous is None:
+            break
+        versions.append(previous)
+    return versions
+
+
+def latest(template):
+    """Return the newest ready version superseding ``template``, or ``template`` itself."""
+    from models import PDFTemplate
+
+    seen = {template.id}
+    while template.superseded_at is not None:
+        newer = PDFTemplate.query.filter_by(supersedes_id=template.id, deleted_at=None).order_by(
+            PDFTemplate.id.desc()).first()
+        if newer is None or newer.id in seen:
+            break
+        seen.add(newer.id)
+        template = newer
+    return template
+
+
+def _copy_fields(source_id: int, target_id: int, first_id: Optional[int] = None,
+                 last_id: Optional[int] = None) -> None:
+    """Copy the fields of ``source_id`` with ids in [first_id, last_id] to ``target_id``."""
+    from app import db
+    from models import FormField
+
+    query = (
+        select(literal(target_id), FormField.field_name, FormField.field_type, FormField.options,
+               literal(datetime.utcnow()))
+        .where(FormField.template_id == source_id)
+        .order_by(FormField.id)
+    )
+    if first_id is not None:
+        query = query.where(FormField.id.between(first_id, last_id))
+    db.session.execute(insert(FormField).from_select(
+        ['template_id', 'field_name', 'field_type', 'options', 'created_at'], query
+    ))
+
+
+def _insert_fields(target_id: int, specs: Sequence[Spec]) -> None:
+    from app import db
+    from models import FormField
+
+    now = datetime.utcnow()
+    db.session.execute(insert(FormField), [
+        {'template_id': target_id, 'field_name': name, 'field_type': field_type,
+         'options': json.dumps(list(options)) if options else None, 'created_at': now}
+        for name, field_type, options in specs
+    ])
+
+
+def copy_all_fields(template, previous) -> int:
+    """Give ``template`` the fields of ``previous`` with a single INSERT ... SELECT.
+
+    Returns:
+        Number of fields copied
+    """
+    from app import db
+    from models import FormField
+
+    db.session.execute(delete(FormField).where(FormField.template_id == template.id))
+    _copy_fields(previous.id, template.id)
+    template.field_changes = json.dumps({'added': [], 'removed': [], 'changed': []})
+    return db.session.query(FormField).filter_by(template_id=template.id).count()
+
+
+def store_fields(template, specs: Sequence[Spec]) -> Dict[str, List[str]]:
+    """Replace the fields of ``template`` with the extracted ``specs``.
+
+    Without a previous version all fields are inserted. Otherwise unchanged
+    fields are copied from the previous version in runs of consecutive rows
+    and only the others are inserted, and the differences are stored in
+    ``template.field_changes``. Does not commit.
+
+    Args:
+        template: PDFTemplate being extracted
+        specs: (name, type, options) of its fields in document order
+
+    Returns:
+        Names of the added, removed and changed fields
+    """
+    from app import db
+    from models import PDFTemplate, FormField
+
+    db.session.execute(delete(FormField).where(FormField.template_id == template.id))
+    previous = db.session.get(PDFTemplate, template.supersedes_id) if template.supersedes_id else None
+    if previous is None:
+        _insert_fields(template.id, specs)
+        return {'added': [name for name, _, _ in specs], 'removed': [], 'changed': []}
+
+    old_rows = db.session.execute(
+        select(FormField.id, FormField.field_name, FormField.field_type, FormField.options)
+        .where(FormField.template_id == previous.id)
+        .order_by(FormField.id)
+    ).all()
+    old_index = {row.field_name: i for i, row in enumerate(old_rows)}
+
+    # Runs in document order: ('copy', first old index, last old index) or ('insert', specs)
+    runs = []
+    changes = {'added': [], 'removed': [], 'changed': []}
+    for name, field_type, options in specs:
+        i = old_index.get(name)
+        if i is not None:
+            old = old_rows[i]
+            if (old.field_type or 'text', json.loads(old.options) if old.options else []) == (field_type, list(options)):
+                if runs and runs[-1][0] == 'copy' and runs[-1][2] == i - 1:
+                    runs[-1][2] = i
+                else:
+                    runs.append(['copy', i, i])
+                continue
+            changes['changed'].append(name)
+        else:
+            changes['added'].append(name)
+        if runs and runs[-1][0] == 'insert':
+            runs[-1][1].append((name, field_type, options))
+        else:
+            runs.append(['insert', [(name, field_type, options)]])
+    names = {name for name, _, _ in specs}
+    changes['removed'] = [row.field_name for row in old_rows if row.field_name not in names]
+
+    for run in runs:
+        if run[0] == 'copy':
+            _copy_fields(previous.id, template.id, old_rows[run[1]].id, old_rows[run[2]].id)
+        else:
+            _insert_fields(template.id, run[1])
+    template.field_changes = json.dumps(changes)
+    logger.info(
+        f"Template {template.id} v{template.version}: {len(specs) - len(changes['added']) - len(changes['changed'])} "
+        f"fields copied from v{previous.version} in {sum(1 for run in runs if run[0] == 'copy')} runs, "
+        f"{len(changes['added'])} added, {len(changes['changed'])} changed, {len(changes['removed'])} removed"
+    )
+    return changes
+
+
+def mark_superseded(template) -> None:
+    """Hide the version ``template`` supersedes from the template list. Does not commit."""
+    from app import db
+    from models import PDFTemplate
+
+    if template.supersedes_id is not None:
+        db.session.query(PDFTemplate).filter_by(id=template.supersedes_id, superseded_at=None).update(
+            {PDFTemplate.superseded_at: datetime.utcnow()}, synchronize_session=False
+        )
@@ -0,0 +1,200 @@
+"""Warm-up of hot templates when a process starts.
+
+After a deploy or a worker recycle, the first fill of every template pays
+for parsing it and the first preview pays for starting poppler and loading
+its fonts. Warm-up does that work ahead of traffic, in a background thread:
+it parses the ``WARMUP_TEMPLATES`` templates with the most filled forms over
+the last ``WARMUP_LOOKBACK_DAYS`` into the fill cache
+(:func:`pdf_processor.preload_template`), then renders one of them to warm
+up poppler. With ``PREVIEW_MODE=composite``, it renders the first page of
+each of them into the preview cache instead
+(:func:`pdf_processor.preload_preview_background`). It stops once ``WARMUP_BUDGET_SECONDS`` have passed and reports
+how long it took in the log and as ``warmup_seconds`` on ``/metrics``.
+
+Web processes warm up when the app is created. Under gunicorn,
+``gunicorn.conf.py`` defers warm-up to ``post_fork`` instead, so every worker
+warms its own cache; threads started in the master before forking would not
+survive into the workers.
+
+With ``WARMUP_SHARED``, ``gunicorn.conf.py`` preloads the app and warms up
+once in the master instead (:func:`preload_shared`). Workers forked afterwards
+share the parsed templates copy-on-write, so the memory they take does not
+grow with the number of workers. ``gc.freeze()`` moves everything allocated
+so far out of reach of the garbage collector, whose passes would otherwise
+write to every object and copy the pages holding them into each worker.
+"""
+
+import gc
+import logging
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from flask import Flask
+from sqlalchemy import func, select
+
+import metrics
+import pdf_processor
+import storage
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app: Flask) -> None:
+    """Read the warm-up settings for ``app``.
+
+    Reads ``WARMUP_TEMPLATES`` (templates preloaded, 0 disables warm-up),
+    ``WARMUP_LOOKBACK_DAYS``, ``WARMUP_BUDGET_SECONDS``, ``WARMUP_RENDER``
+    (warm up poppler too), ``WARMUP_DEFERRED`` (set by ``gunicorn.conf.py``
+    so that :func:`start` is only called in ``post_fork``) and
+    ``WARMUP_SHARED`` (warm up in the gunicorn master, see
+    :func:`preload_shared`).
+    """
+    app.config.setdefault('WARMUP_TEMPLATES', int(os.environ.get('WARMUP_TEMPLATES', '10')))
+    app.config.setdefault('WARMUP_LOOKBACK_DAYS', float(os.environ.get('WARMUP_LOOKBACK_DAYS', '7')))
+    app.config.setdefault('WARMUP_BUDGET_SECONDS', float(os.environ.get('WARMUP_BUDGET_SECONDS', '30')))
+    app.config.setdefault('WARMUP_RENDER', os.environ.get('WARMUP_RENDER', 'true').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('WARMUP_DEFERRED', os.environ.get('WARMUP_DEFERRED', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('WARMUP_SHARED', os.environ.get('WARMUP_SHARED', '').lower() in ('1', 'true', 'yes'))
+
+
+@dataclass
+class WarmupResult:
+    """Outcome of a warm-up."""
+
+    templates: int = 0
+    rendered: bool = False
+    seconds: float = 0.0
+    out_of_budget: bool = False
+
+
+def hot_templates(limit: int, lookback_days: float) -> List:
+    """Return the ready templates with the most filled forms in the lookback window.
+
+    Must run inside an app context.
+    """
+    from app import db
+    from models import PDFTemplate, FilledForm
+
+    since = datetime.utcnow() - timedelta(days=lookback_days)
+    fills = func.count(FilledForm.id).label('fills')
+    ranked = (
+        select(FilledForm.template_id, fills)
+        .where(FilledForm.created_at >= since, FilledForm.deleted_at.is_(None))
+        .group_by(FilledForm.template_id)
+        .order_by(fills.desc())
+        .subquery()
+    )
+    return db.session.execute(
+        select(PDFTemplate)
+        .join(ranked, ranked.c.template_id == PDFTemplate.id)
+        .where(PDFTemplate.deleted_at.is_(None), PDFTemplate.superseded_at.is_(None),
+               PDFTemplate.status == PDFTemplate.STATUS_READY)
+        .order_by(ranked.c.fills.desc())
+        .limit(limit)
+    ).scalars().all()
+
+
+def run(limit: int, lookback_days: float, budget_seconds: float, render: bool = True) -> WarmupResult:
+    """Preload the hot templates and warm up poppler within a time budget.
+
+    Must run inside an app context.
+    """
+    result = WarmupResult()
+    started = time.monotonic()
+    deadline = started + budget_seconds
+    paths = [template.file_path for template in hot_templates(limit, lookback_days)]
+
+    for path in paths:
+        if time.monotonic() >= deadline:
+            result.out_of_budget = True
+            break
+        try:
+            if not storage.fetch(path):
+                continue
+            pdf_processor.preload_template(path)
+            result.templates += 1
+        except Exception as e:
+            logger.warning(f"Could not preload template {path}: {str(e)}")
+            continue
+        if render and pdf_processor.PREVIEW_MODE == 'composite':
+            # Composite previews of the template's forms then skip poppler
+            try:
+                result.rendered = pdf_processor.preload_preview_background(path) or result.rendered
+            except Exception as e:
+                logger.warning(f"Could not render preview background of {path}: {str(e)}")
+
+    if render and paths and not result.rendered and not result.out_of_budget and time.monotonic() < deadline:
+        # The first poppler run of a process loads fonts and shared libraries
+        with tempfile.TemporaryDirectory(prefix='warmup_') as scratch:
+            try:
+                pdf_processor.convert_pdf_to_png(paths[0], os.path.join(scratch, 'warmup.png'))
+                result.rendered = True
+            except Exception as e:
+                logger.warning(f"Could not warm up rendering: {str(e)}")
+
+    result.seconds = time.monotonic() - started
+    metrics.WARMUP_SECONDS.set(result.seconds)
+    metrics.WARMUP_TEMPLATES.set(result.templates)
+    logger.info(
+        f"Warm-up preloaded {result.templates} of {len(paths)} templates"
+        f"{', rendered a preview' if result.rendered else ''} in {result.seconds:.2f}s"
+        f"{' (budget exhausted)' if result.out_of_budget else ''}"
+    )
+    return result
+
+
+def start(app: Flask) -> Optional[threading.Thread]:
+    """Warm up in a background thread, unless ``WARMUP_TEMPLATES`` is 0.
+
+    Returns:
+        The warm-up thread, or None if warm-up is disabled
+    """
+    config = app.config
+    if config['WARMUP_TEMPLATES'] <= 0:
+        return None
+
+    def target():
+        with app.app_context():
+            try:
+                run(config['WARMUP_TEMPLATES'], config['WARMUP_LOOKBACK_DAYS'],
+                    config['WARMUP_BUDGET_SECONDS'], config['WARMUP_RENDER'])
+            except Exception as e:
+                logger.error(f"Warm-up failed: {str(e)}", exc_info=True)
+
+    thread = threading.Thread(target=target, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def preload_shared(app: Flask) -> Optional[WarmupResult]:
+    """Warm up in the current process before it forks workers.
+
+    Runs the warm-up synchronously, closes the database connections so that
+    no worker inherits them, and freezes the garbage collector's view of
+    the objects allocated so far (``gc.freeze()``) so that collections in
+    the workers leave the shared pages alone.
+
+    Returns:
+        The warm-up result, or None if warm-up is disabled
+    """
+    from app import db
+
+    config = app.config
+    result = None
+    with app.app_context():
+        if config['WARMUP_TEMPLATES'] > 0:
+            try:
+                result = run(config['WARMUP_TEMPLATES'], config['WARMUP_LOOKBACK_DAYS'],
+                             config['WARMUP_BUDGET_SECONDS'], config['WARMUP_RENDER'])
+            except Exception as e:
+                logger.error(f"Warm-up failed: {str(e)}", exc_info=True)
+        db.engine.dispose()
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Froze {gc.get_freeze_count()} objects before forking workers")
+    return result
@@ -0,0 +1,525 @@
+"""Fill and render jobs coordinated through the database.
+
+``jobs`` runs work in the pool of the process that submitted it. Jobs in
+this module are rows of the ``job`` table instead, so a worker on any node
+can run them and fill throughput scales by adding worker processes
+(``flask worker``).
+
+A worker claims a job by taking a lease on its row. On PostgreSQL and MySQL
+candidate rows are locked with ``SELECT ... FOR UPDATE SKIP LOCKED``, so
+concurrent workers skip each other's rows instead of waiting. SQLite has no
+row locks; there each claim is a compare-and-set ``UPDATE ... WHERE status =
+'queued'``, which succeeds for exactly one worker since SQLite serializes
+writes. While a job runs, the worker renews its leases with heartbeats.
+Jobs whose lease expires are requeued, or failed after ``max_attempts``.
+
+Every state change after the claim is conditional on the lease owner, so a
+worker that lost its lease cannot complete or fail a job another worker has
+claimed since. Handlers leave their database changes uncommitted: the worker
+commits them in the transaction that completes the job, and rolls them back
+if the lease was lost, so a job that was requeued and claimed again does not
+mark its form ready or queue its render twice. Jobs run at least once: handlers must be idempotent, which
+the fill and render handlers are since they replace their output files
+atomically.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import select, update
+
+import metrics
+import storage
+
+logger = logging.getLogger(__name__)
+
+MODES = ('inline', 'queue')
+# Dialects supporting SELECT ... FOR UPDATE SKIP LOCKED
+SKIP_LOCKED_DIALECTS = ('postgresql', 'mysql', 'mariadb')
+# Seconds to wait before retry N is 2 ** (N - 1) * this value
+RETRY_BACKOFF_SECONDS = 2.0
+# Expired leases released per check
+REQUEUE_BATCH_SIZE = 100
+
+# Queue name -> (handler, failure hook), see :func:`handler`
+HANDLERS: Dict[str, tuple] = {}
+
+
+def init_app(app: Flask) -> None:
+    """Read the job settings for ``app``.
+
+    Reads ``FILL_MODE`` and ``RENDER_MODE`` (``inline`` to fill or render
+    within the request, ``queue`` to leave it to workers),
+    ``JOB_LEASE_SECONDS``, ``JOB_HEARTBEAT_SECONDS``, ``JOB_MAX_ATTEMPTS``,
+    ``JOB_POLL_SECONDS`` (idle wait between claims) and
+    ``JOB_WORKER_THREADS`` (workers started in each web process, 0 to rely
+    on ``flask worker``).
+    """
+    for name in ('FILL_MODE', 'RENDER_MODE'):
+        mode = os.environ.get(name, 'inline').strip().lower()
+        if mode not in MODES:
+            logger.warning(f"Unknown {name} {mode!r}, using inline")
+            mode = 'inline'
+        app.config.setdefault(name, mode)
+    app.config.setdefault('JOB_LEASE_SECONDS', int(os.environ.get('JOB_LEASE_SECONDS', '60')))
+    app.config.setdefault('JOB_HEARTBEAT_SECONDS',
+                          float(os.environ.get('JOB_HEARTBEAT_SECONDS', app.config['JOB_LEASE_SECONDS'] / 3)))
+    app.config.setdefault('JOB_MAX_ATTEMPTS', int(os.environ.get('JOB_MAX_ATTEMPTS', '3')))
+    app.config.setdefault('JOB_POLL_SECONDS', float(os.environ.get('JOB_POLL_SECONDS', '1')))
+    app.config.setdefault('JOB_WORKER_THREADS', int(os.environ.get('JOB_WORKER_THREADS', '0')))
+
+
+def start_workers(app: Flask) -> Optional[threading.Thread]:
+    """Start an embedded worker in a daemon thread if ``JOB_WORKER_THREADS`` is set.
+
+    Call once the tables exist.
+
+    Returns:
+        The worker thread, or None
+    """
+    if app.config['JOB_WORKER_THREADS'] <= 0:
+        return None
+    worker = Worker(app, list(HANDLERS), concurrency=app.config['JOB_WORKER_THREADS'])
+    thread = threading.Thread(target=worker.run, name='job-worker', daemon=True)
+    thread.start()
+    return thread
+
+
+def handler(queue: str, on_failure: Optional[Callable[[dict, str], None]] = None) -> Callable:
+    """Register the decorated function as the handler of ``queue``.
+
+    Args:
+        queue: Queue name
+        on_failure: Called with the payload and error message when a job of
+            this queue fails for good
+
+    Handlers must not commit: their changes are committed with the
+    completion of the job, only while the worker still holds its lease.
+    """
+    def register(func: Callable[[dict], None]) -> Callable[[dict], None]:
+        HANDLERS[queue] = (func, on_failure)
+        return func
+    return register
+
+
+def enqueue(queue: str, payload: dict, max_attempts: Optional[int] = None):
+    """Add a job to the session; it is queued when the caller commits.
+
+    Adding the job in the caller's transaction means the job exists if and
+    only if the rows it refers to were committed.
+
+    Returns:
+        The new Job
+    """
+    from app import db
+    from models import Job
+
+    job = Job(
+        queue=queue,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts or current_app.config['JOB_MAX_ATTEMPTS'],
+        run_after=datetime.utcnow(),
+    )
+    db.session.add(job)
+    return job
+
+
+def claim(owner: str, queues: Iterable[str], limit: int = 1, lease_seconds: Optional[int] = None) -> List:
+    """Take leases on up to ``limit`` due jobs of ``queues``.
+
+    Must run inside an app context.
+
+    Args:
+        owner: Unique name of the claiming worker
+        queues: Queues to take jobs from
+        limit: Most jobs to claim
+        lease_seconds: Lease length, defaults to ``JOB_LEASE_SECONDS``
+
+    Returns:
+        The claimed Jobs, oldest first
+    """
+    from app import db
+    from models import Job
+
+    now = datetime.utcnow()
+    lease = timedelta(seconds=lease_seconds or current_app.config['JOB_LEASE_SECONDS'])
+    claimed_values = dict(
+        status=Job.STATUS_RUNNING,
+        lease_owner=owner,
+        lease_expires_at=now + lease,
+        heartbeat_at=now,
+        attempts=Job.attempts + 1,
+    )
+    due = (
+        select(Job.id)
+        .where(Job.status == Job.STATUS_QUEUED, Job.queue.in_(list(queues)), Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+    )
+
+    if db.engine.dialect.name in SKIP_LOCKED_DIALECTS:
+        ids = db.session.scalars(due.limit(limit).with_for_update(skip_locked=True)).all()
+        if ids:
+            db.session.execute(
+                update(Job).where(Job.id.in_(ids)).values(**claimed_values)
+                .execution_options(synchronize_session=False)
+            )
+    else:
+        # Look at a few extra candidates in case other workers win some of them
+        ids = []
+        for job_id in db.session.scalars(due.limit(limit * 4)).all():
+            result = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == Job.STATUS_QUEUED).values(**claimed_values)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                ids.append(job_id)
+                if len(ids) == limit:
+                    break
+    db.session.commit()
+
+    if not ids:
+        return []
+    jobs = db.session.scalars(select(Job).where(Job.id.in_(ids)).order_by(Job.run_after, Job.id)).all()
+    for job in jobs:
+        metrics.JOBS.inc(queue=job.queue, result='claimed')
+    return jobs
+
+
+def heartbeat(owner: str, job_ids: Iterable[int], lease_seconds: Optional[int] = None) -> int:
+    """Extend the leases ``owner`` holds on ``job_ids``.
+
+    Returns:
+        Number of leases extended; fewer than requested means leases were lost
+    """
+    from app import db
+    from models import Job
+
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    now = datetime.utcnow()
+    lease = timedelta(seconds=lease_seconds or current_app.config['JOB_LEASE_SECONDS'])
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(job_ids), Job.lease_owner == owner, Job.status == Job.STATUS_RUNNING)
+        .values(lease_expires_at=now + lease, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def complete(job_id: int, owner: str) -> bool:
+    """Mark a job done if ``owner`` still holds its lease.
+
+    Pending changes of the session, such as those of the job's handler, are
+    committed in the same transaction, or rolled back with it if the lease
+    was lost.
+
+    Returns:
+        False if the lease was lost to another worker
+    """
+    from app import db
+    from models import Job
+
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.lease_owner == owner, Job.status == Job.STATUS_RUNNING)
+        .values(status=Job.STATUS_DONE, lease_owner=None, lease_expires_at=None,
+                error_message=None, finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+
+def fail(job_id: int, owner: str, error: str, expired_only: bool = False) -> Optional[str]:
+    """Requeue a job with backoff, or fail it after its last attempt.
+
+    Args:
+        job_id: Job to release
+        owner: Worker expected to hold the lease
+        error: Reason, stored on the job
+        expired_only: Only release the job if its lease has expired
+
+    Returns:
+        The new status, or None if ``owner`` does not hold the lease
+    """
+    from app import db
+    from models import Job
+
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return None
+    now = datetime.utcnow()
+    if job.attempts >= job.max_attempts:
+        values = dict(status=Job.STATUS_FAILED, finished_at=now)
+    else:
+        delay = timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (max(job.attempts, 1) - 1))
+        values = dict(status=Job.STATUS_QUEUED, run_after=now + delay)
+
+    conditions = [Job.id == job_id, Job.lease_owner == owner, Job.status == Job.STATUS_RUNNING]
+    if expired_only:
+        conditions.append(Job.lease_expires_at < now)
+    result = db.session.execute(
+        update(Job).where(*conditions)
+        .values(lease_owner=None, lease_expires_at=None, error_message=error, **values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        return None
+
+    status = values['status']
+    metrics.JOBS.inc(queue=job.queue, result='failed' if status == Job.STATUS_FAILED else 'retried')
+    if status == Job.STATUS_FAILED:
+        logger.error(f"Job {job_id} ({job.queue}) failed after {job.attempts} attempts: {error}")
+        on_failure = HANDLERS.get(job.queue, (None, None))[1]
+        if on_failure is not None:
+            try:
+                on_failure(job.get_payload(), error)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failure hook of job {job_id} crashed: {str(e)}", exc_info=True)
+    else:
+        logger.warning(f"Job {job_id} ({job.queue}) attempt {job.attempts} failed: {error}, requeued")
+    return status
+
+
+def requeue_expired() -> int:
+    """Release jobs whose worker stopped renewing the lease.
+
+    Returns:
+        Number of jobs requeued or failed
+    """
+    from app import db
+    from models import Job
+
+    expired = db.session.execute(
+        select(Job.id, Job.lease_owner)
+        .where(Job.status == Job.STATUS_RUNNING, Job.lease_expires_at < datetime.utcnow())
+        .limit(REQUEUE_BATCH_SIZE)
+    ).all()
+    released = 0
+    for job_id, owner in expired:
+        if fail(job_id, owner, f"Lease of {owner} expired", expired_only=True) is not None:
+            released += 1
+    return released
+
+
+class Worker:
+    """Claims and runs jobs of some queues with a pool of threads.
+
+    A heartbeat thread renews the leases of all running jobs every
+    ``JOB_HEARTBEAT_SECONDS``. :meth:`stop` lets running jobs finish.
+    """
+
+    def __init__(self, app: Flask, queues: List[str], concurrency: int = 1, owner: Optional[str] = None):
+        self.app = app
+        self.queues = queues
+        self.concurrency = max(1, concurrency)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._active: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Stop claiming jobs; :meth:`run` returns once running jobs finish."""
+        self._stop.set()
+
+    def run(self, burst: bool = False) -> int:
+        """Claim and run jobs until stopped.
+
+        Args:
+            burst: Return as soon as no job is due
+
+        Returns:
+            Number of jobs run
+        """
+        config = self.app.config
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job')
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+        heartbeat_thread.start()
+        logger.info(f"Worker {self.owner} running {', '.join(self.queues)} jobs with {self.concurrency} threads")
+
+        ran = 0
+        next_requeue = 0.0
+        try:
+            while not self._stop.is_set():
+                with self.app.app_context():
+                    if time.monotonic() >= next_requeue:
+                        requeue_expired()
+                        next_requeue = time.monotonic() + config['JOB_HEARTBEAT_SECONDS']
+                    with self._lock:
+                        free = self.concurrency - len(self._active)
+                    jobs = claim(self.owner, self.queues, limit=free) if free > 0 else []
+                    claimed = [(job.id, job.queue, job.get_payload()) for job in jobs]
+
+                for job_id, queue, payload in claimed:
+                    with self._lock:
+                        self._active[job_id] = queue
+                    executor.submit(self._execute, job_id, queue, payload)
+                ran += len(claimed)
+
+                if not claimed:
+                    with self._lock:
+                        idle = not self._active
+                    if burst and idle:
+                        break
+                    self._stop.wait(config['JOB_POLL_SECONDS'])
+        finally:
+            executor.shutdown(wait=True)
+            self._stop.set()
+        return ran
+
+    def _execute(self, job_id: int, queue: str, payload: dict) -> None:
+        start = time.perf_counter()
+        try:
+            with self.app.app_context():
+                from app import db
+
+                func = HANDLERS[queue][0]
+                try:
+                    func(payload)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f"Job {job_id} ({queue}) raised: {str(e)}", exc_info=True)
+                    fail(job_id, self.owner, str(e))
+                    return
+                if complete(job_id, self.owner):
+                    metrics.JOBS.inc(queue=queue, result='completed')
+                else:
+                    metrics.JOBS.inc(queue=queue, result='lost')
+                    logger.warning(f"Worker {self.owner} lost the lease of job {job_id} before completing it")
+        except Exception as e:
+            logger.error(f"Job {job_id} ({queue}) crashed: {str(e)}", exc_info=True)
+        finally:
+            metrics.JOB_SECONDS.observe(time.perf_counter() - start, queue=queue)
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def _heartbeat_loop(self) -> None:
+        interval = self.app.config['JOB_HEARTBEAT_SECONDS']
+        while not self._stop.wait(interval):
+            with self._lock:
+                job_ids = list(self._active)
+            if not job_ids:
+                continue
+            try:
+                with self.app.app_context():
+                    renewed = heartbeat(self.owner, job_ids)
+                if renewed < len(job_ids):
+                    logger.warning(f"Worker {self.owner} lost {len(job_ids) - renewed} leases")
+            except Exception as e:
+                logger.error(f"Heartbeat of worker {self.owner} failed: {str(e)}", exc_info=True)
+
+
+def _replace_output(produce: Callable[[str], None], path: str) -> None:
+    """Write an output file through ``produce(temp_path)``, then move it into place."""
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        produce(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def render_filled_form(filled_form) -> bool:
+    """Render the PNG preview of a filled form and store it.
+
+    Returns:
+        True if the preview was rendered
+    """
+    import pdf_processor
+    import uploads
+
+    if not storage.fetch(filled_form.pdf_path):
+        raise FileNotFoundError(f"Filled PDF is missing: {filled_form.pdf_path}")
+    template_path = filled_form.template.file_path
+    if pdf_processor.PREVIEW_MODE == 'composite' and not storage.fetch(template_path):
+        # The filled PDF is rendered in full instead
+        template_path = None
+    _replace_output(lambda temp: pdf_processor.render_preview(filled_form.pdf_path, temp, template_path,
+                                                              filled_form.get_data()),
+                    filled_form.png_path)
+    filled_form.png_sha256 = uploads.file_sha256(filled_form.png_path)
+    storage.publish(filled_form.png_path)
+    return True
+
+
+def _mark_form(payload: dict, status: str) -> None:
+    from app import db
+    from models import FilledForm
+
+    filled_form = db.session.get(FilledForm, payload['filled_form_id'])
+    if filled_form is not None:
+        filled_form.status = status
+        db.session.commit()
+
+
+def _fill_failed(payload: dict, error: str) -> None:
+    from models import FilledForm
+    _mark_form(payload, FilledForm.STATUS_FAILED)
+
+
+def _render_failed(payload: dict, error: str) -> None:
+    # The PDF is fine without a preview
+    from models import FilledForm
+    _mark_form(payload, FilledForm.STATUS_READY)
+
+
+@handler('fill', on_failure=_fill_failed)
+def run_fill(payload: dict) -> None:
+    """Fill the PDF of a queued filled form, then render or queue its preview."""
+    from app import db
+    from models import FilledForm
+    import pdf_processor
+    import uploads
+
+    filled_form = db.session.get(FilledForm, payload['filled_form_id'])
+    if filled_form is None or filled_form.deleted_at is not None:
+        return
+    template = filled_form.template
+    if not storage.fetch(template.file_path):
+        raise FileNotFoundError(f"Template file is missing: {template.file_path}")
+
+    _replace_output(lambda temp: pdf_processor.fill_pdf_form(template.file_path, filled_form.get_data(), temp),
+                    filled_form.pdf_path)
+    filled_form.pdf_sha256 = uploads.file_sha256(filled_form.pdf_path)
+    storage.publish(filled_form.pdf_path)
+
+    if current_app.config['RENDER_MODE'] == 'queue':
+        filled_form.status = FilledForm.STATUS_RENDERING
+        enqueue('render', {'filled_form_id': filled_form.id})
+    else:
+        try:
+            render_filled_form(filled_form)
+        except Exception as e:
+            logger.warning(f"Error rendering filled form {filled_form.id}: {str(e)}")
+        filled_form.status = FilledForm.STATUS_READY
+
+
+@handler('render', on_failure=_render_failed)
+def run_render(payload: dict) -> None:
+    """Render the PNG preview of a filled form."""
+    from app import db
+    from models import FilledForm
+
+    filled_form = db.session.get(FilledForm, payload['filled_form_id'])
+    if filled_form is None or filled_form.deleted_at is not None:
+        return
+    render_filled_form(filled_form)
+    filled_form.status = FilledForm.STATUS_READY